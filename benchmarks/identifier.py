@@ -0,0 +1,175 @@
+"""
+Identifier.parse (single pass tokenizer, memoized) vs. the character by
+character port of olap4j's parser it replaces.
+
+    python -m benchmarks.identifier
+"""
+import timeit
+
+from mondrian_rest.identifier import (Identifier, IdentifierBuilder,
+                                      SYNTAX, QUOTING, _parse)
+
+# ported from olap4j
+# https://github.com/olap4j/olap4j/blob/b8eccd85753ffddb66c9d8b7c2cd7de2bd510ce0/src/org/olap4j/impl/IdentifierParser.java
+
+STATE = type('Enum',
+             (),
+             dict(START=0, BEFORE_SEG=1, IN_BRACKET_SEG=2, AFTER_SEG=3, IN_SEG=4))
+
+
+IDENTIFIERS = [
+    '[Date].[Year].[2010]',
+    '[string].[with].[a [bracket]] in it]',
+    'Time.1997.[Q3]',
+    '[Customers].[City].&[San Francisco]&CA&USA.&[cust1234]',
+    '[Date].Year',
+    'ISICrev4.Level 2.Level 2 ES',
+    '[Export Geography].[Region Metropolitana Santiago]',
+]
+
+
+def parse_olap4j(string):
+    """
+    Character by character port of olap4j's parser, which `Identifier.parse`
+    replaced. Note that it never terminates on some inputs (eg: `''` or
+    `[a]b`), so only benchmark it on valid identifiers.
+    """
+    k = len(string)
+
+    pstate = { 'i': 0, 'state': STATE.START, 'start': 0, 'syntax': SYNTAX.NAME }
+
+    ident = IdentifierBuilder()
+
+    def inner():
+
+        c = string[pstate['i']]
+
+        if pstate['state'] in (STATE.START, STATE.BEFORE_SEG):
+            if c == '[':
+                pstate.update({
+                    'i': pstate['i'] + 1,
+                    'start': pstate['i'],
+                    'state': STATE.IN_BRACKET_SEG
+                })
+            elif c == ' ':
+                pstate['i'] += 1
+            elif c in (',', '}', '\0'):
+                return
+            elif c == '.':
+                raise ValueError("Unexpected '.'")
+            elif c == '&':
+                pstate['i'] += 1
+                if pstate['syntax'] != SYNTAX.NAME:
+                    raise ValueError("Unexpected '&'")
+                pstate['syntax'] = SYNTAX.FIRST_KEY
+            else:
+                pstate.update({
+                    'state': STATE.IN_SEG,
+                    'start': pstate['i']
+                })
+
+        elif pstate['state'] == STATE.IN_SEG:
+            if c in (',', ')', '}', '\0'):
+                ident.add_segment(string[pstate['start']:pstate['i']].strip(),
+                                   QUOTING.UNQUOTED,
+                                   pstate['syntax'])
+                pstate['state'] = STATE.AFTER_SEG
+                return
+            elif c == '.':
+                ident.add_segment(string[pstate['start']:pstate['i']].strip(),
+                                   QUOTING.UNQUOTED,
+                                   pstate['syntax'])
+                pstate.update({
+                    'syntax': SYNTAX.NAME,
+                    'state': STATE.BEFORE_SEG,
+                    'i': pstate['i'] + 1
+                })
+            elif c == '&':
+                ident.add_segment(string[pstate['start']:pstate['i']].strip(),
+                                   QUOTING.UNQUOTED,
+                                   pstate['syntax'])
+                pstate.update({
+                    'syntax': SYNTAX.NEXT_KEY,
+                    'state': STATE.BEFORE_SEG,
+                    'i': pstate['i'] + 1
+                })
+
+            else:
+                pstate['i'] += 1
+
+        elif pstate['state'] == STATE.IN_BRACKET_SEG:
+            if c == '\0':
+               raise ValueError("Expected ']', in member identifier %s" % string)
+            if c == ']':
+                if string[pstate['i']+1] == ']':
+                    pstate['i'] += 2
+                    # fall through
+                else:
+                    ident.add_segment(string[pstate['start']:pstate['i']+1].strip().replace(']]', ']'),
+                                       QUOTING.QUOTED,
+                                       pstate['syntax'])
+                    pstate.update({
+                        'i': pstate['i'] + 1,
+                        'state': STATE.AFTER_SEG
+                    })
+            else:
+                pstate['i'] += 1
+        elif pstate['state'] == STATE.AFTER_SEG:
+            if c == ' ':
+                pstate['i'] += 1
+            elif c == '.':
+                pstate.update({
+                    'state': STATE.BEFORE_SEG,
+                    'syntax': SYNTAX.NAME,
+                    'i': pstate['i'] + 1
+                })
+            elif c == '&':
+                pstate['state']= STATE.BEFORE_SEG
+                # Roll the syntax - NAME=>FIRST_KEY=>NEXT_KEY=>NEXT_KEY...
+                if pstate['syntax'] == SYNTAX.NAME:
+                    pstate['syntax'] = SYNTAX.FIRST_KEY
+                else:
+                    pstate['syntax'] = SYNTAX.NEXT_KEY
+                pstate['i'] += 1
+            elif c == '\0':
+                pstate['i'] += 1
+                return
+        else:
+            raise AssertionError("Unexpected state: " + str(pstate))
+
+    # this sucks, but lets me keep the algorithm
+    # close to the original
+    string += '\0'
+    while pstate['i'] < k + 1:
+        inner()
+
+    if pstate['state'] == STATE.START:
+        pass
+    elif pstate['state'] == STATE.BEFORE_SEG:
+        raise ValueError("Expected identifier after '.', in member identifier %s" % string)
+    elif pstate['state'] == STATE.IN_BRACKET_SEG:
+        raise ValueError("Expected ']' in member identifier %s" % string)
+
+    return ident.build()
+
+
+def bench(fn, number):
+    return min(timeit.repeat(lambda: [fn(i) for i in IDENTIFIERS],
+                             number=number, repeat=5)) / number / len(IDENTIFIERS)
+
+
+def main(number=2000):
+    uncached = _parse.__wrapped__
+    results = [
+        ('olap4j state machine', bench(parse_olap4j, number)),
+        ('tokenizer, uncached', bench(lambda s: uncached(Identifier, s), number)),
+        ('Identifier.parse (memoized)', bench(Identifier.parse, number)),
+    ]
+    baseline = results[0][1]
+    for name, t in results:
+        print('%-30s %8.2f us/identifier  %6.1fx' % (name, t * 1e6, baseline / t))
+    return results
+
+
+if __name__ == '__main__':
+    main()
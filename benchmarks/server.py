@@ -0,0 +1,123 @@
+"""
+A local stand-in for a mondrian-rest server, serving one (synthetic) cube,
+to benchmark the client end to end.
+
+    with StubServer(cube, aggregate) as server:
+        MondrianClient(server.url).get_cube(cube['name'])
+"""
+import gzip
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+
+from .synthetic import make_members
+
+
+class StubServer(object):
+    """
+    Serves the schema `cube`, the members of its levels and, for every
+    query to its `aggregate` endpoint, the response `aggregate` (or, if it
+    is callable, `aggregate(query string parameters)`).
+
+    With `compress`, responses are gzipped for clients that accept it.
+    """
+
+    def __init__(self, cube, aggregate, members=100, compress=False):
+        self.cube = cube
+        self.members = members
+        self.compress = compress
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._gzipped = {}
+
+        if callable(aggregate):
+            self._aggregate = lambda params: json.dumps(
+                aggregate(params)).encode('utf-8')
+        else:
+            body = json.dumps(aggregate).encode('utf-8')
+            self._aggregate = lambda params: body
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/' % self._server.server_address[1]
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def respond(self, path, params):
+        """ The (status, body) of the response to a request """
+        name = re.escape(self.cube['name'])
+        if path == '/cubes':
+            return 200, json.dumps({'cubes': [self.cube]}).encode('utf-8')
+        if re.match(r'^/cubes/%s$' % name, path):
+            return 200, json.dumps(self.cube).encode('utf-8')
+        if re.match(r'^/cubes/%s/aggregate$' % name, path):
+            return 200, self._aggregate(params)
+
+        m = re.match(r'^/cubes/%s/dimensions/D(\d+)/levels/D\d+ L(\d+)/members$'
+                     % name, path)
+        if m:
+            members = make_members(int(m.group(1)), int(m.group(2)),
+                                   self.members, parents=False)
+            return 200, json.dumps(members).encode('utf-8')
+
+        return 404, b'{}'
+
+    def gzipped(self, body):
+        """ `body`, gzipped (once per distinct body) """
+        with self._lock:
+            compressed = self._gzipped.get(body)
+        if compressed is None:
+            compressed = gzip.compress(body, compresslevel=6)
+            with self._lock:
+                self._gzipped[body] = compressed
+        return compressed
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                status, body = stub.respond(unquote(url.path),
+                                            parse_qs(url.query))
+                with stub._lock:
+                    stub.requests += 1
+                gzipped = stub.compress and \
+                    'gzip' in self.headers.get('Accept-Encoding', '')
+                if gzipped:
+                    body = stub.gzipped(body)
+
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                if gzipped:
+                    self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
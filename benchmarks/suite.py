@@ -0,0 +1,198 @@
+"""
+Benchmarks of the hot paths of the client, on synthetic data (see
+`benchmarks.synthetic`) and, end to end, against a local stub server.
+
+    python -m benchmarks.suite [--quick] [--output results.json]
+                               [--compare baseline.json]
+
+Results are written as JSON: one entry per benchmark, with its parameters
+and the best and median of its timings, in seconds. With `--compare`, the
+ratio of each best timing to that of a previous run is reported too.
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+import timeit
+from operator import itemgetter
+
+import numpy as np
+import pandas as pd
+
+from mondrian_rest import Aggregation, Cube, Identifier, MondrianClient
+from mondrian_rest.aggregation import parse_properties
+from mondrian_rest.client import CUBE_ATTRS
+from mondrian_rest.decoding import orjson
+from mondrian_rest.identifier import _parse
+
+from .identifier import IDENTIFIERS
+from .server import StubServer
+from .synthetic import make_cube, make_aggregation, property_names
+
+MEASURES = ['M0', 'M1']
+
+# the JSON decoders to compare
+DECODERS = [('json', json.loads)]
+if orjson is not None:
+    DECODERS.append(('orjson', orjson.loads))
+
+
+def timings(fn, repeat, number=1):
+    """ The time per call of `repeat` runs of `number` calls to `fn` """
+    return [t / number for t in timeit.repeat(fn, number=number, repeat=repeat)]
+
+
+def params_for(cube, axes, depth, parents, properties):
+    """ The aggregation parameters matching `make_aggregation` """
+    extra = {'parents': parents}
+    if properties:
+        extra['properties'] = [p for d in range(axes)
+                               for p in property_names(d, depth, properties)]
+    return cube._aggregation_params(
+        ['D%d.D%d L%d' % (d, d, depth) for d in range(axes)], [], MEASURES,
+        extra)
+
+
+def benchmarks(quick=False):
+    """ Yield the (name, parameters, function, repeat) of every benchmark """
+    repeat = 3 if quick else 7
+    members = (40, 250) if quick else (100, 1000)
+    depth = 3
+
+    schema = make_cube(depth=depth, measures=len(MEASURES))
+    cube = Cube(*(itemgetter(*CUBE_ATTRS)(schema) + (None, )))
+
+    uncached = _parse.__wrapped__
+    yield ('Identifier.parse', {'cached': False},
+           lambda: [uncached(Identifier, i) for i in IDENTIFIERS], repeat)
+    yield ('Identifier.parse', {'cached': True},
+           lambda: [Identifier.parse(i) for i in IDENTIFIERS], repeat)
+
+    properties = [p for d in range(3) for p in property_names(d, depth, 3)]
+    yield ('parse_properties', {'properties': len(properties)},
+           lambda: parse_properties(properties), repeat)
+
+    for parents, nproperties in [(False, 0), (True, 0), (True, 2)]:
+        data = make_aggregation(schema, members, depth=depth, sparsity=0.3,
+                                parents=parents, properties=nproperties)
+        params = params_for(cube, len(members), depth, parents, nproperties)
+        info = {'members': list(members), 'cells': int(np.prod(members)),
+                'parents': parents, 'properties': nproperties}
+
+        agg = lambda data=data, params=params: Aggregation(data, cube, None,
+                                                           params)
+        if not parents:
+            yield ('Aggregation.tidy', info, lambda agg=agg: agg().tidy,
+                   repeat)
+        yield ('Aggregation.to_pandas', info,
+               lambda agg=agg: agg().to_pandas(), repeat)
+
+    data = make_aggregation(schema, members, depth=depth, sparsity=0.99)
+    params = params_for(cube, len(members), depth, False, 0)
+    info = {'members': list(members), 'cells': int(np.prod(members)),
+            'sparsity': 0.99}
+    yield ('Aggregation.to_pandas', info,
+           lambda: Aggregation(data, cube, None, params).to_pandas(), repeat)
+    yield ('Aggregation.to_coo', info,
+           lambda: Aggregation(data, cube, None, params).to_coo(), repeat)
+
+    data = make_aggregation(schema, members, depth=depth, sparsity=0.3)
+    params = params_for(cube, len(members), depth, False, 0)
+    for workers in (2, 4):
+        info = {'members': list(members), 'cells': int(np.prod(members)),
+                'workers': workers}
+        yield ('Aggregation.to_pandas', info,
+               lambda workers=workers: Aggregation(
+                   data, cube, None, params).to_pandas(workers=workers),
+               repeat)
+
+    body = json.dumps(data).encode('utf-8')
+    for name, loads in DECODERS:
+        info = {'bytes': len(body), 'decoder': name}
+        yield ('decode', info, lambda loads=loads: loads(body), repeat)
+
+    params = {'drilldown': ['D%d.D%d L%d' % (d, d, depth)
+                            for d in range(len(members))],
+              'measures': MEASURES,
+              'parents': True}
+    for compress in (False, True):
+        with StubServer(schema, data, compress=compress) as server:
+            for name, loads in DECODERS:
+                client = MondrianClient(server.url, json_loads=loads)
+                remote = client.get_cube(schema['name'])
+                info = {'members': list(members),
+                        'cells': int(np.prod(members)),
+                        'gzip': compress, 'decoder': name}
+                yield ('Cube.get_aggregation', info,
+                       lambda remote=remote: remote.get_aggregation(**params),
+                       repeat)
+                yield ('Cube.get_aggregation+to_pandas', info,
+                       lambda remote=remote: remote.get_aggregation(
+                           **params).to_pandas(), repeat)
+                client.close()
+
+
+def run(quick=False, out=sys.stderr):
+    results = []
+    for name, params, fn, repeat in benchmarks(quick):
+        fn()  # warm up
+        ts = timings(fn, repeat)
+        results.append({
+            'name': name,
+            'params': params,
+            'repeat': repeat,
+            'min': min(ts),
+            'median': statistics.median(ts),
+        })
+        out.write('%-34s %-60s %10.3f ms\n' % (
+            name, json.dumps(params, sort_keys=True), min(ts) * 1e3))
+    return results
+
+
+def compare(results, baseline, out=sys.stderr):
+    """ Report the ratio of the timings in `results` to those of the same
+        benchmarks in `baseline` (a previous report) """
+    key = lambda r: (r['name'], json.dumps(r['params'], sort_keys=True))
+    previous = {key(r): r for r in baseline['results']}
+    for r in results:
+        p = previous.get(key(r))
+        if p is not None:
+            r['ratio'] = r['min'] / p['min']
+            out.write('%-34s %-60s %9.2fx\n' % (r['name'] + ':', key(r)[1],
+                                                 r['ratio']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--quick', action='store_true',
+                        help='smaller inputs and fewer repetitions')
+    parser.add_argument('--output', help='write the results (JSON) here')
+    parser.add_argument('--compare',
+                        help='report the change from these results (JSON)')
+    args = parser.parse_args(argv)
+
+    report = {
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'quick': args.quick,
+        'results': run(args.quick),
+    }
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report['results'], json.load(f))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    main()
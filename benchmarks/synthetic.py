@@ -0,0 +1,139 @@
+"""
+Synthetic cube schemas and `aggregate` responses, shaped like the files in
+`mondrian_rest/test_fixtures`, of any size.
+
+Dimension `Dn` has levels `Dn L1`...`Dn Lk` below `(All)`; `D0` is a time
+dimension. The i-th member of a level has, as parent, the (i // `FANOUT`)-th
+member of the level above.
+"""
+import random
+
+FANOUT = 10
+
+
+def make_cube(name='synthetic', dimensions=3, depth=3, measures=2):
+    """ The schema (as served by the `cubes/<name>` endpoint) of a cube with
+        `dimensions` dimensions of `depth` levels and `measures` measures """
+    return {
+        'name': name,
+        'annotations': {},
+        'dimensions': [{
+            'name': 'D%d' % d,
+            'caption': 'D%d' % d,
+            'type': 'time' if d == 0 else 'standard',
+            'annotations': {},
+            'hierarchies': [{
+                'name': 'D%d' % d,
+                'has_all': True,
+                'all_member_name': 'All D%d' % d,
+                'levels': [{
+                    'name': level_name(d, l),
+                    'full_name': '[D%d].[%s]' % (d, level_name(d, l)),
+                    'caption': level_name(d, l)
+                } for l in range(depth + 1)]
+            }]
+        } for d in range(dimensions)],
+        'measures': [{
+            'name': 'M%d' % m,
+            'caption': 'M%d' % m,
+            'annotations': {},
+            'full_name': '[Measures].[M%d]' % m
+        } for m in range(measures)]
+    }
+
+
+def level_name(dimension, depth):
+    return '(All)' if depth == 0 else 'D%d L%d' % (dimension, depth)
+
+
+def make_member(dimension, depth, i, parents=True, properties=0):
+    """ The `i`-th member of level `depth` of dimension `dimension` """
+    name = 'D%d L%d member %d' % (dimension, depth, i)
+    member = {
+        'name': name,
+        'full_name': '[D%d].[%s]' % (dimension, name),
+        'caption': name.title(),
+        'all_member?': False,
+        'drillable?': True,
+        'depth': depth,
+        'key': i if dimension == 0 else 'k%d' % i,
+        'num_children': FANOUT,
+        'parent_name': None,
+        'level_name': level_name(dimension, depth),
+        'properties': {'D%d L%d P%d' % (dimension, depth, p): i
+                       for p in range(properties)}
+    }
+    if parents:
+        member['ancestors'] = [
+            make_member(dimension, a, i // FANOUT**(depth - a), False,
+                        properties)
+            for a in reversed(range(1, depth))
+        ] + [{'name': 'All D%d' % dimension, 'caption': 'All D%d' % dimension,
+              'depth': 0, 'key': 0, 'level_name': '(All)',
+              'all_member?': True, 'properties': {}}]
+    return member
+
+
+def make_members(dimension, depth, members, parents=True, properties=0):
+    """ The response of the `members` endpoint for a level """
+    return {'members': [make_member(dimension, depth, i, parents, properties)
+                        for i in range(members)]}
+
+
+def property_names(dimension, depth, properties):
+    """ The `properties` parameter asking for the properties of a level
+        (and, with `parents`, of its ancestors) """
+    return ['D%d.%s.D%d L%d P%d' % (dimension, level_name(dimension, l),
+                                    dimension, l, p)
+            for l in range(1, depth + 1) for p in range(properties)]
+
+
+def make_aggregation(cube, members=(100, 100), depth=2, sparsity=0.0,
+                     parents=True, properties=0, seed=0):
+    """
+    The response of the `aggregate` endpoint of `cube` drilling down to
+    level `depth` of its first `len(members)` dimensions, which have
+    `members[i]` members each. A fraction `sparsity` of the cells is empty.
+    """
+    rnd = random.Random(seed)
+    measures = cube['measures']
+
+    axes = [{'members': [{
+        'name': m['name'],
+        'full_name': m['full_name'],
+        'caption': m['caption'],
+        'all_member?': False,
+        'drillable?': False,
+        'depth': 0,
+        'key': m['name'],
+        'num_children': 0,
+        'parent_name': None,
+        'ancestors': []
+    } for m in measures]}]
+    axes += [make_members(d, depth, n, parents, properties)
+             for d, n in enumerate(members)]
+
+    axis_dimensions = [{'name': 'Measures', 'caption': 'Measures',
+                        'type': 'measures', 'level': 'MeasuresLevel',
+                        'level_depth': 0}]
+    axis_dimensions += [{'name': 'D%d' % d, 'caption': 'D%d' % d,
+                         'type': 'time' if d == 0 else 'standard',
+                         'level': level_name(d, depth), 'level_depth': depth}
+                        for d in range(len(members))]
+
+    def cell():
+        if rnd.random() < sparsity:
+            return [None] * len(measures)
+        return [round(rnd.random() * 1e6, 2) for _ in measures]
+
+    # nested from the last axis in, measures innermost
+    def values(sizes):
+        if len(sizes) == 0:
+            return cell()
+        return [values(sizes[:-1]) for _ in range(sizes[-1])]
+
+    return {
+        'axes': axes,
+        'axis_dimensions': axis_dimensions,
+        'values': values(list(members))
+    }
@@ -1,3 +1,10 @@
 from mondrian_rest.client import Cube, MondrianClient
-from mondrian_rest.aggregation import Aggregation
+from mondrian_rest.aggregation import Aggregation, StreamingAggregation, FlatAggregation
 from mondrian_rest.identifier import Identifier
+from mondrian_rest.schema import Dimension, Hierarchy, Level, Measure
+from mondrian_rest.transport import Transport, SessionTransport
+from mondrian_rest.cache import AggregationCache, SchemaCache
+from mondrian_rest.members import LevelMembers, MemberCatalog
+from mondrian_rest.async_client import AsyncCube, AsyncMondrianClient
+from mondrian_rest.store import ResultStore
+from mondrian_rest.instrumentation import Instrumentation, LoggingHook, SpanHook
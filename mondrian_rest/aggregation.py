@@ -1,13 +1,20 @@
+import io
+import json
 from functools import reduce as reduce_
-try:
-    from itertools import product, izip, groupby
-except ImportError:
-    izip = zip
+from itertools import chain, product, groupby, islice
 
 import numpy as np
 import pandas as pd
 
 from .identifier import Identifier
+from .instrumentation import instrumentation_of, timed
+from .parallel import typed_values, typed_cells, typed_column
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
 
 
 def parse_properties(properties):
@@ -21,11 +28,11 @@ def parse_properties(properties):
     def reducer(h, it):
         k, v = it
         h[k] = dict(
-            map(lambda jt: (jt[0], map(lambda vv: list(vv)[-1].name, jt[1])),
+            map(lambda jt: (jt[0], [list(vv)[-1].name for vv in jt[1]]),
                 groupby(v, key=lambda s: s.segments[1].name)))
         return h
 
-    return reduce(
+    return reduce_(
         reducer,
         groupby(
             sorted(
@@ -34,27 +41,132 @@ def parse_properties(properties):
             key=lambda s: s[0].name), {})
 
 
-def get_props(row, pnames, props, dimensions):
-    def reducer(h, row):
-        ax_i, member = row
-        dname = dimensions[ax_i]['name']
-        if props.get(dname):
-            mmbr_lvl = dimensions[ax_i]['level']
-            for p in props[dname].get(mmbr_lvl, []):
-                h[p] = member['properties'][p]
-            if member.get('ancestors'):
-                for l, p in filter(lambda it: it[0] != mmbr_lvl,
-                                   props[dname].items()):
-                    anc = next(anc for anc in member['ancestors']
-                               if anc['level_name'] == l)
-                    for prop in p:
-                        h[prop] = anc['properties'][prop]
-
-        return h
-
-    pvalues = reduce(reducer, enumerate(row), {})
+class PropertyPlan(object):
+    """
+    Where each of the requested `properties` comes from: the axis (of
+    `axis_dimensions`, which excludes the measures) and the level of its
+    members (`None`) or of their ancestors that holds it. Resolved once
+    from the query, then applied to the members of each axis with
+    `columns`.
+    """
 
-    return map(lambda pn: pvalues[pn], pnames)
+    def __init__(self, properties, axis_dimensions):
+        props = parse_properties(properties)
+        self.names = [Identifier.parse(p).segments[-1].name for p in properties]
+
+        # when several axes (or levels) hold a property, the last one wins
+        self.sources = {}
+        for j, dd in enumerate(axis_dimensions):
+            dprops = props.get(dd['name'], {})
+            for p in dprops.get(dd['level'], []):
+                self.sources[p] = (j, None)
+            for level, ps in dprops.items():
+                if level != dd['level']:
+                    for p in ps:
+                        self.sources[p] = (j, level)
+
+    def columns(self, members):
+        """ The (name, axis index, per-member values) of every property,
+            given the `members` of each axis. A property not found in any
+            axis has `None` as its axis index (and values). """
+        ancestors = {}
+        columns = []
+        for pn in self.names:
+            if pn not in self.sources:
+                columns.append((pn, None, None))
+                continue
+
+            j, level = self.sources[pn]
+            if level is None:
+                values = [m['properties'][pn] for m in members[j]]
+            else:
+                if j not in ancestors:
+                    ancestors[j] = [ancestor_index(m) for m in members[j]]
+                values = [
+                    idx[level]['properties'][pn] for idx in ancestors[j]
+                ]
+            columns.append((pn, j, values))
+
+        return columns
+
+
+def ancestor_index(member):
+    """ The ancestors of `member`, by level name """
+    return {a['level_name']: a for a in member.get('ancestors', [])}
+
+
+def axis_codes(sizes):
+    """ For the cartesian product of axes with lengths `sizes` (first axis
+        varies slowest, as in `itertools.product`), return one array per
+        axis with the index of that axis' member in every cell. """
+    total = int(np.prod(sizes)) if sizes else 1
+    codes = []
+    for i, size in enumerate(sizes):
+        inner = int(np.prod(sizes[i + 1:])) if i + 1 < len(sizes) else 1
+        outer = total // (size * inner) if size * inner else 0
+        codes.append(
+            np.tile(np.repeat(np.arange(size, dtype=code_dtype(size)), inner),
+                    outer))
+    return codes
+
+
+def code_dtype(n):
+    """ The smallest signed integer dtype holding codes for `n` values
+        (and -1, for missing ones) """
+    return np.min_scalar_type(-max(n, 1))
+
+
+def measure_column(values, has_nulls=False):
+    """ The values of a measure as a typed Series. Filtering out the empty
+        cells of a measure (`has_nulls`) does not change its dtype: integers
+        are still floats, and booleans objects. """
+    column = pd.Series(values).infer_objects()
+    if has_nulls and column.dtype.kind in 'iu':
+        column = column.astype('float64')
+    elif has_nulls and column.dtype.kind == 'b':
+        column = column.astype(object)
+    return column
+
+
+def categorical_level(values, level, nrows):
+    """ The index `level` of the per-member `values` as a CategoricalIndex,
+        and the bytes it saves over a plain column of `nrows` values """
+    level = pd.CategoricalIndex(level)
+
+    # estimated as the average size of a member's value, times the rows
+    plain = values.memory_usage(index=False, deep=True) * nrows \
+        // max(len(values), 1)
+    codes = np.min_scalar_type(-len(level) - 1).itemsize * nrows
+
+    return level, plain - codes - level.memory_usage(deep=True)
+
+
+def flat_values(data):
+    """ The values of every measure of every cell of aggregation `data`, as
+        a flat array in the order of the response """
+    sizes = [len(ax['members']) for ax in data['axes'][1:]]
+    count = int(np.prod(sizes)) * len(data['axes'][0]['members'])
+    if count == 0:
+        return np.empty(0, dtype=object)
+
+    # `values` is nested from the last axis inwards, measures innermost:
+    # flattened, without building intermediate lists
+    flat = data['values']
+    for _ in sizes:
+        flat = chain.from_iterable(flat)
+    return np.fromiter(flat, dtype=object, count=count)
+
+
+def downcast(values):
+    """ `values` (a Series) in the smallest numeric dtype that holds them
+        exactly """
+    if values.dtype.kind in 'iu':
+        return pd.to_numeric(values, downcast='integer')
+    if values.dtype.kind == 'f':
+        narrow = values.astype(np.float32)
+        if ((narrow == values) | values.isnull()).all():
+            return narrow
+    return values
 
 
 class Aggregation(object):
@@ -65,6 +177,7 @@ class Aggregation(object):
         self.url = url
 
         self._tidy = None
+        self._member_columns_cache = None
 
     @property
     def axes(self):
@@ -90,108 +203,433 @@ class Aggregation(object):
         if self._tidy is not None:
             return self._tidy
 
-        data = self._data
-        measures = data['axes'][0]['members']
-        prod = [
-            izip(e['members'], range(len(e['members'])))
-            for e in data['axes'][1:]
-        ]
-        values = data['values']
+        with timed(instrumentation_of(self._cube), 'tidy') as attributes:
+            self._tidy = {
+                'axes': self.axis_dimensions[1:],
+                'measures': self.measures,
+                'data': list(self.iter_rows())
+            }
+            attributes['rows'] = len(self._tidy['data'])
 
-        def build_row(cell):
-            cidxs = list(reversed([c[1] for c in cell]))
+        return self._tidy
+
+    def iter_cells(self):
+        """ Iterate over the (coordinates, measure values) of every cell,
+            with the coordinates (member indexes) in axis order. """
+        values = self.values
+        for cidxs in product(*[range(len(e['members']))
+                               for e in self.axes[1:]]):
+            yield cidxs, reduce_(
+                lambda memo, cur: memo[cur],  # navigate to values[coords]
+                reversed(cidxs),
+                values)
+
+    def iter_rows(self):
+        """ Iterate over the rows of `tidy`, without keeping them around """
+        members = [e['members'] for e in self.axes[1:]]
+        for cidxs, mvalues in self.iter_cells():
+            yield [members[i][c] for i, c in enumerate(cidxs)] + list(mvalues)
+
+    def iter_pandas(self, chunksize, filter_empty_measures=True,
+                    compact=False):
+        """ Iterate over the result as DataFrames (like the one
+            `to_pandas` returns) of up to `chunksize` rows each. """
+        cells = self.iter_cells()
+        while True:
+            chunk = list(islice(cells, chunksize))
+            if len(chunk) == 0:
+                return
+            df = self._cells_to_pandas(chunk, filter_empty_measures, compact)
+            if len(df) > 0:
+                yield df
+
+    def measure_arrays(self):
+        """ Return the cell values as one n-dimensional array per measure,
+            with a dimension for each non-measure axis, in axis order. """
+        sizes = [len(ax['members']) for ax in self.axes[1:]]
+        values = flat_values(self._data).reshape(
+            tuple(reversed(sizes)) + (len(self.measures), ))
+
+        return [values[..., mi].T for mi in range(len(self.measures))]
+
+    def to_coo(self, how='any', workers=None):
+        """
+        The non-empty cells, in the order of `tidy`, as sparse (COO)
+        coordinates: `(codes, values)`, with the index of the member of
+        every cell in each axis (`codes`, one array per non-measure axis)
+        and the values of every measure in those cells (`values`, one array
+        per measure, typed like the columns of `to_pandas`).
+
+        A cell is empty if it has no value for any measure or, with
+        `how='all'`, if it lacks a value for some measure. Only the
+        coordinates of the cells that are kept are ever built.
+
+        With `workers`, values are converted in up to that many processes
+        (see `parallel.typed_values`).
+        """
+        sizes = [len(ax['members']) for ax in self.axes[1:]]
+        nmeasures = len(self.measures)
+
+        # cells come in the order of the response: last axis slowest
+        notnull, column = self._measure_values(workers)
+        keep = notnull.all(axis=1) if how == 'all' else notnull.any(axis=1)
+
+        # find the kept cells in the order of `tidy` (first axis slowest)
+        # on the mask, which takes a byte per cell
+        keep = keep.reshape(tuple(reversed(sizes))).T.ravel()
+        if len(sizes) > 0:
+            coords = np.unravel_index(np.flatnonzero(keep), sizes)
+            positions = np.ravel_multi_index(coords[::-1],
+                                             tuple(reversed(sizes)))
+        else:
+            coords = ()
+            positions = np.flatnonzero(keep)
+        del keep
+        codes = [c.astype(code_dtype(size)) for c, size in zip(coords, sizes)]
+        del coords
+
+        values = [column(mi, positions, not notnull[:, mi].all())
+                  for mi in range(nmeasures)]
+        return codes, values
+
+    def to_pandas(self, filter_empty_measures=True, compact=False,
+                  workers=None):
+        """
+        The result as a DataFrame, with a row per cell, indexed by the keys
+        and captions of its members (and properties) and with a column per
+        measure.
+
+        With `filter_empty_measures`, only the cells with a value for every
+        measure are unrolled (see `to_coo`), so the time and memory it takes
+        grow with the non-empty cells, not with the product of the axes.
+
+        If `compact`, member columns are Categoricals and measures take the
+        smallest dtype that holds them exactly. The bytes saved are in
+        `df.attrs['memory_saved']`.
+
+        With `workers`, the values of the cells are converted in up to that
+        many processes (see `parallel`); the DataFrame is the same. Only
+        worth it for results of millions of cells with idle cores: on a
+        single core, or for smaller results, it's no faster.
+        """
+        with timed(instrumentation_of(self._cube), 'to_pandas') as attributes:
+            if filter_empty_measures:
+                codes, mvalues = self.to_coo(how='all', workers=workers)
+            else:
+                # every cell of the cartesian product of the axes, in order
+                codes = axis_codes([len(e['members']) for e in self.axes[1:]])
+                mvalues = self._all_cells(workers)
+
+            df = self._build_frame(codes, mvalues, False, compact)
+            attributes['rows'] = len(df)
+        return df
 
-            cm = [c[0] for c in cell]
+    def _measure_values(self, workers=None):
+        """
+        The values of every cell, in the order of the response: `(notnull,
+        column)`, with which cells have a value for each measure (an array
+        of shape (cells, measures)) and a function returning the typed
+        values of a measure in some of the cells, given their positions
+        and whether the measure has empty cells.
+        """
+        nmeasures = len(self.measures)
+        typed = typed_values(self._data, workers) \
+            if workers and workers > 1 else None
+        if typed is not None:
+            bits, kinds = typed
+            return kinds != 0, lambda mi, positions, has_nulls: typed_column(
+                bits[positions, mi], kinds[positions, mi], has_nulls)
+
+        flat = flat_values(self._data).reshape(-1, nmeasures)
+        return pd.notnull(flat), lambda mi, positions, has_nulls: \
+            measure_column(flat[positions, mi], has_nulls).to_numpy()
+
+    def _all_cells(self, workers=None):
+        """ The values of every measure in every cell, in the order of
+            `tidy` """
+        if not workers or workers <= 1:
+            return [mv.ravel() for mv in self.measure_arrays()]
+
+        sizes = [len(ax['members']) for ax in self.axes[1:]]
+        _, column = self._measure_values(workers)
+        positions = np.arange(int(np.prod(sizes))) \
+            .reshape(tuple(reversed(sizes))).T.ravel()
+        return [column(mi, positions, False)
+                for mi in range(len(self.measures))]
+
+    def to_arrow(self, filter_empty_measures=True, workers=None):
+        """
+        The result as a `pyarrow.Table` with the columns of
+        `to_pandas().reset_index()`. Member columns are dictionary-encoded,
+        built straight from the members of each axis. `workers` is as in
+        `to_pandas`.
+        """
+        if pa is None:
+            raise ImportError(
+                'to_arrow requires pyarrow (pip install mondrian-rest[arrow])')
 
+        if filter_empty_measures:
+            codes, mvalues = self.to_coo(how='all', workers=workers)
+        else:
+            codes = axis_codes([len(e['members']) for e in self.axes[1:]])
+            mvalues = self._all_cells(workers)
+
+        names = []
+        arrays = []
+        for name, j, values in self._member_columns():
+            if j is None:
+                if len(mvalues) > 0 and len(mvalues[0]) > 0:
+                    raise KeyError(name)
+                array = pa.array([], type=pa.null())
+            else:
+                member_codes, categories = pd.factorize(values)
+                indices = member_codes.take(codes[j])
+                array = pa.DictionaryArray.from_arrays(
+                    pa.array(indices, mask=indices < 0, type=pa.int32()),
+                    pa.array(np.asarray(categories, dtype=object),
+                             from_pandas=True))
+            names.append(name)
+            arrays.append(array)
+
+        names += [m['caption'] for m in self._agg_params['measures']]
+        arrays += [pa.array(pd.Series(mv).infer_objects(), from_pandas=True)
+                   for mv in mvalues]
+
+        return pa.Table.from_arrays(arrays, names=names)
+
+    def to_parquet(self, path, filter_empty_measures=True, workers=None,
+                   **kwargs):
+        """ Write `to_arrow` to the Parquet file at `path` (`kwargs` go to
+            `pyarrow.parquet.write_table`) """
+        pq.write_table(self.to_arrow(filter_empty_measures, workers), path,
+                       **kwargs)
+
+    def _cells_to_pandas(self, cells, filter_empty_measures, compact=False,
+                         workers=None):
+        """ Build a DataFrame from a list of `iter_cells` items """
+        codes = [
+            np.array([c[0][i] for c in cells], dtype=np.intp)
+            for i in range(len(self.axes) - 1)
+        ]
+        typed = typed_cells(cells, len(self.measures), workers) \
+            if workers and workers > 1 else None
+        if typed is not None:
+            bits, kinds = typed
+            mvalues = [typed_column(bits[:, mi], kinds[:, mi])
+                       for mi in range(len(self.measures))]
+        else:
             mvalues = [
-                reduce_(
-                    lambda memo, cur: memo[cur],  # navigate to values[coords]
-                    cidxs + [mi],
-                    values) for mi, m in enumerate(measures)
+                np.array([c[1][mi] for c in cells], dtype=object)
+                for mi in range(len(self.measures))
             ]
 
-            return cm + mvalues
+        return self._build_frame(codes, mvalues, filter_empty_measures,
+                                 compact)
 
-        self._tidy = {
-            'axes': data['axis_dimensions'][1:],
-            'measures': measures,
-            'data': [build_row(cell) for cell in product(*prod)]
-        }
+    def _member_columns(self):
+        """
+        The (name, axis index, per-member values) of the columns that come
+        from the members of each axis: their keys and captions (and those
+        of their ancestors, with `parents`) and their properties.
 
-        return self._tidy
+        Built once per aggregation; a property not found in any axis has
+        `None` as its axis index.
+        """
+        if self._member_columns_cache is not None:
+            return self._member_columns_cache
 
-    def to_pandas(self, filter_empty_measures=True):
-        tidy = self.tidy
-        columns = []
-        table = []
-        properties = self._agg_params.get('properties', [])
-        measures = self._agg_params['measures']
+        axes = self.axis_dimensions[1:]
+        members = [ax['members'] for ax in self.axes[1:]]
 
-        props = parse_properties(properties)
-        pnames = [Identifier.parse(i).segments[-1].name for i in properties]
-
-        # header row
-        if self._agg_params['parents']:
-            slices = []
-            for dd in tidy['axes']:
-                slices.append(dd['level_depth'])
-                for ancestor_level in self._cube.dimensions_by_name[dd[
-                        'name']]['hierarchies'][0]['levels'][1:dd[
-                            'level_depth']]:
+        columns = []
+        for j, (dd, mm) in enumerate(zip(axes, members)):
+            if self._agg_params.get('parents'):
+                depth = dd['level_depth']
+                ancestor_levels = self._cube.dimensions_by_name[
+                    dd['name']].hierarchies[0].levels[1:depth]
+                # `ancestors` go from the closest one up to the root
+                for ancestor_level, a in zip(ancestor_levels,
+                                             reversed(range(depth - 1))):
                     columns += [
-                        'ID %s' % ancestor_level['caption'],
-                        ancestor_level['caption']
+                        ('ID %s' % ancestor_level['caption'], j,
+                         pd.Series([m['ancestors'][a]['key'] for m in mm])),
+                        (ancestor_level['caption'], j,
+                         pd.Series([m['ancestors'][a]['caption'] for m in mm]))
                     ]
-                columns += ['ID %s' % dd['level'], dd['level']]
 
-            # property names
-            columns += pnames
+            columns += [
+                ('ID %s' % dd['level'], j, pd.Series([m['key'] for m in mm])),
+                (dd['level'], j, pd.Series([m['caption'] for m in mm]))
+            ]
+
+        plan = PropertyPlan(self._agg_params.get('properties', []), axes)
+        columns += [(pn, j, values if j is None else pd.Series(values))
+                    for pn, j, values in plan.columns(members)]
+
+        self._member_columns_cache = columns
+        return columns
+
+    def _build_frame(self, codes, mvalues, filter_empty_measures,
+                     compact=False):
+        """ Build a DataFrame from the per-axis member `codes` and the
+            per-measure `mvalues` of a sequence of cells. The index is built
+            straight from the members of each axis and `codes`, without
+            expanding the members to a value per cell. """
+        measures = self._agg_params['measures']
+        saved = 0
+
+        # `mvalues` is consumed: each array of Python objects is dropped as
+        # soon as its typed column is built
+        table = []
+        while len(mvalues) > 0:
+            table.append(pd.Series(mvalues.pop(0)).infer_objects())
+        if filter_empty_measures and len(table) > 0:
+            keep = reduce_(np.logical_and,
+                           [column.notnull().to_numpy() for column in table])
+            if not keep.all():
+                table = [column[keep].reset_index(drop=True)
+                         for column in table]
+                codes = [c[keep] for c in codes]
+            del keep
+        nrows = len(table[0]) if len(table) > 0 else 0
+
+        if compact:
+            for i, column in enumerate(table):
+                table[i] = downcast(column)
+                saved += column.memory_usage(index=False, deep=True) \
+                    - table[i].memory_usage(index=False, deep=True)
+
+        # one index level per member column
+        names = []
+        levels = []
+        level_codes = []
+        for name, j, values in self._member_columns():
+            if j is None:
+                if nrows > 0:
+                    raise KeyError(name)
+                level = pd.Index([], dtype=object)
+                cell_codes = np.empty(0, dtype=np.intp)
+            else:
+                member_codes, level = pd.factorize(values)
+                if len(level) == len(values):
+                    # one distinct value per member, in member order: the
+                    # cells share the codes of their axis
+                    cell_codes = codes[j]
+                else:
+                    cell_codes = member_codes.astype(
+                        code_dtype(len(level))).take(codes[j])
+                if compact:
+                    level, level_saved = categorical_level(values, level,
+                                                           nrows)
+                    saved += level_saved
+            names.append(name)
+            levels.append(level)
+            level_codes.append(cell_codes)
+
+        df = pd.DataFrame(dict(enumerate(table)))
+        df.columns = [m['caption'] for m in measures]
+        if len(names) > 0:
+            df.index = pd.MultiIndex(levels=levels, codes=level_codes,
+                                     names=names, verify_integrity=False)
+
+        if compact:
+            df.attrs['memory_saved'] = int(saved)
+
+        return df
+
+
+class StreamingAggregation(Aggregation):
+    """ An aggregation whose cells are decoded from the HTTP response as they
+        are iterated, instead of being loaded all at once. It can only be
+        iterated once, and cells come in the order of the response (with the
+        *last* axis varying slowest), which is not the order of `tidy`. """
+
+    def __init__(self, stream, cube, url, agg_params=None, response=None):
+        super(StreamingAggregation, self).__init__(stream.data, cube, url,
+                                                   agg_params)
+        self._stream = stream
+        self._response = response
 
-            # measure names
-            columns += [m['caption'] for m in measures]
+    def __enter__(self):
+        return self
 
-            for row in tidy['data']:
-                r = []
-                for j, cell in enumerate(row[:len(tidy['axes'])]):
-                    for ancestor in reversed(
-                            cell['ancestors'][:slices[j] - 1]):
-                        r += [ancestor['key'], ancestor['caption']]
-                    r += [cell['key'], cell['caption']]
+    def __exit__(self, *exc_info):
+        self.close()
 
-                r += get_props(row[:-len(measures)], pnames, props,
-                               tidy['axes'])
+    def close(self):
+        """ Release the HTTP response (and its pooled connection). Done
+            automatically once the cells have been fully iterated. """
+        self._stream = None
+        if self._response is not None:
+            self._response.close()
+            self._response = None
 
-                for mvalue in row[len(tidy['axes']):]:
-                    r.append(mvalue)
+    @property
+    def values(self):
+        raise Exception(
+            "Values of a streaming aggregation can only be iterated")
+
+    def iter_cells(self):
+        if self._stream is None:
+            raise Exception("Streaming aggregation has already been consumed")
+        stream, self._stream = self._stream, None
+        return self._iter_stream(stream)
 
-                table.append(r)
+    def _iter_stream(self, stream):
+        try:
+            for cell in stream.cells():
+                yield cell
+        finally:
+            self.close()
 
-        else:  # no parents
-            for dd in tidy['axes']:
-                columns += ['ID %s' % dd['level'], dd['level']]
-            # measure names
-            columns += [m['caption'] for m in self._agg_params['measures']]
+    def to_pandas(self, filter_empty_measures=True, compact=False,
+                  workers=None):
+        return self._cells_to_pandas(
+            list(self.iter_cells()), filter_empty_measures, compact, workers)
+
+
+class FlatAggregation(object):
+    """
+    An aggregation fetched in one of the flat formats of mondrian-rest
+    (`csv` or `jsonrecords`): a table with a row per cell, whose columns
+    are those of the index of `Aggregation.to_pandas` followed by the
+    measures.
 
-            for row in tidy['data']:
-                r = []
-                for cell in row[:len(tidy['axes'])]:
-                    r += [cell['key'], cell['caption']]
+    CSV carries no types, so member keys and captions are read as strings;
+    `jsonrecords` keeps the types of the JSON response.
+    """
 
-                r += get_props(row[:-len(measures)], pnames, props,
-                               tidy['axes'])
+    FORMATS = ('csv', 'jsonrecords')
 
-                for mvalue in row[len(tidy['axes']):]:
-                    r.append(mvalue)
+    def __init__(self, body, format, cube, url, agg_params):
+        if format not in self.FORMATS:
+            raise ValueError('Unknown format `%s`' % format)
+        self.body = body
+        self.format = format
+        self.url = url
+        self._cube = cube
+        self._agg_params = agg_params
 
-                table.append(r)
+    def to_pandas(self, filter_empty_measures=True):
+        measures = self._agg_params['measures']
 
-        df = pd.DataFrame(table,
-                          columns=columns) \
-               .set_index(columns[:-len(self._agg_params['measures'])])
+        if self.format == 'csv':
+            columns = list(pd.read_csv(io.BytesIO(self.body), nrows=0).columns)
+            index = columns[:-len(measures)]
+            df = pd.read_csv(io.BytesIO(self.body),
+                             dtype={c: str for c in index},
+                             keep_default_na=False,
+                             na_values={c: [''] for c in columns[len(index):]})
+        else:
+            records = json.loads(self.body.decode('utf-8'))['data']
+            df = pd.DataFrame.from_records(records)
+            index = list(df.columns[:-len(measures)])
+
+        df.columns = index + [m['caption'] for m in measures]
+        df = df.set_index(index)
 
         if filter_empty_measures:
-            df = df[reduce_(
-                np.logical_and,
-                [df[msr['name']].notnull() for msr in self.measures])]
+            df = df[reduce_(np.logical_and,
+                            [df[m['caption']].notnull() for m in measures])]
 
         return df
@@ -0,0 +1,325 @@
+"""
+asyncio counterparts of `MondrianClient` and `Cube`, built on `httpx`
+(install with `pip install mondrian-rest[async]`).
+"""
+
+import asyncio
+from itertools import islice
+from operator import itemgetter
+from urllib.parse import urljoin
+
+from .aggregation import Aggregation, StreamingAggregation
+from .cache import canonical_key, reorder_measures
+from .client import Cube, CUBE_ATTRS, aggregation_qs_params
+from .jsonstream import AggregationStream
+from .instrumentation import Instrumentation
+from .members import LevelMembers
+from .singleflight import AsyncSingleFlight
+from .union import AsyncMeasureBatcher, select_measures
+from .decoding import json_loads
+from .batch import run_batch_async
+from .transport import DEFAULT_TIMEOUT, RETRY_STATUSES
+
+# rows decoded per hop to the parsing thread by `iter_aggregation`
+STREAM_BATCH_SIZE = 1024
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+def httpx_timeout(timeout):
+    """ Convert a `requests`-style timeout to an `httpx.Timeout` """
+    if isinstance(timeout, tuple):
+        connect, read = timeout
+        return httpx.Timeout(read, connect=connect)
+    return httpx.Timeout(timeout)
+
+
+class AsyncCube(Cube):
+    """ A `Cube` whose queries are coroutines """
+
+    async def get_members(self, dimension_name, level_name):
+        r = await self.client.get_members(self.name, dimension_name,
+                                          level_name)
+        return r['members']
+
+    async def get_level_members(self, dimension_name, level_name):
+        return await self.client.get_level_members(self.name, dimension_name,
+                                                   level_name)
+
+    async def prefetch_members(self, dimensions=None):
+        """ Like `Cube.prefetch_members`, fetching every level at once """
+        levels = self._member_levels(dimensions)
+        members = await asyncio.gather(
+            *[self.get_level_members(*dl) for dl in levels])
+        return dict(zip(levels, members))
+
+    async def get_aggregation(self, drilldown=[], cut=[], measures=[],
+                              timeout=None, **extra_params):
+        return await self.client.get_aggregation(
+            self,
+            self._aggregation_params(drilldown, cut, measures, extra_params),
+            timeout=timeout)
+
+    async def get_aggregations(self, queries, max_concurrency=8,
+                               rate_limit=None, timeout=None):
+        """ Run the aggregation `queries` concurrently: see
+            `AsyncMondrianClient.get_aggregations` """
+        return await self.client.get_aggregations(
+            [dict(q, cube=self) for q in queries],
+            max_concurrency=max_concurrency, rate_limit=rate_limit,
+            timeout=timeout)
+
+    def iter_aggregation(self, drilldown=[], cut=[], measures=[],
+                         chunksize=None, timeout=None, **extra_params):
+        """
+        Like `Cube.iter_aggregation`, but an async iterator: use it with
+        `async for`.
+        """
+        return self.client.iter_aggregation(
+            self,
+            self._aggregation_params(drilldown, cut, measures, extra_params),
+            chunksize=chunksize,
+            timeout=timeout)
+
+
+class AsyncMondrianClient(object):
+    """
+    Like `MondrianClient`, but its methods are coroutines. All requests go
+    through one `httpx.AsyncClient`, whose pool holds up to `pool_size`
+    connections. Requests time out after `timeout` (connect, read) seconds
+    and are retried up to `retries` times, with exponential backoff, on
+    connection errors and 5xx responses. The members of levels are kept in
+    `member_catalog` (a `members.MemberCatalog`), if given. With
+    `coalesce`, identical concurrent requests share one upstream request,
+    and with `measure_window`, those differing only in their measures
+    share one for the union of their measures (see `MondrianClient`).
+    Responses are decoded with `json_loads`.
+
+    Use it as an async context manager, or call `close` when done.
+    """
+
+    def __init__(self, api_base, pool_size=100, timeout=DEFAULT_TIMEOUT,
+                 retries=3, backoff_factor=0.5, http_client=None,
+                 instrumentation=None, member_catalog=None, coalesce=True,
+                 json_loads=json_loads, measure_window=None):
+        if http_client is None:
+            if httpx is None:
+                raise ImportError(
+                    'AsyncMondrianClient requires httpx '
+                    '(pip install mondrian-rest[async])')
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=pool_size,
+                                    max_keepalive_connections=pool_size),
+                timeout=httpx_timeout(timeout))
+
+        self.api_base = api_base
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self._http = http_client
+        self.member_catalog = member_catalog
+        self.instrumentation = instrumentation if instrumentation is not None \
+            else Instrumentation()
+        self._single_flight = AsyncSingleFlight() if coalesce else None
+        self.json_loads = json_loads
+        self._measure_batcher = AsyncMeasureBatcher(measure_window) \
+            if measure_window else None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        await self._http.aclose()
+
+    async def get_cubes(self):
+        r = await self._get_json(urljoin(self.api_base, 'cubes'))
+        return [
+            AsyncCube(*(itemgetter(*CUBE_ATTRS)(c) + (self, )))
+            for c in r['cubes']
+        ]
+
+    async def get_cube(self, cube_id):
+        r = await self._get_json(urljoin(self.api_base, 'cubes/' + cube_id))
+        return AsyncCube(*(itemgetter(*CUBE_ATTRS)(r) + (self, )))
+
+    async def get_aggregation(self, cube, params, timeout=None):
+        url = urljoin(self.api_base, 'cubes/%s/aggregate' % cube.name)
+        qs_params = aggregation_qs_params(params)
+
+        async def fetch(qs_params=qs_params):
+            r = await self._request(url, qs_params, timeout=timeout)
+            return str(r.url), self._decode(r)
+
+        if self._measure_batcher is not None:
+            return await self._union_aggregation(url, qs_params, fetch, cube,
+                                                 params)
+        (agg_url, data), shared = await self._coalesced(
+            canonical_key(url, qs_params), fetch)
+        if shared:
+            data = reorder_measures(data, qs_params['measures[]'])
+        return Aggregation(data, cube, agg_url, params)
+
+    async def get_aggregations(self, queries, max_concurrency=8,
+                               rate_limit=None, timeout=None):
+        """ Like `MondrianClient.get_aggregations`, awaiting up to
+            `max_concurrency` queries at a time """
+        def call(query):
+            query = dict(query)
+            cube = query.pop('cube')
+            query.setdefault('timeout', timeout)
+
+            async def run():
+                c = cube if isinstance(cube, Cube) else \
+                    await self.get_cube(cube)
+                return await c.get_aggregation(**query)
+            return run
+
+        return await run_batch_async([call(q) for q in queries],
+                                     max_concurrency=max_concurrency,
+                                     rate_limit=rate_limit)
+
+    async def iter_aggregation(self, cube, params, chunksize=None,
+                               timeout=None):
+        """
+        Stream an aggregation, yielding its rows or, if `chunksize` is given,
+        DataFrames of up to `chunksize` rows (see `StreamingAggregation`).
+
+        The response body is read on the event loop, but decoded in a worker
+        thread, so that parsing a large response does not block the loop.
+        Streamed requests are not retried.
+        """
+        loop = asyncio.get_running_loop()
+        kwargs = {} if timeout is None else {'timeout': httpx_timeout(timeout)}
+
+        async with self._http.stream(
+                'GET',
+                urljoin(self.api_base, 'cubes/%s/aggregate' % cube.name),
+                params=aggregation_qs_params(params),
+                **kwargs) as r:
+            r.raise_for_status()
+            body = r.aiter_bytes()
+
+            def chunks():
+                # runs in the worker thread, fetching from the event loop
+                while True:
+                    try:
+                        yield asyncio.run_coroutine_threadsafe(
+                            body.__anext__(), loop).result()
+                    except StopAsyncIteration:
+                        return
+
+            agg = await loop.run_in_executor(
+                None, lambda: StreamingAggregation(
+                    AggregationStream(chunks()), cube, str(r.url), params))
+
+            if chunksize:
+                batches = agg.iter_pandas(chunksize)
+            else:
+                rows = agg.iter_rows()
+                batches = iter(lambda: list(islice(rows, STREAM_BATCH_SIZE)),
+                               [])
+
+            while True:
+                batch = await loop.run_in_executor(None, next, batches, None)
+                if batch is None:
+                    return
+                if chunksize:
+                    yield batch
+                else:
+                    for row in batch:
+                        yield row
+
+    async def get_members(self, cube_id, dimension, level):
+        if self.member_catalog is not None:
+            members = await self.get_level_members(cube_id, dimension, level)
+            return {'members': members.members}
+        return await self._get_json(
+            self._members_url(cube_id, dimension, level))
+
+    async def get_level_members(self, cube_id, dimension, level):
+        if self.member_catalog is None:
+            r = await self.get_members(cube_id, dimension, level)
+            return LevelMembers(r['members'])
+
+        async def fetch():
+            r = await self._request(url)
+            r.raise_for_status()
+            return self.member_catalog.set(cube_id, dimension, level,
+                                           r.content, self._decode(r))
+
+        members = self.member_catalog.get(cube_id, dimension, level)
+        if members is None:
+            url = self._members_url(cube_id, dimension, level)
+            members = (await self._coalesced(url, fetch))[0]
+        return members
+
+    def _members_url(self, cube_id, dimension, level):
+        return urljoin(
+            self.api_base, 'cubes/%s/dimensions/%s/levels/%s/members' %
+            (cube_id, dimension, level))
+
+    async def _get_json(self, url):
+        """ The decoded response to a request to `url` """
+        async def fetch():
+            return self._decode(await self._request(url))
+        return (await self._coalesced(url, fetch))[0]
+
+    async def _union_aggregation(self, url, qs_params, fetch, cube, params):
+        """ Like `MondrianClient._union_aggregation` """
+        names = qs_params['measures[]']
+
+        async def fetch_union(measures):
+            union = dict(qs_params, **{'measures[]': measures})
+            return (await self._coalesced(canonical_key(url, union),
+                                          lambda: fetch(union)))[0]
+
+        (agg_url, data), measures = await self._measure_batcher.do(
+            canonical_key(url, {k: v for k, v in qs_params.items()
+                                if k != 'measures[]'}),
+            names, fetch_union)
+        if set(measures) != set(names):
+            self.instrumentation.count('measure_unions')
+            agg_url = str(httpx.URL(url, params=qs_params))
+        data = select_measures(data, names, params.get('nonempty'))
+        return Aggregation(data, cube, agg_url, params)
+
+    async def _coalesced(self, key, fetch):
+        """ `(await fetch(), shared)`, like `MondrianClient._coalesced` """
+        if self._single_flight is None:
+            return await fetch(), False
+        result, shared = await self._single_flight.do(key, fetch)
+        if shared:
+            self.instrumentation.count('coalesced')
+        return result, shared
+
+    def _decode(self, r):
+        with self.instrumentation.timed('decode',
+                                        bytes=len(r.content)):
+            return self.json_loads(r.content)
+
+    async def _request(self, url, params=None, timeout=None):
+        with self.instrumentation.timed('request', url=url) as attributes:
+            r = await self._retrying_request(url, params, timeout)
+            attributes['status'] = r.status_code
+            attributes['bytes'] = len(r.content)
+        return r
+
+    async def _retrying_request(self, url, params=None, timeout=None):
+        kwargs = {} if timeout is None else {'timeout': httpx_timeout(timeout)}
+        attempt = 0
+        while True:
+            try:
+                r = await self._http.get(url, params=params, **kwargs)
+                if r.status_code not in RETRY_STATUSES \
+                   or attempt >= self.retries:
+                    return r
+            except httpx.TransportError:
+                if attempt >= self.retries:
+                    raise
+            await asyncio.sleep(self.backoff_factor * (2**attempt))
+            attempt += 1
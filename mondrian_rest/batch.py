@@ -0,0 +1,70 @@
+"""
+Running batches of queries concurrently (see `MondrianClient.get_aggregations`),
+with a bound on the queries in flight and on the rate they are started at.
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class RateLimiter(object):
+    """ Spaces calls out to at most `rate` per second. Safe to share between
+        threads. """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def delay(self):
+        """ Reserve the next slot, and return how long to wait for it (in
+            seconds) """
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        return start - now
+
+    def wait(self):
+        delay = self.delay()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def run_batch(calls, max_workers=8, rate_limit=None):
+    """
+    Call every function in `calls`, up to `max_workers` at a time and
+    starting at most `rate_limit` per second (if given). Returns their
+    results in the order of `calls`, with the exception raised by those
+    that failed in their place.
+    """
+    limiter = RateLimiter(rate_limit) if rate_limit else None
+
+    def run(call):
+        if limiter is not None:
+            limiter.wait()
+        try:
+            return call()
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(run, calls))
+
+
+async def run_batch_async(calls, max_concurrency=8, rate_limit=None):
+    """ Like `run_batch`, for functions returning awaitables, up to
+        `max_concurrency` of which are awaited at a time """
+    limiter = RateLimiter(rate_limit) if rate_limit else None
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(call):
+        async with semaphore:
+            if limiter is not None:
+                await asyncio.sleep(limiter.delay())
+            return await call()
+
+    return await asyncio.gather(*[run(c) for c in calls],
+                                return_exceptions=True)
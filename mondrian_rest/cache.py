@@ -0,0 +1,312 @@
+"""
+Caching of aggregation results, keyed by the (canonicalized) query that
+produced them.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode, quote
+
+from .decoding import json_loads
+
+# parameters whose order does not change the result (`measures[]` does, but
+# a cached result can be reordered: see `reorder_measures`)
+UNORDERED_PARAMS = ['cut[]', 'measures[]', 'properties[]', 'caption[]']
+
+# the decoded form of an aggregation response (dicts, lists, str and float
+# objects) takes about 4.5-5.5 times the size of its JSON encoding
+DECODED_SIZE_FACTOR = 5
+
+
+def canonical_key(url, qs_params):
+    """ A string identifying the query to `url` with `qs_params` """
+    items = []
+    for k in sorted(qs_params):
+        v = qs_params[k]
+        if isinstance(v, (list, tuple)):
+            v = sorted(v) if k in UNORDERED_PARAMS else list(v)
+        items.append((k, v))
+    return url + '?' + urlencode(items, doseq=True)
+
+
+def reorder_measures(data, names):
+    """ Return aggregation `data` with its measures in the order of `names` """
+    members = data['axes'][0]['members']
+    index = {m['name']: i for i, m in enumerate(members)}
+    perm = [index[n] for n in names]
+    if perm == list(range(len(members))):
+        return data
+
+    def walk(v, depth):
+        if depth == 0:
+            return [v[i] for i in perm]
+        return [walk(vv, depth - 1) for vv in v]
+
+    reordered = dict(data)
+    reordered['axes'] = [dict(data['axes'][0],
+                              members=[members[i] for i in perm])] \
+        + data['axes'][1:]
+    reordered['values'] = walk(data['values'], len(data['axes']) - 1)
+    return reordered
+
+
+def entry_path(directory, cube_name, key):
+    """ The file of entry `key` (a string) of `cube_name` in `directory`:
+        one directory per cube, one file per hash of the key """
+    return os.path.join(directory, quote(cube_name, safe=''),
+                        hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+
+def remove_entries(directory, cube_name=None):
+    """ Delete the entries of `cube_name` (all of them if None) from
+        `directory` """
+    path = directory if cube_name is None \
+        else os.path.join(directory, quote(cube_name, safe=''))
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def read_entry(path):
+    """ Read a cache file, returning its (header, body) """
+    with open(path, 'rb') as f:
+        header = json.loads(f.readline().decode('utf-8'))
+        return header, f.read()
+
+
+def write_entry(path, header, body):
+    """ Write a cache file: a JSON `header` line followed by `body` """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+
+    # write to a temporary file first, so readers never see partial entries
+    fd, tmp = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(json.dumps(header).encode('utf-8'))
+        f.write(b'\n')
+        f.write(body)
+    os.replace(tmp, path)
+
+
+class AggregationCache(object):
+    """
+    Two-tier cache of aggregation responses.
+
+    The memory tier is an LRU of decoded responses, holding up to (about)
+    `max_bytes` of memory. The size of an entry is estimated as
+    `DECODED_SIZE_FACTOR` times the size of its response body. If
+    `directory` is given, responses are also written there and survive the
+    process. Entries of both tiers expire `ttl` seconds after being stored
+    (`None`: never).
+
+    Safe to share between threads.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, ttl=None, directory=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.directory = directory
+
+        self._entries = OrderedDict()  # key -> (cube, stored_at, nbytes, url, data)
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self._stats = dict(hits=0, misses=0, disk_hits=0, evictions=0)
+
+    @property
+    def stats(self):
+        with self._lock:
+            return dict(self._stats,
+                        entries=len(self._entries),
+                        bytes=self._nbytes)
+
+    def _expired(self, stored_at):
+        return self.ttl is not None and time.time() - stored_at > self.ttl
+
+    def get(self, cube_name, key):
+        """ Return the (url, data) cached for `key`, or None """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[1]):
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return entry[3], entry[4]
+
+        hit = self._disk_get(cube_name, key)
+        with self._lock:
+            if hit is None:
+                self._stats['misses'] += 1
+                return None
+            self._stats['hits'] += 1
+            self._stats['disk_hits'] += 1
+
+        # the entry keeps the time it was stored at (on disk)
+        stored_at, url, body = hit
+        data = json_loads(body)
+        self._memory_set(cube_name, key, url, data,
+                         len(body) * DECODED_SIZE_FACTOR, stored_at)
+        return url, data
+
+    def set(self, cube_name, key, url, body, data):
+        """ Cache the response `body` (bytes) to the query `key`, which was
+            fetched from `url` and decodes to `data` """
+        self._memory_set(cube_name, key, url, data,
+                         len(body) * DECODED_SIZE_FACTOR)
+        self._disk_set(cube_name, key, url, body)
+
+    def invalidate(self, cube_name=None):
+        """ Drop every entry of `cube_name` (all of them if None) """
+        with self._lock:
+            for key in [k for k, e in self._entries.items()
+                        if cube_name is None or e[0] == cube_name]:
+                self._remove(key)
+
+        if self.directory is not None:
+            remove_entries(self.directory, cube_name)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._nbytes -= entry[2]
+
+    def _memory_set(self, cube_name, key, url, data, nbytes, stored_at=None):
+        if nbytes > self.max_bytes:
+            return
+        if stored_at is None:
+            stored_at = time.time()
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (cube_name, stored_at, nbytes, url, data)
+            self._nbytes += nbytes
+            while self._nbytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+
+    def _disk_get(self, cube_name, key):
+        if self.directory is None:
+            return None
+        path = entry_path(self.directory, cube_name, key)
+        try:
+            stored_at = os.path.getmtime(path)
+            if self._expired(stored_at):
+                os.remove(path)
+                return None
+            header, body = read_entry(path)
+        except (IOError, OSError):
+            return None
+
+        # guard against hash collisions
+        if header['key'] != key:
+            return None
+        return stored_at, header['url'], body
+
+    def _disk_set(self, cube_name, key, url, body):
+        if self.directory is None:
+            return
+        write_entry(entry_path(self.directory, cube_name, key),
+                    {'key': key, 'url': url}, body)
+
+
+class SchemaCache(object):
+    """
+    Cache of cube schemas (the responses of the `cubes` endpoints).
+
+    A schema is served from the cache for `ttl` seconds after it was
+    fetched (or last revalidated). After that it is revalidated with a
+    conditional request, if the server sent an `ETag` or `Last-Modified`
+    for it, or fetched again otherwise.
+
+    If `directory` is given, schemas are also persisted there, so that they
+    can be revalidated (instead of downloaded) after a restart.
+    """
+
+    def __init__(self, ttl=300, directory=None):
+        self.ttl = ttl
+        self.directory = directory
+
+        self._entries = {}  # url -> (validated_at, validators, data)
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        """ Return (fresh, validators, data) for `url`, or None """
+        with self._lock:
+            entry = self._entries.get(url)
+
+        if entry is None and self.directory is not None:
+            path = self._path(url)
+            try:
+                header, body = read_entry(path)
+                validated_at = os.path.getmtime(path)
+            except (IOError, OSError):
+                return None
+            if header['url'] != url:
+                return None
+            entry = (validated_at, header['validators'],
+                     json_loads(body))
+            with self._lock:
+                self._entries[url] = entry
+
+        if entry is None:
+            return None
+
+        validated_at, validators, data = entry
+        fresh = self.ttl is None or time.time() - validated_at <= self.ttl
+        return fresh, validators, data
+
+    def set(self, url, validators, body, data):
+        """ Store the schema at `url`, its response `body` (bytes) and the
+            `validators` (request headers) to revalidate it """
+        with self._lock:
+            self._entries[url] = (time.time(), validators, data)
+        if self.directory is not None:
+            write_entry(self._path(url),
+                        {'url': url, 'validators': validators}, body)
+
+    def touch(self, url):
+        """ Mark the schema at `url` as just revalidated """
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None:
+                self._entries[url] = (time.time(), ) + entry[1:]
+        if self.directory is not None:
+            try:
+                os.utime(self._path(url), None)
+            except OSError:
+                pass
+
+    def invalidate(self, url=None):
+        """ Drop the schema at `url` (all of them if None) """
+        with self._lock:
+            if url is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(url, None)
+
+        if self.directory is not None:
+            if url is None:
+                shutil.rmtree(self.directory, ignore_errors=True)
+            else:
+                try:
+                    os.remove(self._path(url))
+                except OSError:
+                    pass
+
+    def _path(self, url):
+        return os.path.join(self.directory,
+                            hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+
+def response_validators(r):
+    """ The conditional request headers to revalidate response `r` """
+    validators = {}
+    if r.headers.get('ETag'):
+        validators['If-None-Match'] = r.headers['ETag']
+    if r.headers.get('Last-Modified'):
+        validators['If-Modified-Since'] = r.headers['Last-Modified']
+    return validators
@@ -1,36 +1,99 @@
+from concurrent.futures import ThreadPoolExecutor
 from operator import itemgetter
-
-import sys
-if sys.version_info >= (3, 0):
-    from urllib.parse import urljoin
-else: 
-    from urlparse import urljoin
+from urllib.parse import urljoin
 
 import copy
+
+import pandas as pd
 import requests
 
 from .identifier import Identifier
-from .aggregation import Aggregation
+from .schema import Dimension, Measure
+from .aggregation import Aggregation, StreamingAggregation, FlatAggregation
+from .jsonstream import AggregationStream
+from .transport import SessionTransport
+from .cache import canonical_key, reorder_measures, response_validators
+from .sharding import shard_cuts, merge_aggregations
+from .members import LevelMembers, set_cut
+from .singleflight import SingleFlight
+from .decoding import json_loads
+from .batch import run_batch
+from .refresh import period_keys, periods_to_refresh, merge_periods
+from .rollup import finer_queries, measure_rollup, roll_up
+from .union import MeasureBatcher, select_measures
+from .instrumentation import Instrumentation
 
 CUBE_ATTRS = ['name', 'dimensions', 'measures', 'annotations']
 BOOL_OPTS = ['nonempty', 'distinct', 'parents']
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+# TODO: validate shape of params
+def aggregation_qs_params(params):
+    """ Build the query string parameters of the `aggregate` endpoint """
+    qs_params = {
+        bo: 'true' if params.get(bo) else 'false'
+        for bo in BOOL_OPTS
+    }
+
+    if len(params.get('measures', [])) == 0:
+        raise Exception("Must provide at least one measure")
+
+    for m in params['measures']:
+        qs_params['measures[]'] = [m['name'] for m in params['measures']]
+
+    if len(params.get('drilldown', [])) > 0:
+        qs_params['drilldown[]'] = [l['full_name'] for l in params['drilldown']]
+
+    if len(params.get('cut', [])) > 0:
+        qs_params['cut[]'] = params['cut']
+
+    if len(params.get('properties', [])) > 0:
+        qs_params['properties[]'] = params['properties']
+
+    if len(params.get('caption', [])) > 0:
+        qs_params['caption[]'] = params['caption']
+
+    return qs_params
+
 
 class Cube(object):
 
     def __init__(self, name, dimensions, measures, annotations, client):
         self.name = name
-        self.dimensions = dimensions
-        self.measures = measures
+        self.dimensions = [
+            d if isinstance(d, Dimension) else Dimension(d)
+            for d in dimensions
+        ]
+        self.measures = [
+            m if isinstance(m, Measure) else Measure(m)
+            for m in measures
+        ]
         self.annotations = annotations
         self.client = client
 
+        # indexes, built once (don't mutate them)
         self._dimensions_by_name = {
-            d['name']: d for d in self.dimensions
+            d.name: d for d in self.dimensions
+        }
+        self._std_dimensions = {
+            d.name: d
+            for d in self.dimensions
+            if d.type != 'time'
+        }
+        self._measures_by_name = {
+            m.name: m for m in self.measures
+        }
+        self._levels_by_full_name = {
+            l.full_name: l
+            for d in self.dimensions
+            for h in d.hierarchies
+            for l in h.levels
         }
 
     @property
     def time_dimension(self):
-        tds = [d for d in self.dimensions if d['type'] == 'time']
+        tds = [d for d in self.dimensions if d.type == 'time']
         if len(tds) == 0:
             raise Exception("No time dimension defined in cube %s" % self.name)
         elif len(tds) > 1:
@@ -40,26 +103,16 @@ class Cube(object):
     @property
     def std_dimensions(self):
         """ Dict of non-time dimensions keyed by their name """
-        return {
-            d['name']: d
-            for d in self.dimensions
-            if d['type'] != 'time'
-        }
+        return self._std_dimensions
 
     @property
     def dimensions_by_name(self):
         """ Dict of dimensions keyed by their name """
-        return {
-            d['name']: d
-            for d in self.dimensions
-        }
+        return self._dimensions_by_name
 
     @property
     def measures_by_name(self):
-        return {
-            m['name']: m
-            for m in self.measures
-        }
+        return self._measures_by_name
 
     def get_level(self, dimension_name, level_name, hierarchy=0):
         """
@@ -67,12 +120,17 @@ class Cube(object):
         in hierarchy `hierarchy` (default: 0)
         """
         d = self._dimensions_by_name[dimension_name]
-        for l in d['hierarchies'][hierarchy]['levels']:
-            if l['name'] == level_name:
-                return l
-
-        # raise if not found
-        raise ValueError('level with name `%s`` not found' % level_name)
+        try:
+            return d.hierarchies[hierarchy].levels_by_name[level_name]
+        except KeyError:
+            raise ValueError('level with name `%s`` not found' % level_name)
+
+    def get_level_by_full_name(self, full_name):
+        """ Get level with full name `full_name` (eg: `[Date].[Year]`) """
+        try:
+            return self._levels_by_full_name[full_name]
+        except KeyError:
+            raise ValueError('level with full name `%s`` not found' % full_name)
 
     def get_members(self, dimension_name, level_name):
         return self.client.get_members(
@@ -81,7 +139,180 @@ class Cube(object):
             level_name
         )['members']
 
-    def get_aggregation(self, drilldown=[], cut=[], measures=[], **extra_params):
+    def get_level_members(self, dimension_name, level_name):
+        """ The members of a level as `LevelMembers`, to look them up by
+            key, caption or full name (eg: to build cuts) """
+        return self.client.get_level_members(self.name, dimension_name,
+                                             level_name)
+
+    def prefetch_members(self, dimensions=None, max_workers=4):
+        """
+        Fetch the members of every level of `dimensions` (names; all of
+        them by default), up to `max_workers` levels at a time. Returns
+        their `LevelMembers` by (dimension name, level name), which are
+        kept in the client's `member_catalog`, if any.
+        """
+        levels = self._member_levels(dimensions)
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            members = list(pool.map(
+                lambda dl: self.get_level_members(*dl), levels))
+        return dict(zip(levels, members))
+
+    def get_aggregation(self, drilldown=[], cut=[], measures=[],
+                        timeout=None, format='json', shard_by=None,
+                        shard_size=1, max_workers=4, **extra_params):
+        """
+        `timeout` overrides the (connect, read) timeout of the client's
+        transport for this query. With `format` 'csv' or 'jsonrecords', the
+        result is fetched as a flat table (see `FlatAggregation`).
+
+        With `shard_by`, one of the levels in `drilldown` (or True, for the
+        one of the time dimension), the query is split into shards, each
+        one cut to `shard_size` members of that level. Up to `max_workers`
+        shards are fetched at a time, and their results are merged into one
+        `Aggregation`, like that of the whole query.
+        """
+        params = self._aggregation_params(drilldown, cut, measures,
+                                          extra_params)
+        if not shard_by:
+            return self.client.get_aggregation(self, params, timeout=timeout,
+                                               format=format)
+        if format != 'json':
+            raise ValueError("Can't shard a query in format `%s`" % format)
+
+        dimension_name, level = self._drilled_level(shard_by, params)
+        shards = [
+            dict(params, cut=list(params['cut']) + [c])
+            for c in shard_cuts(self.get_members(dimension_name, level.name),
+                                shard_size)
+        ]
+        if len(shards) == 0:
+            return self.client.get_aggregation(self, params, timeout=timeout)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            aggs = list(pool.map(
+                lambda p: self.client.get_aggregation(self, p, timeout=timeout),
+                shards))
+
+        return Aggregation(merge_aggregations([a._data for a in aggs]), self,
+                           self.client.aggregation_url(self, params), params)
+
+    def get_aggregations(self, queries, max_workers=8, rate_limit=None,
+                         timeout=None):
+        """
+        Run the aggregation `queries` (dicts of the arguments of
+        `get_aggregation`) concurrently: see `MondrianClient.get_aggregations`.
+        """
+        return self.client.get_aggregations(
+            [dict(q, cube=self) for q in queries], max_workers=max_workers,
+            rate_limit=rate_limit, timeout=timeout)
+
+    def refresh_aggregation(self, previous, drilldown=[], cut=[],
+                            measures=[], overlap=1, filter_empty_measures=True,
+                            timeout=None, **extra_params):
+        """
+        Bring `previous`, the `to_pandas()` (or `to_arrow()`) of the
+        aggregation with these arguments, up to date: only the periods of
+        the drilled down level of the time dimension from the last
+        `overlap` ones in `previous` on are queried, and they replace those
+        in `previous`. Returns the updated DataFrame (or Table).
+        """
+        params = self._aggregation_params(drilldown, cut, measures,
+                                          extra_params)
+        return self._refresh(previous, params, overlap, timeout,
+                             lambda agg: agg.to_pandas(filter_empty_measures)
+                             if isinstance(previous, pd.DataFrame)
+                             else agg.to_arrow(filter_empty_measures))
+
+    def get_arrow(self, drilldown=[], cut=[], measures=[],
+                  filter_empty_measures=True, timeout=None, refresh=False,
+                  overlap=1, **extra_params):
+        """
+        The aggregation as a `pyarrow.Table` (see `Aggregation.to_arrow`),
+        read from the client's `store` if it holds it. With `refresh`, a
+        stored table is brought up to date (see `refresh_aggregation`) and
+        stored again.
+        """
+        return self.client.get_arrow(
+            self,
+            self._aggregation_params(drilldown, cut, measures, extra_params),
+            filter_empty_measures=filter_empty_measures,
+            timeout=timeout, refresh=refresh, overlap=overlap)
+
+    def iter_aggregation(self, drilldown=[], cut=[], measures=[],
+                         chunksize=None, timeout=None, **extra_params):
+        """
+        Like `get_aggregation`, but streams the response: iterate over the
+        rows of `Aggregation.tidy` or, if `chunksize` is given, over
+        DataFrames of up to `chunksize` rows. Rows come in the order of the
+        response (see `StreamingAggregation`).
+        """
+        agg = self.client.get_aggregation(
+            self,
+            self._aggregation_params(drilldown, cut, measures, extra_params),
+            stream=True, timeout=timeout)
+
+        if chunksize:
+            return agg.iter_pandas(chunksize)
+        return agg.iter_rows()
+
+    def _member_levels(self, dimensions=None):
+        """ The (dimension name, level name) of the levels of `dimensions`
+            that have members to fetch (ie: not `(All)`) """
+        if dimensions is None:
+            dimensions = [d.name for d in self.dimensions]
+        levels = []
+        for name in dimensions:
+            for h in self.dimensions_by_name[name].hierarchies:
+                for l in h.levels[1:] if h.get('has_all') else h.levels:
+                    if (name, l.name) not in levels:
+                        levels.append((name, l.name))
+        return levels
+
+    def _drilled_level(self, level, params):
+        """ The (dimension name, level) named by `level` (True: that of the
+            time dimension), to split the query with `params` along """
+        if level is True:
+            dimension = self.time_dimension
+            candidates = set(l.full_name for h in dimension.hierarchies
+                             for l in h.levels)
+        else:
+            names = [seg.name for seg in Identifier.parse(level).segments]
+            dimension = self.dimensions_by_name[names[0]]
+            candidates = set([self.get_level(*names).full_name])
+
+        drilled = [l for l in params['drilldown']
+                   if l['full_name'] in candidates]
+        if len(drilled) == 0:
+            raise ValueError('Can only split a query along a drilled down level')
+        if any(c.startswith('[%s]' % dimension.name) for c in params['cut']):
+            raise ValueError(
+                "Can't split a query along dimension `%s`, which is cut"
+                % dimension.name)
+
+        return dimension.name, drilled[0]
+
+    def _refresh(self, previous, params, overlap, timeout, convert):
+        """ `previous` updated with the `convert`ed aggregations of the
+            periods to refresh (see `refresh_aggregation`) """
+        dimension_name, level = self._drilled_level(True, params)
+        members = self.get_level_members(dimension_name, level.name).members
+        column = 'ID %s' % level.name
+
+        periods = periods_to_refresh(members, period_keys(previous, column),
+                                     overlap)
+        if periods is None:
+            return convert(self.client.get_aggregation(self, params,
+                                                       timeout=timeout))
+
+        cut = set_cut(m['full_name'] for m in periods)
+        new = convert(self.client.get_aggregation(
+            self, dict(params, cut=list(params['cut']) + [cut]),
+            timeout=timeout))
+        return merge_periods(previous, new, column,
+                             set(m['key'] for m in periods))
+
+    def _aggregation_params(self, drilldown, cut, measures, extra_params):
 
         agg_params = copy.copy(extra_params)
 
@@ -97,65 +328,330 @@ class Cube(object):
             for m in measures
         ]
 
-
-        return self.client.get_aggregation(self,
-                                           agg_params)
+        return agg_params
 
 
 class MondrianClient(object):
-    def __init__(self, api_base):
+    def __init__(self, api_base, transport=None, cache=None, schema_cache=None,
+                 store=None, instrumentation=None, member_catalog=None,
+                 coalesce=True, json_loads=json_loads, rollup=True,
+                 measure_window=None):
+        """
+        `transport` performs the HTTP requests (see `transport.Transport`).
+        By default, a `SessionTransport` with pooled keep-alive connections,
+        timeouts and retries.
+
+        If `cache` (a `cache.AggregationCache`) is given, aggregation results
+        are looked up there before querying the server. Likewise, cube
+        schemas are kept in (and revalidated through) `schema_cache`, a
+        `cache.SchemaCache`, and the tables of `get_arrow` in `store`, a
+        `store.ResultStore`. The members of levels are kept in
+        `member_catalog`, a `members.MemberCatalog`.
+
+        With `rollup`, an aggregation missing from `cache` is rolled up from
+        a cached one at a finer level of the same hierarchy, fetched with
+        `parents`, if its measures can be (their aggregator is a sum, count,
+        min or max, or they have an `additive` annotation): see
+        `rollup.finer_queries`. Members of the coarser level with no
+        children in the finer result are left out.
+
+        The timings of requests, decoding and the building of results are
+        recorded by `instrumentation` (see `instrumentation.Instrumentation`,
+        a new one by default).
+
+        With `coalesce`, identical concurrent requests for cubes, members
+        or (non-streamed, JSON) aggregations share one upstream request:
+        threads asking for what another one is already fetching wait for
+        its result (fetched with the timeout of the first one).
+
+        With `measure_window` (in seconds), the aggregations that differ
+        only in their measures, requested within that long of the first
+        one, are fetched with one request for the union of their measures
+        (the first caller waits that long before sending it). Each caller
+        gets an `Aggregation` of its own measures, like the one it would
+        have fetched alone.
+
+        Responses are decoded with `json_loads` (`orjson.loads` if it is
+        installed, `json.loads` otherwise), which takes the body as bytes.
+        """
         self.api_base = api_base
+        self.transport = transport if transport is not None else SessionTransport()
+        self.cache = cache
+        self.schema_cache = schema_cache
+        self.store = store
+        self.member_catalog = member_catalog
+        self.instrumentation = instrumentation if instrumentation is not None \
+            else Instrumentation()
+        self._single_flight = SingleFlight() if coalesce else None
+        self.json_loads = json_loads
+        self.rollup = rollup
+        self._measure_batcher = MeasureBatcher(measure_window) \
+            if measure_window else None
+
+        self._schema_objects = {}
 
     def get_cubes(self):
-        r = self._request(urljoin(self.api_base, 'cubes')).json()
-        return [Cube(*(itemgetter(*CUBE_ATTRS)(c) + (self,))) for c in r['cubes']]
+        return list(self._get_schema(
+            urljoin(self.api_base, 'cubes'),
+            lambda r: [Cube(*(itemgetter(*CUBE_ATTRS)(c) + (self,))) for c in r['cubes']]))
 
     def get_cube(self, cube_id):
-        r = self._request(urljoin(self.api_base, 'cubes/' + cube_id)).json()
-        return Cube(*(itemgetter(*CUBE_ATTRS)(r) + (self,)))
-
-    # TODO: validate shape of params
-    def get_aggregation(self, cube, params):
-        qs_params = {
-            bo: 'true' if params.get(bo) else 'false'
-            for bo in BOOL_OPTS
-        }
+        return self._get_schema(
+            urljoin(self.api_base, 'cubes/' + cube_id),
+            lambda r: Cube(*(itemgetter(*CUBE_ATTRS)(r) + (self,))))
 
-        if len(params.get('measures', [])) == 0:
-            raise Exception("Must provide at least one measure")
-
-        for m in params['measures']:
-            qs_params['measures[]'] = [m['name'] for m in params['measures']]
-
-        if len(params.get('drilldown', [])) > 0:
-            qs_params['drilldown[]'] = [l['full_name'] for l in params['drilldown']]
-
-        if len(params.get('cut', [])) > 0:
-            qs_params['cut[]'] = params['cut']
-
-        if len(params.get('properties', [])) > 0:
-            qs_params['properties[]'] = params['properties']
-
-        if len(params.get('caption', [])) > 0:
-            qs_params['caption[]'] = params['caption']
-
-        r = self._request(
-                urljoin(self.api_base, 'cubes/%s/aggregate' % cube.name),
-                qs_params
-            )
-
-        return Aggregation(r.json(), cube, r.url, params)
+    def get_aggregation(self, cube, params, stream=False, timeout=None,
+                        format='json'):
+        """
+        Query the aggregation of `cube` with `params`. If `format` is
+        'csv' or 'jsonrecords', the result is a flat table, returned as a
+        `FlatAggregation` (these are not cached nor streamed).
+        """
+        qs_params = aggregation_qs_params(params)
+        url = urljoin(self.api_base, 'cubes/%s/aggregate' % cube.name)
+        kwargs = {} if timeout is None else {'timeout': timeout}
+
+        if format != 'json':
+            if format not in FlatAggregation.FORMATS:
+                raise ValueError('Unknown format `%s`' % format)
+            r = self._request(url + '.' + format, qs_params, **kwargs)
+            r.raise_for_status()
+            return FlatAggregation(r.content, format, cube, r.url, params)
+
+        if stream:
+            r = self._request(url, qs_params, stream=True, **kwargs)
+            try:
+                r.raise_for_status()
+                stream = AggregationStream(r.iter_content(STREAM_CHUNK_SIZE))
+            except Exception:
+                r.close()
+                raise
+            return StreamingAggregation(stream, cube, r.url, params, response=r)
+
+        key = canonical_key(url, qs_params)
+
+        def fetch(qs_params=qs_params, key=key):
+            r = self._request(url, qs_params, **kwargs)
+            data = self._decode(r)
+            if self.cache is not None and r.status_code == 200:
+                self.cache.set(cube.name, key, r.url, r.content, data)
+            return r.url, data
+
+        if self.cache is not None:
+            hit = self.cache.get(cube.name, key)
+            if hit is not None:
+                self.instrumentation.count('cache_hits')
+                agg_url, data = hit
+                data = reorder_measures(data, qs_params['measures[]'])
+                return Aggregation(data, cube, agg_url, params)
+            self.instrumentation.count('cache_misses')
+
+            if self.rollup:
+                data = self._rollup(cube, params, url)
+                if data is not None:
+                    self.instrumentation.count('rollups')
+                    return Aggregation(data, cube,
+                                       self.aggregation_url(cube, params),
+                                       params)
+
+        if self._measure_batcher is not None:
+            return self._union_aggregation(url, qs_params, fetch, cube, params)
+        return self._coalesced_aggregation(key, fetch, cube, params)
+
+    def get_aggregations(self, queries, max_workers=8, rate_limit=None,
+                         timeout=None):
+        """
+        Run the aggregation `queries` concurrently, up to `max_workers` at a
+        time and starting at most `rate_limit` per second (if given). Each
+        query is a dict of the arguments of `Cube.get_aggregation`, plus
+        `cube`: a `Cube` or the name of one. `timeout` applies to the
+        queries that don't set their own.
+
+        Returns the results in the order of `queries`: for each one, its
+        `Aggregation` or, if it failed, the exception it raised.
+        """
+        def call(query):
+            query = dict(query)
+            cube = query.pop('cube')
+            query.setdefault('timeout', timeout)
+
+            def run():
+                c = cube if isinstance(cube, Cube) else self.get_cube(cube)
+                return c.get_aggregation(**query)
+            return run
+
+        return run_batch([call(q) for q in queries], max_workers=max_workers,
+                         rate_limit=rate_limit)
+
+    def get_arrow(self, cube, params, filter_empty_measures=True,
+                  timeout=None, refresh=False, overlap=1):
+        if self.store is None:
+            return self.get_aggregation(cube, params, timeout=timeout) \
+                .to_arrow(filter_empty_measures)
+
+        qs_params = aggregation_qs_params(params)
+        key = canonical_key(
+            urljoin(self.api_base, 'cubes/%s/aggregate' % cube.name),
+            qs_params) + ('' if filter_empty_measures else '#all')
+
+        table = self.store.get(cube.name, key)
+        if table is None:
+            table = self.get_aggregation(cube, params, timeout=timeout) \
+                .to_arrow(filter_empty_measures)
+            self.store.set(cube.name, key, table)
+        elif refresh:
+            table = cube._refresh(
+                table, params, overlap, timeout,
+                lambda agg: agg.to_arrow(filter_empty_measures))
+            self.store.set(cube.name, key, table)
+
+        # the key doesn't depend on the order of the measures
+        captions = [m['caption'] for m in params['measures']]
+        return table.select(
+            [c for c in table.column_names if c not in captions] + captions)
+
+    def _rollup(self, cube, params, url):
+        """ The data of the aggregation of `cube` with `params`, rolled up
+            from a cached one (see `rollup.finer_queries`), or None """
+        for finer, axis, level in finer_queries(cube, params):
+            qs_params = aggregation_qs_params(finer)
+            hit = self.cache.get(cube.name, canonical_key(url, qs_params))
+            if hit is not None:
+                return roll_up(
+                    reorder_measures(hit[1], qs_params['measures[]']), axis,
+                    level, params.get('parents'),
+                    [measure_rollup(m) for m in params['measures']])
+        return None
+
+    def aggregation_url(self, cube, params):
+        """ The URL of the aggregation of `cube` with `params` """
+        return requests.Request(
+            'GET', urljoin(self.api_base, 'cubes/%s/aggregate' % cube.name),
+            params=aggregation_qs_params(params)).prepare().url
 
     def get_members(self, cube_id, dimension, level):
-        return self._request(
-            urljoin(
-                self.api_base,
-                'cubes/%s/dimensions/%s/levels/%s/members' % (cube_id, dimension, level)
-            )
-        ).json()
+        if self.member_catalog is not None:
+            return {'members': self.get_level_members(cube_id, dimension,
+                                                      level).members}
+        url = self._members_url(cube_id, dimension, level)
+        return self._coalesced(url, lambda: self._decode(self._request(url)))[0]
+
+    def get_level_members(self, cube_id, dimension, level):
+        """ The members of a level as `LevelMembers`, from `member_catalog`
+            if it holds them """
+        if self.member_catalog is None:
+            return LevelMembers(
+                self.get_members(cube_id, dimension, level)['members'])
+
+        def fetch():
+            r = self._request(url)
+            r.raise_for_status()
+            return self.member_catalog.set(cube_id, dimension, level,
+                                           r.content, self._decode(r))
+
+        members = self.member_catalog.get(cube_id, dimension, level)
+        if members is None:
+            url = self._members_url(cube_id, dimension, level)
+            members = self._coalesced(url, fetch)[0]
+        return members
 
     def get_member(self, cube, member_full_name):
         raise Exception('Not Implemented')
 
-    def _request(self, url, params=None):
-        return requests.get(url, params=params)
+    def close(self):
+        self.transport.close()
+
+    def _members_url(self, cube_id, dimension, level):
+        return urljoin(
+            self.api_base,
+            'cubes/%s/dimensions/%s/levels/%s/members' % (cube_id, dimension, level))
+
+    def _get_schema(self, url, build):
+        """
+        Fetch the schema at `url` (through `schema_cache`, if any) and
+        `build` its objects, which are reused while the schema is unchanged.
+        """
+        if self.schema_cache is None:
+            return build(self._coalesced(
+                url, lambda: self._decode(self._request(url)))[0])
+
+        def revalidate(hit):
+            validators = hit[1] if hit is not None else None
+            if validators:
+                r = self._request(url, headers=validators)
+            else:
+                r = self._request(url)
+
+            if r.status_code == 304 and hit is not None:
+                self.schema_cache.touch(url)
+                return hit[2]
+            data = self._decode(r)
+            if r.status_code == 200:
+                self.schema_cache.set(url, response_validators(r), r.content, data)
+            return data
+
+        hit = self.schema_cache.get(url)
+        if hit is not None and hit[0]:
+            data = hit[2]
+        else:
+            data = self._coalesced(url, lambda: revalidate(hit))[0]
+
+        built = self._schema_objects.get(url)
+        if built is None or built[0] is not data:
+            built = (data, build(data))
+            self._schema_objects[url] = built
+        return built[1]
+
+    def _coalesced(self, key, fetch):
+        """ `(fetch(), shared)`, sharing the result of a `fetch` for `key`
+            already in flight (see `coalesce`) """
+        if self._single_flight is None:
+            return fetch(), False
+        result, shared = self._single_flight.do(key, fetch)
+        if shared:
+            self.instrumentation.count('coalesced')
+        return result, shared
+
+    def _coalesced_aggregation(self, key, fetch, cube, params):
+        """ The `Aggregation` of the (url, data) that `fetch` returns """
+        (agg_url, data), shared = self._coalesced(key, fetch)
+        if shared:
+            # the query it was shared with may list measures in another order
+            data = reorder_measures(data, [m['name'] for m in params['measures']])
+        return Aggregation(data, cube, agg_url, params)
+
+    def _union_aggregation(self, url, qs_params, fetch, cube, params):
+        """ The `Aggregation` of `params`, taken out of the union of its
+            measures and those of the queries gathered with it """
+        names = qs_params['measures[]']
+
+        def fetch_union(measures):
+            union = dict(qs_params, **{'measures[]': measures})
+            key = canonical_key(url, union)
+            return self._coalesced(key, lambda: fetch(union, key))[0]
+
+        (agg_url, data), measures = self._measure_batcher.do(
+            canonical_key(url, {k: v for k, v in qs_params.items()
+                                if k != 'measures[]'}),
+            names, fetch_union)
+        if set(measures) != set(names):
+            self.instrumentation.count('measure_unions')
+            agg_url = self.aggregation_url(cube, params)
+        data = select_measures(data, names, params.get('nonempty'))
+        return Aggregation(data, cube, agg_url, params)
+
+    def _request(self, url, params=None, **kwargs):
+        with self.instrumentation.timed('request', url=url) as attributes:
+            r = self.transport.get(url, params=params, **kwargs)
+            attributes['status'] = r.status_code
+            # a streamed body isn't read yet
+            if not kwargs.get('stream'):
+                attributes['bytes'] = len(r.content)
+        return r
+
+    def _decode(self, r):
+        """ The JSON body of response `r` """
+        with self.instrumentation.timed('decode') as attributes:
+            data = self.json_loads(r.content)
+            attributes['bytes'] = len(r.content)
+        return data
@@ -0,0 +1,22 @@
+"""
+Decoding of responses: the compressions to negotiate with the server and
+the JSON decoder, `orjson` if it is installed (`pip install
+mondrian-rest[speedups]`, which also adds brotli and zstd support).
+"""
+
+import json
+
+from urllib3.util.request import ACCEPT_ENCODING
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# the content codings urllib3 can decode: gzip and deflate, and br and zstd
+# if `brotli` and `zstandard` are installed
+ACCEPT_ENCODING = ACCEPT_ENCODING.replace(',', ', ')
+
+
+# decodes a JSON document (bytes or str)
+json_loads = orjson.loads if orjson is not None else json.loads
@@ -1,10 +1,9 @@
+import re
+from functools import lru_cache
+
 # ported from olap4j
 # https://github.com/olap4j/olap4j/blob/b8eccd85753ffddb66c9d8b7c2cd7de2bd510ce0/src/org/olap4j/impl/IdentifierParser.java
 
-STATE = type('Enum',
-             (),
-             dict(START=0, BEFORE_SEG=1, IN_BRACKET_SEG=2, AFTER_SEG=3, IN_SEG=4))
-
 SYNTAX = type('Enum',
              (),
              dict(NAME=0, FIRST_KEY=1, NEXT_KEY=2))
@@ -14,22 +13,43 @@ QUOTING = type('Enum',
                dict(UNQUOTED=0, QUOTED=1, KEY=2))
 
 class Segment(object):
+    __slots__ = ('_name', '_quoting', '_unquoted')
+
     def __init__(self, name, quoting):
-        self._name = name
-        self._quoting = quoting
+        set_ = super(Segment, self).__setattr__
+        set_('_name', name)
+        set_('_quoting', quoting)
+        # unquote
+        set_('_unquoted', name[1:-1] if quoting == QUOTING.QUOTED else name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Segment is immutable")
 
     @property
     def name(self):
-        if self._quoting == QUOTING.QUOTED:
-            # unquote
-            return self._name[1:-1]
-        else:
-            return self._name
+        return self._unquoted
+
+    @property
+    def quoting(self):
+        return self._quoting
+
+    def __eq__(self, other):
+        return isinstance(other, Segment) \
+            and (self._name, self._quoting) == (other._name, other._quoting)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self._name, self._quoting))
 
     def __repr__(self):
         return "<Segment \'%s\' quoting=%d>" % (self._name, self._quoting)
 
-class Identifier(object):
+
+class IdentifierBuilder(object):
+    """ Accumulates the segments of an identifier while it's parsed """
+
     def __init__(self):
         self._segments = []
         self._subsegments = []
@@ -56,150 +76,128 @@ class Identifier(object):
         else:
             self._subsegments.append(segment)
 
-    def __str__(self):
+    def build(self, cls=None):
         self._flush_subsegments()
+        return (cls or Identifier)(self._segments)
+
+
+class Identifier(object):
+    """ An (immutable) parsed MDX identifier """
+    __slots__ = ('_segments', )
+
+    def __init__(self, segments=()):
+        super(Identifier, self).__setattr__('_segments', tuple(segments))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Identifier is immutable")
+
+    def __str__(self):
         return '.'.join([s.name for s in self._segments])
 
     def __getitem__(self, i):
         return self._segments[i]
 
+    def __len__(self):
+        return len(self._segments)
+
+    def __eq__(self, other):
+        return isinstance(other, Identifier) \
+            and self._segments == other._segments
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._segments)
+
+    def __repr__(self):
+        return '<Identifier %s>' % list(self._segments)
+
     @property
     def segments(self):
-        self._flush_subsegments()
         return self._segments
 
     @classmethod
     def parse(cls, string):
-        k = len(string)
-
-        pstate = { 'i': 0, 'state': STATE.START, 'start': 0, 'syntax': SYNTAX.NAME }
-
-        ident = cls()
-
-        #ipdb.set_trace()
-        def inner():
-
-            c = string[pstate['i']]
-
-            if pstate['state'] in (STATE.START, STATE.BEFORE_SEG):
-                if c == '[':
-                    pstate.update({
-                        'i': pstate['i'] + 1,
-                        'start': pstate['i'],
-                        'state': STATE.IN_BRACKET_SEG
-                    })
-                elif c == ' ':
-                    pstate['i'] += 1
-                elif c in (',', '}', '\0'):
-                    return
-                elif c == '.':
-                    raise ValueError("Unexpected '.'")
-                elif c == '&':
-                    pstate['i'] += 1
-                    if pstate['syntax'] != SYNTAX.NAME:
-                        raise ValueError("Unexpected '&'")
-                    pstate['syntax'] = SYNTAX.FIRST_KEY
-                else:
-                    pstate.update({
-                        'state': STATE.IN_SEG,
-                        'start': pstate['i']
-                    })
-
-            elif pstate['state'] == STATE.IN_SEG:
-                if c in (',', ')', '}', '\0'):
-                    ident.add_segment(string[pstate['start']:pstate['i']].strip(),
-                                       QUOTING.UNQUOTED,
-                                       pstate['syntax'])
-                    pstate['state'] = STATE.AFTER_SEG
-                    return
-                elif c == '.':
-                    ident.add_segment(string[pstate['start']:pstate['i']].strip(),
-                                       QUOTING.UNQUOTED,
-                                       pstate['syntax'])
-                    pstate.update({
-                        'syntax': SYNTAX.NAME,
-                        'state': STATE.BEFORE_SEG,
-                        'i': pstate['i'] + 1
-                    })
-                elif c == '&':
-                    ident.add_segment(string[pstate['start']:pstate['i']].strip(),
-                                       QUOTING.UNQUOTED,
-                                       pstate['syntax'])
-                    pstate.update({
-                        'syntax': SYNTAX.NEXT_KEY,
-                        'state': STATE.BEFORE_SEG,
-                        'i': pstate['i'] + 1
-                    })
-
-                else:
-                    pstate['i'] += 1
-
-            elif pstate['state'] == STATE.IN_BRACKET_SEG:
-                if c == '\0':
-                   raise ValueError("Expected ']', in member identifier %s" % string)
-                if c == ']':
-                    if string[pstate['i']+1] == ']':
-                        pstate['i'] += 2
-                        # fall through
-                    else:
-                        ident.add_segment(string[pstate['start']:pstate['i']+1].strip().replace(']]', ']'),
-                                           QUOTING.QUOTED,
-                                           pstate['syntax'])
-                        pstate.update({
-                            'i': pstate['i'] + 1,
-                            'state': STATE.AFTER_SEG
-                        })
-                else:
-                    pstate['i'] += 1
-            elif pstate['state'] == STATE.AFTER_SEG:
-                if c == ' ':
-                    pstate['i'] += 1
-                elif c == '.':
-                    pstate.update({
-                        'state': STATE.BEFORE_SEG,
-                        'syntax': SYNTAX.NAME,
-                        'i': pstate['i'] + 1
-                    })
-                elif c == '&':
-                    pstate['state']= STATE.BEFORE_SEG
-                    # Roll the syntax - NAME=>FIRST_KEY=>NEXT_KEY=>NEXT_KEY...
-                    if pstate['syntax'] == SYNTAX.NAME:
-                        pstate['syntax'] = SYNTAX.FIRST_KEY
-                    else:
-                        pstate['syntax'] = SYNTAX.NEXT_KEY
-                    pstate['i'] += 1
-                elif c == '\0':
-                    pstate['i'] += 1
-                    return
+        """ Parse `string`. Results are memoized (identifiers are
+            immutable, so they can be shared). """
+        return _parse(cls, string)
+
+
+PARSE_CACHE_SIZE = 4096
+
+_SPACES = re.compile(r' *')
+_BRACKET_SEG = re.compile(r'\[((?:[^\]]|\]\])*)\]')
+_UNQUOTED_SEG = re.compile(r'[^.&,)}]*')
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse(cls, string):
+    """
+    Single pass tokenizer, equivalent to the character by character port
+    of olap4j's parser it replaces: every iteration
+    consumes a whole segment and the separator that follows it.
+    """
+    k = len(string)
+    ident = IdentifierBuilder()
+    syntax = SYNTAX.NAME
+
+    i = _SPACES.match(string).end()
+    if i == k:
+        return ident.build(cls)
+
+    while True:
+        if i == k:
+            raise ValueError(
+                "Expected identifier after '.', in member identifier %s" %
+                string)
+
+        c = string[i]
+        if c == '[':
+            m = _BRACKET_SEG.match(string, i)
+            if m is None:
+                raise ValueError(
+                    "Expected ']', in member identifier %s" % string)
+            ident.add_segment('[%s]' % m.group(1).replace(']]', ']'),
+                              QUOTING.QUOTED, syntax)
+            i = _SPACES.match(string, m.end()).end()
+            if i == k:
+                break
+            c = string[i]
+            if c == '.':
+                syntax = SYNTAX.NAME
+            elif c == '&':
+                # Roll the syntax - NAME=>FIRST_KEY=>NEXT_KEY=>NEXT_KEY...
+                syntax = SYNTAX.FIRST_KEY if syntax == SYNTAX.NAME \
+                    else SYNTAX.NEXT_KEY
             else:
-                raise AssertionError("Unexpected state: " + str(pstate))
-
-        # this sucks, but lets me keep the algorithm
-        # close to the original
-        string += '\0'
-        while pstate['i'] < k + 1:
-            inner()
-
-        if pstate['state'] == STATE.START:
-            pass
-        elif pstate['state'] == STATE.BEFORE_SEG:
-            raise ValueError("Expected identifier after '.', in member identifier %s" % string)
-        elif pstate['state'] == STATE.IN_BRACKET_SEG:
-            ValueError("Expected ']' in member identifier %s" % string)
-
-        return ident
-
-
-if __name__ == '__main__':
-    # TODO: port these tests
-    # https://github.com/olap4j/olap4j/blob/b8eccd85753ffddb66c9d8b7c2cd7de2bd510ce0/testsrc/org/olap4j/impl/Olap4jUtilTest.java#L358
-    print(Identifier.parse('[Date].[Year].[2010]').segments)
-    print()
-    print(Identifier.parse("[string].[with].[a [bracket]] in it]").segments)
-    print()
-    print(Identifier.parse("Time.1997.[Q3]").segments)
-    print()
-    print(Identifier.parse("[Customers].[City].&[San Francisco]&CA&USA.&[cust1234]").segments)
-    print()
-    print(Identifier.parse("[Date].Year").segments)
-    print()
+                raise ValueError("Unexpected '%s', in member identifier %s" %
+                                 (c, string))
+        elif c == '&':
+            if syntax != SYNTAX.NAME:
+                raise ValueError("Unexpected '&'")
+            syntax = SYNTAX.FIRST_KEY
+        elif c == '.':
+            raise ValueError("Unexpected '.'")
+        elif c in ',)}':
+            raise ValueError("Unexpected '%s', in member identifier %s" %
+                             (c, string))
+        else:
+            end = _UNQUOTED_SEG.match(string, i).end()
+            ident.add_segment(string[i:end].strip(), QUOTING.UNQUOTED,
+                              syntax)
+            if end == k:
+                break
+            c = string[end]
+            if c == '.':
+                syntax = SYNTAX.NAME
+            elif c == '&':
+                syntax = SYNTAX.NEXT_KEY
+            else:
+                raise ValueError("Unexpected '%s', in member identifier %s" %
+                                 (c, string))
+            i = end
+
+        i = _SPACES.match(string, i + 1).end()
+
+    return ident.build(cls)
@@ -0,0 +1,203 @@
+"""
+Timings and sizes of the phases of a query: the HTTP request, the JSON
+decoding of the response and the building of `tidy` rows or DataFrames.
+
+Every `MondrianClient` has an `Instrumentation`, which keeps counters and
+latency histograms and passes every `Event` to the hooks subscribed to it,
+eg: a `LoggingHook` or a `SpanHook` (OpenTelemetry-style spans).
+"""
+
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+# upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+class Event(object):
+    """ A phase of a query: `name` (eg: 'request', 'decode', 'tidy',
+        'to_pandas'), when it started (`time.time()`), how long it took (in
+        seconds) and its `attributes` (eg: `bytes`, `url`, `rows`) """
+    __slots__ = ('name', 'start', 'duration', 'attributes')
+
+    def __init__(self, name, start, duration, attributes):
+        self.name = name
+        self.start = start
+        self.duration = duration
+        self.attributes = attributes
+
+    def __repr__(self):
+        return '<Event %s %.3fms %r>' % (self.name, self.duration * 1e3,
+                                         self.attributes)
+
+
+class Histogram(object):
+    """ Counts of observations in the buckets of `bounds` (the last bucket
+        holds everything above them) """
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """ Upper bound of the bucket holding the `q` quantile (None if it
+            is above the last bound, or nothing was observed) """
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def as_dict(self):
+        return {'bounds': list(self.bounds), 'counts': list(self.counts),
+                'count': self.count, 'sum': self.sum}
+
+
+class Instrumentation(object):
+    """
+    Collects the events of a client: counts requests, bytes received, cache
+    hits and misses, coalesced requests, results rolled up from cached ones
+    and those taken out of a union of measures, keeps a latency histogram
+    per phase, and calls each subscribed hook with every `Event`.
+
+    Hooks are called synchronously, from the thread that ran the phase, so
+    they should be quick. Exceptions raised by hooks are logged and
+    otherwise ignored.
+    """
+
+    def __init__(self, hooks=()):
+        self.hooks = list(hooks)
+        self._lock = threading.Lock()
+        self._counters = dict(requests=0, bytes=0, errors=0, cache_hits=0,
+                              cache_misses=0, coalesced=0, rollups=0,
+                              measure_unions=0)
+        self._histograms = {}
+
+    def subscribe(self, hook):
+        """ Call `hook(event)` on every event """
+        self.hooks.append(hook)
+        return hook
+
+    def unsubscribe(self, hook):
+        self.hooks.remove(hook)
+
+    @property
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+    @property
+    def histograms(self):
+        """ The latency `Histogram` of every phase, by name """
+        with self._lock:
+            return dict(self._histograms)
+
+    def count(self, counter, n=1):
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + n
+
+    def emit(self, name, start, duration, **attributes):
+        """ Record the phase `name` """
+        event = Event(name, start, duration, attributes)
+        with self._lock:
+            if name == 'request':
+                self._counters['requests'] += 1
+                self._counters['bytes'] += attributes.get('bytes') or 0
+                status = attributes.get('status')
+                if attributes.get('error') or \
+                   (isinstance(status, int) and status >= 400):
+                    self._counters['errors'] += 1
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(duration)
+
+        for hook in self.hooks:
+            try:
+                hook(event)
+            except Exception:
+                logging.getLogger(__name__).exception(
+                    'Instrumentation hook %r failed', hook)
+        return event
+
+    @contextmanager
+    def timed(self, name, **attributes):
+        """ Time the enclosed block as phase `name`. Yields its attributes,
+            which the block can add to (eg: the size of a response). """
+        start = time.time()
+        t0 = time.perf_counter()
+        try:
+            yield attributes
+        except Exception as e:
+            attributes['error'] = type(e).__name__
+            raise
+        finally:
+            self.emit(name, start, time.perf_counter() - t0, **attributes)
+
+
+def instrumentation_of(cube):
+    """ The `Instrumentation` of the client of `cube`, if any """
+    return getattr(getattr(cube, 'client', None), 'instrumentation', None)
+
+
+@contextmanager
+def timed(instrumentation, name, **attributes):
+    """ `instrumentation.timed`, or a no-op if `instrumentation` is None """
+    if instrumentation is None:
+        yield attributes
+    else:
+        with instrumentation.timed(name, **attributes) as a:
+            yield a
+
+
+class LoggingHook(object):
+    """ Hook logging every event to `logger` (by default, this module's) """
+
+    def __init__(self, logger=None, level=logging.DEBUG):
+        self.logger = logger if logger is not None \
+            else logging.getLogger(__name__)
+        self.level = level
+
+    def __call__(self, event):
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(
+                self.level, '%s %.1fms %s', event.name, event.duration * 1e3,
+                ' '.join('%s=%s' % kv for kv in sorted(event.attributes.items())))
+
+
+class SpanHook(object):
+    """
+    Hook recording every event as a span of an OpenTelemetry-style `tracer`:
+    anything with `start_span(name, start_time=ns, attributes=dict)`
+    returning spans with `end(end_time=ns)`, like
+    `opentelemetry.trace.get_tracer(...)`. The spans are exported by
+    whatever the tracer is set up with: no collector needs to be running.
+    """
+
+    def __init__(self, tracer, prefix='mondrian_rest.'):
+        self.tracer = tracer
+        self.prefix = prefix
+
+    def __call__(self, event):
+        start = int(event.start * 1e9)
+        attributes = {k: v for k, v in event.attributes.items()
+                      if isinstance(v, (bool, int, float, str))}
+        span = self.tracer.start_span(self.prefix + event.name,
+                                      start_time=start,
+                                      attributes=attributes)
+        span.end(end_time=start + int(event.duration * 1e9))
@@ -0,0 +1,170 @@
+"""
+Incremental reader for the JSON cell sets returned by the `aggregate`
+endpoint of mondrian-rest, so that large responses can be consumed
+cell by cell instead of being decoded (and held in memory) as a whole.
+"""
+
+import codecs
+import json
+
+WHITESPACE = ' \t\n\r'
+
+_decoder = json.JSONDecoder()
+
+
+class JSONStream(object):
+    """ Pull parser over an iterable of (byte or text) chunks of a JSON
+        document. Containers are walked with `iter_object` and
+        `iter_array`; any other value is decoded whole with `value`. """
+
+    def __init__(self, chunks, encoding='utf-8'):
+        self._chunks = iter(chunks)
+        self._text_decoder = codecs.getincrementaldecoder(encoding)()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self, minimum=1):
+        """ Buffer at least `minimum` more characters (or as many as are
+            left). Returns False if there was nothing left to read. """
+        # drop what has already been consumed
+        self._buf = self._buf[self._pos:]
+        self._pos = 0
+
+        start = size = len(self._buf)
+        want = start + minimum
+        chunks = [self._buf]
+        while size < want and not self._eof:
+            try:
+                chunk = next(self._chunks)
+            except StopIteration:
+                self._eof = True
+                chunk = self._text_decoder.decode(b'', final=True)
+            if isinstance(chunk, bytes):
+                chunk = self._text_decoder.decode(chunk)
+            chunks.append(chunk)
+            size += len(chunk)
+        self._buf = ''.join(chunks)
+
+        return size > start
+
+    def peek(self):
+        """ Return the next non-whitespace character ('' at the end) """
+        while True:
+            buf, pos, k = self._buf, self._pos, len(self._buf)
+            while pos < k and buf[pos] in WHITESPACE:
+                pos += 1
+            self._pos = pos
+            if pos < k:
+                return buf[pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, c):
+        found = self.peek()
+        if found != c:
+            raise ValueError("Expected '%s', found '%s'" % (c, found))
+        self._pos += 1
+
+    def value(self):
+        """ Decode the JSON value at the current position """
+        self.peek()
+        while True:
+            try:
+                v, end = _decoder.raw_decode(self._buf, self._pos)
+            except ValueError:
+                # incomplete value: read (at least) as much again
+                if not self._fill(max(len(self._buf) - self._pos, 4096)):
+                    raise
+                continue
+
+            # a number might continue in the next chunk
+            if end == len(self._buf) and not self._eof:
+                self._fill()
+                continue
+
+            self._pos = end
+            return v
+
+    def iter_object(self):
+        """ Iterate over the keys of the object at the current position.
+            The value of each key must be consumed before advancing. """
+        self.expect('{')
+        if self.peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            c = self.peek()
+            self._pos += 1
+            if c == '}':
+                return
+            elif c != ',':
+                raise ValueError("Expected ',' or '}', found '%s'" % c)
+
+    def iter_array(self):
+        """ Iterate over the indexes of the array at the current position.
+            Each element must be consumed before advancing. """
+        self.expect('[')
+        if self.peek() == ']':
+            self._pos += 1
+            return
+        i = 0
+        while True:
+            yield i
+            c = self.peek()
+            self._pos += 1
+            if c == ']':
+                return
+            elif c != ',':
+                raise ValueError("Expected ',' or ']', found '%s'" % c)
+            i += 1
+
+
+def iter_values(stream, depth, coords=()):
+    """ Walk `depth` levels of nested arrays, yielding the coordinates and
+        the decoded value of every element below them """
+    if depth == 0:
+        yield coords, stream.value()
+        return
+
+    for i in stream.iter_array():
+        for cell in iter_values(stream, depth - 1, coords + (i, )):
+            yield cell
+
+
+class AggregationStream(object):
+    """ Reads an aggregation response, decoding everything up to `values`
+        (ie: `axes` and `axis_dimensions`) upfront, into `data`. The cells
+        in `values` are decoded as `cells()` is iterated. """
+
+    def __init__(self, chunks):
+        self._stream = JSONStream(chunks)
+        self._keys = self._stream.iter_object()
+        self.data = {}
+
+        for key in self._keys:
+            if key == 'values':
+                break
+            self.data[key] = self._stream.value()
+        else:
+            self._keys = None
+
+        if self._keys is not None and 'axes' not in self.data:
+            raise ValueError("Can't stream a response with `values` before `axes`")
+
+    def cells(self):
+        """ Iterate over the (coordinates, measure values) of every cell, in
+            the order of the response. Coordinates are in axis order. """
+        if self._keys is None:
+            return
+
+        depth = len(self.data['axes']) - 1
+        for coords, cell in iter_values(self._stream, depth):
+            yield tuple(reversed(coords)), cell
+
+        for key in self._keys:
+            self.data[key] = self._stream.value()
+        self._keys = None
@@ -0,0 +1,163 @@
+"""
+Catalog of the members of the levels of cubes, indexed by key, caption and
+full name, so that cuts can be built from user input with local lookups.
+"""
+
+import json
+import os
+import threading
+import time
+
+from .cache import entry_path, read_entry, remove_entries, write_entry
+from .decoding import json_loads
+
+
+def set_cut(full_names):
+    """ The cut selecting the members with `full_names` """
+    full_names = list(full_names)
+    if len(full_names) == 1:
+        return full_names[0]
+    return '{%s}' % ','.join(full_names)
+
+
+class LevelMembers(object):
+    """
+    The members of a level (as returned by `Cube.get_members`), indexed by
+    their key, caption and full name. Keys can also be looked up by their
+    string form (eg: '2010' for the key 2010).
+    """
+
+    def __init__(self, members):
+        self.members = members
+        self.by_key = {}
+        self.by_caption = {}
+        self.by_full_name = {}
+        for m in members:
+            self.by_key.setdefault(m['key'], m)
+            self.by_key.setdefault(str(m['key']), m)
+            self.by_caption.setdefault(m['caption'], m)
+            self.by_full_name.setdefault(m['full_name'], m)
+
+    def __len__(self):
+        return len(self.members)
+
+    def __iter__(self):
+        return iter(self.members)
+
+    def __repr__(self):
+        return '<LevelMembers (%d)>' % len(self.members)
+
+    def get(self, value, by='key'):
+        """ The member whose `by` ('key', 'caption' or 'full_name') is
+            `value`, or None """
+        return self._index(by).get(value)
+
+    def resolve(self, values, by='key'):
+        """ The members whose `by` is each of `values`. Raises `KeyError`
+            with those that aren't members of the level. """
+        index = self._index(by)
+        members = [index.get(v) for v in values]
+        missing = [v for v, m in zip(values, members) if m is None]
+        if missing:
+            raise KeyError('Not members of the level: %r' % missing)
+        return members
+
+    def cut(self, values, by='key'):
+        """ The cut selecting the members whose `by` is each of `values` """
+        return set_cut(m['full_name'] for m in self.resolve(values, by))
+
+    def _index(self, by):
+        try:
+            return {'key': self.by_key,
+                    'caption': self.by_caption,
+                    'full_name': self.by_full_name}[by]
+        except KeyError:
+            raise ValueError('Unknown member attribute `%s`' % by)
+
+
+class MemberCatalog(object):
+    """
+    Cache of the members of levels (the responses of the `members`
+    endpoint), as `LevelMembers`.
+
+    Entries expire `ttl` seconds after being stored (`None`: never). If
+    `directory` is given, responses are also written there and survive the
+    process.
+
+    Safe to share between threads.
+    """
+
+    def __init__(self, ttl=None, directory=None):
+        self.ttl = ttl
+        self.directory = directory
+
+        # (cube, dimension, level) -> (stored_at, LevelMembers)
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, cube_name, dimension, level):
+        """ Return the `LevelMembers` of `level`, or None """
+        key = (cube_name, dimension, level)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[0]):
+                del self._entries[key]
+                entry = None
+        if entry is not None:
+            return entry[1]
+
+        hit = self._disk_get(key)
+        if hit is None:
+            return None
+        stored_at, body = hit
+        members = LevelMembers(json_loads(body)['members'])
+        with self._lock:
+            self._entries[key] = (stored_at, members)
+        return members
+
+    def set(self, cube_name, dimension, level, body, data):
+        """ Store the members of `level`: the response `body` (bytes) of the
+            `members` endpoint, which decodes to `data`. Returns them as
+            `LevelMembers`. """
+        key = (cube_name, dimension, level)
+        members = LevelMembers(data['members'])
+        with self._lock:
+            self._entries[key] = (time.time(), members)
+        if self.directory is not None:
+            write_entry(self._path(key), {'key': list(key)}, body)
+        return members
+
+    def invalidate(self, cube_name=None):
+        """ Drop the members of every level of `cube_name` (all of them if
+            None) """
+        with self._lock:
+            for key in [k for k in self._entries
+                        if cube_name is None or k[0] == cube_name]:
+                del self._entries[key]
+
+        if self.directory is not None:
+            remove_entries(self.directory, cube_name)
+
+    def _expired(self, stored_at):
+        return self.ttl is not None and time.time() - stored_at > self.ttl
+
+    def _path(self, key):
+        return entry_path(self.directory, key[0], json.dumps(key[1:]))
+
+    def _disk_get(self, key):
+        if self.directory is None:
+            return None
+        path = self._path(key)
+        try:
+            stored_at = os.path.getmtime(path)
+            if self._expired(stored_at):
+                os.remove(path)
+                return None
+            header, body = read_entry(path)
+        except (IOError, OSError):
+            return None
+
+        # guard against hash collisions
+        if header['key'] != list(key):
+            return None
+        return stored_at, body
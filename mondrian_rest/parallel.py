@@ -0,0 +1,163 @@
+"""
+Converting the values of large aggregations in several processes (see
+`Aggregation.to_pandas`, `workers`). Turning the Python objects of the
+response into typed arrays holds the GIL, so it's done by worker
+processes: the cells are split into contiguous blocks along the outermost
+axis of `values` (the last axis), and each worker writes the values of its
+blocks into buffers shared with the parent.
+
+Workers are forked, and so inherit the response instead of having it
+pickled to them (which would take about as long as converting it). Forking
+a process with other threads running is unsafe, so values are converted in
+the calling process where `fork` is not available, or when the process
+runs other threads (eg: those of `MondrianClient.get_aggregations`).
+
+Only the conversion of the values runs in the workers: the index is still
+built by the caller. Starting the workers takes a few milliseconds each,
+so it's only worth it for results of millions of cells, with idle cores.
+"""
+
+import mmap
+import multiprocessing
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+
+# kinds of cell values
+NULL, INT, FLOAT = 0, 1, 2
+
+# token -> (block, bits, kinds) of the conversions in progress, inherited
+# by the forked workers
+_SOURCES = {}
+
+
+def typed_values(data, workers):
+    """
+    The values of every measure of every cell of aggregation `data`, in
+    the order of the response, converted in up to `workers` processes.
+    Returns `(bits, kinds)`, two arrays of shape (cells, measures): the
+    kind of each value (`NULL`, `INT` or `FLOAT`) and the int64 or float64
+    (viewed as int64) value itself. None if they can't be converted this
+    way (see above, or values that aren't numbers).
+    """
+    sizes = [len(ax['members']) for ax in data['axes'][1:]]
+    if len(sizes) == 0 or sizes[-1] == 0:
+        return None
+
+    def block(start, stop):
+        flat = data['values'][start:stop]
+        for _ in sizes:
+            flat = chain.from_iterable(flat)
+        return flat
+
+    return _convert(block, sizes[-1], int(np.prod(sizes[:-1])),
+                    len(data['axes'][0]['members']), workers)
+
+
+def typed_cells(cells, nmeasures, workers):
+    """ Like `typed_values`, for the values of a list of `iter_cells`
+        items """
+    def block(start, stop):
+        return chain.from_iterable(c[1] for c in cells[start:stop])
+
+    return _convert(block, len(cells), 1, nmeasures, workers)
+
+
+def _convert(block, nblocks, inner, nmeasures, workers):
+    """ Convert the values of `nblocks` blocks of `inner` cells each (of
+        `nmeasures` values), which `block(start, stop)` iterates over """
+    if threading.active_count() > 1:
+        return None
+    try:
+        context = multiprocessing.get_context('fork')
+    except ValueError:
+        return None
+
+    ncells = nblocks * inner
+    if ncells * nmeasures == 0:
+        return None
+
+    # anonymous shared memory, which the forked workers write into
+    bits = np.frombuffer(mmap.mmap(-1, ncells * nmeasures * 8),
+                         dtype=np.int64).reshape(ncells, nmeasures)
+    kinds = np.frombuffer(mmap.mmap(-1, ncells * nmeasures),
+                          dtype=np.uint8).reshape(ncells, nmeasures)
+
+    bounds = np.linspace(0, nblocks, min(workers, nblocks) + 1).astype(int)
+    token = uuid.uuid4().hex
+    _SOURCES[token] = (block, bits, kinds)
+    try:
+        with ProcessPoolExecutor(len(bounds) - 1, mp_context=context) as pool:
+            converted = list(pool.map(
+                _convert_block,
+                [(token, start * inner, stop * inner, start, stop)
+                 for start, stop in zip(bounds[:-1], bounds[1:])]))
+    finally:
+        del _SOURCES[token]
+
+    if not all(converted):
+        return None
+    return bits, kinds
+
+
+def _convert_block(args):
+    """ Convert the cells of the blocks from `start` to `stop`, rows
+        `first` to `last` (in a worker) """
+    token, first, last, start, stop = args
+    block, bits, kinds = _SOURCES[token]
+    nmeasures = bits.shape[1]
+
+    flat = np.fromiter(block(start, stop), dtype=object,
+                       count=(last - first) * nmeasures) \
+        .reshape(-1, nmeasures)
+    return all(
+        convert_column(flat[:, mi], bits[first:last, mi],
+                       kinds[first:last, mi])
+        for mi in range(nmeasures))
+
+
+def convert_column(values, bits, kinds):
+    """ Write the (object) `values` of a measure into `bits` and `kinds`.
+        Returns False if some of them aren't numbers. """
+    notnull = pd.notnull(values)
+    inferred = pd.api.types.infer_dtype(values, skipna=True)
+    try:
+        if inferred == 'empty':
+            kinds[:] = NULL
+        elif inferred == 'integer':
+            bits[:] = np.where(notnull, values, 0).astype(np.int64)
+            kinds[:] = np.where(notnull, INT, NULL)
+        elif inferred == 'floating':
+            bits[:] = values.astype(np.float64).view(np.int64)
+            kinds[:] = np.where(notnull, FLOAT, NULL)
+        elif inferred == 'mixed-integer-float':
+            isint = np.fromiter((type(v) is int for v in values), dtype=bool,
+                                count=len(values))
+            ints, floats = notnull & isint, notnull & ~isint
+            bits[ints] = values[ints].astype(np.int64)
+            bits[floats] = values[floats].astype(np.float64).view(np.int64)
+            kinds[:] = np.where(ints, INT, np.where(floats, FLOAT, NULL))
+        else:
+            return False
+    except OverflowError:
+        return False
+    return True
+
+
+def typed_column(bits, kinds, has_nulls=False):
+    """ The values (`bits` and `kinds`, see `typed_values`) of a measure,
+        typed like `aggregation.measure_column` types them """
+    ints, floats = kinds == INT, kinds == FLOAT
+    if not (ints.any() or floats.any()):
+        return np.full(len(kinds), None, dtype=object)
+    if ints.all() and not has_nulls:
+        return np.array(bits)
+
+    column = bits.view(np.float64).copy()
+    column[ints] = bits[ints]
+    column[kinds == NULL] = np.nan
+    return column
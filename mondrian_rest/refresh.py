@@ -0,0 +1,59 @@
+"""
+Incremental refresh of results along the time dimension (see
+`Cube.refresh_aggregation`): the periods of a stored result from the last
+one on are queried again, and replace those of the stored result.
+"""
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+
+
+def period_keys(result, column):
+    """ The distinct values of `column` (an index level or a column) of
+        `result`, a DataFrame or a `pyarrow.Table` """
+    if isinstance(result, pd.DataFrame):
+        if column in result.index.names:
+            return set(result.index.unique(column))
+        return set(result[column].unique())
+    return set(pc.unique(result.column(column)).to_pylist())
+
+
+def periods_to_refresh(members, stored_keys, overlap=1):
+    """
+    The `members` of a time level (in chronological order) from the last
+    `overlap` of those with `stored_keys` on, or None if every one of them
+    has to be queried.
+    """
+    positions = [i for i, m in enumerate(members) if m['key'] in stored_keys]
+    if len(positions) == 0:
+        return None
+    start = max(positions[-1] - overlap + 1, 0)
+    if start == 0:
+        return None
+    return members[start:]
+
+
+def merge_periods(previous, new, column, keys):
+    """ `previous` without the periods (values of `column`) in `keys`,
+        followed by `new` """
+    if isinstance(previous, pd.DataFrame):
+        if column in previous.index.names:
+            values = previous.index.get_level_values(column)
+        else:
+            values = previous[column]
+        return pd.concat([previous[~values.isin(list(keys))], new])
+
+    values = previous.column(column)
+    value_type = values.type.value_type \
+        if pa.types.is_dictionary(values.type) else values.type
+    kept = previous.filter(pc.invert(pc.is_in(
+        values, value_set=pa.array(list(keys), type=value_type))))
+    merged = pa.concat_tables(
+        [kept, new.select(kept.column_names).cast(kept.schema)])
+    # one dictionary per column, as Arrow IPC files (see `ResultStore`) hold
+    return merged.unify_dictionaries().combine_chunks()
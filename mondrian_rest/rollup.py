@@ -0,0 +1,131 @@
+"""
+Rolling up results: a query drilling down a level can be answered from the
+(cached) result of the same query drilled down to a finer level of that
+hierarchy with `parents`, as the ancestors of its members are the members
+of the coarser level (see `MondrianClient.get_aggregation`).
+"""
+
+import numpy as np
+import pandas as pd
+
+from .aggregation import flat_values
+
+# how the values of a measure are rolled up, by (Mondrian) aggregator
+ROLLUPS = {
+    'sum': np.add,
+    'count': np.add,
+    'min': np.fmin,
+    'max': np.fmax,
+}
+
+
+def measure_rollup(measure):
+    """
+    The ufunc that rolls the values of `measure` up, or None if they can't
+    be. An `additive` annotation ('true' or 'false') takes precedence over
+    the aggregator of the measure.
+    """
+    additive = (measure.get('annotations') or {}).get('additive')
+    if additive is not None:
+        return np.add if str(additive).lower() == 'true' else None
+    return ROLLUPS.get((measure.get('aggregator') or '').lower())
+
+
+def finer_queries(cube, params):
+    """
+    Yield the `(params, axis, level)` of the queries a query with `params`
+    can be rolled up from, nearest level first: `params` with the `level`
+    drilled down at `axis` (an index of `params['drilldown']`) replaced by
+    a finer one of its hierarchy, and `parents`. None if the measures can't
+    be rolled up, or the query asks for properties or captions.
+
+    Levels and measures may be schema objects or raw dicts: the levels are
+    looked up in `cube`.
+    """
+    if params.get('properties') or params.get('caption'):
+        return
+    if not all(measure_rollup(m) for m in params['measures']):
+        return
+    try:
+        levels = [cube.get_level_by_full_name(l['full_name'])
+                  for l in params['drilldown']]
+    except ValueError:
+        return
+
+    hierarchies = [h for d in cube.dimensions for h in d.hierarchies]
+    for axis, level in enumerate(levels):
+        hierarchy = next(h for h in hierarchies
+                         if level.full_name in (l.full_name for l in h.levels))
+        names = set(l.full_name for l in hierarchy.levels)
+        if any(l.full_name in names for i, l in enumerate(levels)
+               if i != axis):
+            continue
+        for finer in hierarchy.levels[level.depth + 1:]:
+            drilldown = list(params['drilldown'])
+            drilldown[axis] = finer
+            yield dict(params, drilldown=drilldown, parents=True), axis, level
+
+
+def roll_up(data, axis, level, parents, rollups):
+    """
+    Roll aggregation `data` up to `level` along `axis` (an index of the
+    non-measure axes), whose members must have their `ancestors`. The
+    values of each measure are rolled up with the ufunc in `rollups`;
+    the ancestors of the new members are kept if `parents`.
+    """
+    members = data['axes'][axis + 1]['members']
+
+    # the members of `level`, in the order they are first seen, and the
+    # index of that of each member of the finer level
+    coarse = []
+    positions = {}  # full name -> index in `coarse`
+    codes = np.empty(len(members), dtype=np.intp)
+    for i, m in enumerate(members):
+        ancestors = m['ancestors']
+        a = next(a for a in ancestors if a['depth'] == level.depth)
+        if a['full_name'] not in positions:
+            positions[a['full_name']] = len(coarse)
+            member = dict(a)
+            if parents:
+                member['ancestors'] = [
+                    aa for aa in ancestors if aa['depth'] < level.depth]
+            coarse.append(member)
+        codes[i] = positions[a['full_name']]
+
+    axes = list(data['axes'])
+    axes[axis + 1] = dict(axes[axis + 1], members=coarse)
+    axis_dimensions = list(data['axis_dimensions'])
+    axis_dimensions[axis + 1] = dict(axis_dimensions[axis + 1],
+                                     level=level.name, level_depth=level.depth)
+    if len(members) == 0:
+        return dict(data, axes=axes, axis_dimensions=axis_dimensions)
+
+    sizes = [len(ax['members']) for ax in data['axes'][1:]]
+    nmeasures = len(rollups)
+    values = flat_values(data).reshape(tuple(reversed(sizes)) + (nmeasures, ))
+
+    # group the members of `axis` (moved first) together, in order
+    order = np.argsort(codes, kind='stable')
+    starts = np.flatnonzero(np.r_[True, np.diff(codes[order]) != 0])
+    values = np.moveaxis(values, len(sizes) - 1 - axis, 0)[order]
+
+    rolled = []
+    for mi, ufunc in enumerate(rollups):
+        mvalues = values[..., mi]
+        notnull = pd.notnull(mvalues)
+        typed = pd.Series(mvalues[notnull]).infer_objects()
+        numbers = np.where(notnull, mvalues,
+                           0 if ufunc is np.add else np.nan).astype('float64')
+
+        result = ufunc.reduceat(numbers, starts, axis=0)
+        empty = ~np.logical_or.reduceat(notnull, starts, axis=0)
+        if typed.dtype.kind in 'iu':
+            result = np.where(empty, 0, result).astype('int64')
+        result = result.astype(object)
+        result[empty] = None
+        rolled.append(result)
+
+    rolled = np.moveaxis(np.stack(rolled, axis=-1), 0, len(sizes) - 1 - axis)
+
+    return dict(data, axes=axes, axis_dimensions=axis_dimensions,
+                values=rolled.tolist())
@@ -0,0 +1,91 @@
+"""
+Indexed model of a cube schema, built once from the `cubes` endpoint
+response. Every object keeps dict-style access to its raw attributes (so
+`level['full_name']` keeps working) and adds attributes and lookup tables.
+"""
+
+from collections.abc import Mapping
+
+
+class SchemaObject(Mapping):
+    """ Read-only mapping over the raw attributes of a schema object """
+    __slots__ = ('_raw', )
+
+    # keys served by an attribute holding the indexed (not raw) children
+    _children = ()
+
+    def __init__(self, raw):
+        self._raw = raw
+
+    def __getitem__(self, key):
+        if key in self._children:
+            return getattr(self, key)
+        return self._raw[key]
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def __len__(self):
+        return len(self._raw)
+
+    def __repr__(self):
+        return '<%s %s>' % (type(self).__name__,
+                            self._raw.get('full_name', self._raw.get('name')))
+
+    @property
+    def raw(self):
+        """ The attributes as returned by the server """
+        return self._raw
+
+
+class Measure(SchemaObject):
+    __slots__ = ('name', 'full_name', 'caption', 'annotations', 'aggregator')
+
+    def __init__(self, raw):
+        super(Measure, self).__init__(raw)
+        self.name = raw['name']
+        self.full_name = raw.get('full_name')
+        self.caption = raw.get('caption')
+        self.annotations = raw.get('annotations', {})
+        self.aggregator = raw.get('aggregator')
+
+
+class Level(SchemaObject):
+    __slots__ = ('name', 'full_name', 'caption', 'depth')
+
+    def __init__(self, raw, depth):
+        super(Level, self).__init__(raw)
+        self.name = raw['name']
+        self.full_name = raw.get('full_name')
+        self.caption = raw.get('caption')
+        self.depth = depth
+
+
+class Hierarchy(SchemaObject):
+    __slots__ = ('name', 'levels', 'levels_by_name')
+
+    _children = ('levels', )
+
+    def __init__(self, raw):
+        super(Hierarchy, self).__init__(raw)
+        self.name = raw['name']
+        self.levels = [
+            Level(l, depth) for depth, l in enumerate(raw['levels'])
+        ]
+        self.levels_by_name = {l.name: l for l in self.levels}
+
+
+class Dimension(SchemaObject):
+    __slots__ = ('name', 'caption', 'type', 'annotations', 'hierarchies',
+                 'hierarchies_by_name')
+
+    _children = ('hierarchies', )
+
+    def __init__(self, raw):
+        super(Dimension, self).__init__(raw)
+        self.name = raw['name']
+        self.caption = raw.get('caption')
+        self.type = raw.get('type')
+        self.annotations = raw.get('annotations', {})
+        self.hierarchies = [Hierarchy(h) for h in raw['hierarchies']]
+        self.hierarchies_by_name = {h.name: h for h in self.hierarchies}
@@ -0,0 +1,98 @@
+"""
+Merging of the results of a query split into shards, each one cut to some
+members of a drilled down level (see `Cube.get_aggregation`).
+"""
+
+import heapq
+from collections import OrderedDict
+
+import numpy as np
+
+from .members import set_cut
+
+
+def shard_cuts(members, shard_size=1):
+    """ The cuts selecting `members` (as returned by `Cube.get_members`),
+        `shard_size` at a time """
+    names = [m['full_name'] for m in members]
+    return [set_cut(names[i:i + shard_size])
+            for i in range(0, len(names), shard_size)]
+
+
+def merge_members(member_lists):
+    """ The union (by full name) of the members in `member_lists`, in an
+        order consistent with that of every list (ties are broken by order
+        of first appearance) """
+    members = OrderedDict()
+    successors = {}
+    npredecessors = {}
+    for ml in member_lists:
+        prev = None
+        for m in ml:
+            name = m['full_name']
+            if name not in members:
+                members[name] = m
+                successors[name] = set()
+                npredecessors[name] = 0
+            if prev is not None and name not in successors[prev]:
+                successors[prev].add(name)
+                npredecessors[name] += 1
+            prev = name
+
+    # topological sort of the members
+    rank = {name: i for i, name in enumerate(members)}
+    ready = [(rank[n], n) for n, c in npredecessors.items() if c == 0]
+    heapq.heapify(ready)
+    merged = []
+    while len(merged) < len(members):
+        if len(ready) == 0:
+            # the lists disagree on the order: take the first member left
+            name = min((n for n, c in npredecessors.items() if c > 0),
+                       key=rank.get)
+            npredecessors[name] = 0
+        else:
+            name = heapq.heappop(ready)[1]
+        npredecessors[name] = -1
+        merged.append(members[name])
+        for s in successors[name]:
+            if npredecessors[s] > 0:
+                npredecessors[s] -= 1
+                if npredecessors[s] == 0:
+                    heapq.heappush(ready, (rank[s], s))
+
+    return merged
+
+
+def merge_aggregations(datas):
+    """
+    Merge the responses `datas` to the shards of a query into the response
+    to the whole query. The members of each axis are the union of those of
+    the shards, and cells missing from every shard are `None`.
+    """
+    first = datas[0]
+    naxes = len(first['axes'])
+    nmeasures = len(first['axes'][0]['members'])
+
+    axes = [first['axes'][0]] + [
+        dict(first['axes'][i],
+             members=merge_members([d['axes'][i]['members'] for d in datas]))
+        for i in range(1, naxes)
+    ]
+    index = [{m['full_name']: k for k, m in enumerate(ax['members'])}
+             for ax in axes]
+
+    # `values` are nested from the last axis in, with the measures innermost
+    shape = [len(axes[i]['members']) for i in reversed(range(1, naxes))]
+    values = np.full(shape + [nmeasures], None, dtype=object)
+    for d in datas:
+        sizes = [len(d['axes'][i]['members'])
+                 for i in reversed(range(1, naxes))]
+        if 0 in sizes:
+            continue
+        block = np.empty(sizes + [nmeasures], dtype=object)
+        block[...] = d['values']
+        positions = [[index[i][m['full_name']] for m in d['axes'][i]['members']]
+                     for i in reversed(range(1, naxes))]
+        values[np.ix_(*(positions + [range(nmeasures)]))] = block
+
+    return dict(first, axes=axes, values=values.tolist())
@@ -0,0 +1,69 @@
+"""
+Coalescing of identical concurrent requests: while a call for a key is in
+flight, callers asking for the same key wait for its result instead of
+making their own call.
+"""
+
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight(object):
+    """ Coalesces the calls of concurrent threads """
+
+    def __init__(self):
+        self._calls = {}  # key -> Future
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """
+        Return `(fn(), shared)`. If a call for `key` is already in flight,
+        wait for it and return its result (or raise its exception) instead,
+        with `shared` True.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is None:
+                future = self._calls[key] = Future()
+                leader = True
+            else:
+                leader = False
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = fn()
+        except BaseException as e:
+            self._done(key)
+            future.set_exception(e)
+            raise
+        self._done(key)
+        future.set_result(result)
+        return result, False
+
+    def _done(self, key):
+        with self._lock:
+            del self._calls[key]
+
+
+class AsyncSingleFlight(object):
+    """ Coalesces the calls of concurrent coroutines (of one event loop) """
+
+    def __init__(self):
+        self._calls = {}  # key -> Task
+
+    async def do(self, key, fn):
+        """
+        Return `(await fn(), shared)`, like `SingleFlight.do`. The call is
+        shielded: cancelling one of its callers doesn't cancel it for the
+        others.
+        """
+        task = self._calls.get(key)
+        if task is not None:
+            return await asyncio.shield(task), True
+
+        task = self._calls[key] = asyncio.ensure_future(fn())
+        task.add_done_callback(lambda t: self._calls.pop(key, None))
+        return await asyncio.shield(task), False
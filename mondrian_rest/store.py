@@ -0,0 +1,65 @@
+"""
+Local store of aggregation results in Arrow IPC files, keyed by the query
+that produced them, which are read back memory-mapped: repeated extracts
+are neither fetched nor unrolled again, and not even copied into memory.
+"""
+
+import os
+import tempfile
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+from .cache import entry_path, remove_entries
+
+KEY_METADATA = b'mondrian_rest.key'
+
+
+class ResultStore(object):
+    """
+    Arrow tables (see `Aggregation.to_arrow`) stored in `directory`, one
+    file per query. Stored tables never expire: drop them with
+    `invalidate`.
+    """
+
+    def __init__(self, directory):
+        if pa is None:
+            raise ImportError(
+                'ResultStore requires pyarrow (pip install mondrian-rest[arrow])')
+        self.directory = directory
+
+    def get(self, cube_name, key):
+        """ Return the table stored for `key` (memory-mapped), or None """
+        try:
+            path = entry_path(self.directory, cube_name, key)
+            source = pa.memory_map(path, 'r')
+        except (IOError, OSError):
+            return None
+        table = pa.ipc.open_file(source).read_all()
+
+        # guard against hash collisions
+        if (table.schema.metadata or {}).get(KEY_METADATA) != key.encode('utf-8'):
+            return None
+        return table.replace_schema_metadata(None)
+
+    def set(self, cube_name, key, table):
+        """ Store `table`, the result of the query `key` """
+        path = entry_path(self.directory, cube_name, key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+
+        table = table.replace_schema_metadata({KEY_METADATA: key.encode('utf-8')})
+
+        # write to a temporary file first, so readers never see partial files
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        os.close(fd)
+        with pa.OSFile(tmp, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp, path)
+
+    def invalidate(self, cube_name=None):
+        """ Drop every table of `cube_name` (all of them if None) """
+        remove_entries(self.directory, cube_name)
@@ -1,17 +1,33 @@
 import unittest
-from mock import patch, MagicMock, Mock
+from unittest.mock import patch, MagicMock, Mock
 from operator import itemgetter
-import sys
-if sys.version_info >= (3, 0):
-    from urllib.parse import urljoin
-else: 
-    from urlparse import urljoin
+from urllib.parse import urljoin
+import asyncio
 import json
 import os
+import shutil
+import tempfile
+import threading
+import time
 
+import numpy as np
 import requests
+import pandas as pd
 
-from .client import MondrianClient, Cube, Aggregation, CUBE_ATTRS
+from .client import MondrianClient, Cube, Aggregation, CUBE_ATTRS, aggregation_qs_params
+from .aggregation import StreamingAggregation, PropertyPlan, FlatAggregation
+from .jsonstream import AggregationStream
+from .transport import SessionTransport, DEFAULT_TIMEOUT
+from .cache import AggregationCache, SchemaCache, DECODED_SIZE_FACTOR, reorder_measures, canonical_key
+from .sharding import merge_members
+from .members import MemberCatalog
+from .rollup import measure_rollup
+from .parallel import typed_values
+from .identifier import Identifier, Segment, QUOTING
+from .async_client import AsyncMondrianClient, AsyncCube, httpx
+from .store import ResultStore
+from .instrumentation import Instrumentation, LoggingHook, SpanHook
+from .aggregation import pa, pq
 
 API_BASE = 'http://mondrian'
 FIXTURES_DIR =  os.path.join(os.path.dirname(os.path.realpath(__file__)), 'test_fixtures')
@@ -27,26 +43,28 @@ class TestMondrianClient(unittest.TestCase):
                 )) as f:
             self.cube_fixture = f.read()
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_get_cubes(self, MockRequests):
-        MockRequests.json.return_value = { 'cubes': [json.loads(self.cube_fixture)] }
+        MockRequests.return_value.content = json.dumps({'cubes': [json.loads(self.cube_fixture)]}).encode('utf-8')
         cs = self.client.get_cubes()
 
         assert len(cs) == 1
         assert type(cs[0]) == Cube
-        MockRequests.assert_called_with(urljoin(API_BASE, 'cubes'))
+        MockRequests.assert_called_with(urljoin(API_BASE, 'cubes'), params=None, timeout=DEFAULT_TIMEOUT)
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_get_one_cube(self, MockRequests):
-        MockRequests.json.return_value = self.cube_fixture
+        MockRequests.return_value.content = self.cube_fixture.encode('utf-8')
         c = self.client.get_cube('foodmart')
         assert type(c) == Cube
-        MockRequests.assert_called_with(urljoin(API_BASE, 'cubes/foodmart'))
+        MockRequests.assert_called_with(urljoin(API_BASE, 'cubes/foodmart'), params=None, timeout=DEFAULT_TIMEOUT)
 
-    @patch('client.MondrianClient._request')
+    @patch('mondrian_rest.client.MondrianClient._request')
     def test_get_aggregation(self, mock_client_request):
+        with open(os.path.join(FIXTURES_DIR, 'aggregation_response.json'), 'rb') as f:
+            mock_client_request.return_value.content = f.read()
         cube = json.loads(self.cube_fixture)
-        c = self.client.get_aggregation('exports',
+        c = self.client.get_aggregation(Cube(*(itemgetter(*CUBE_ATTRS)(cube) + (self.client,))),
                                         {
                                             'drilldown': [cube['dimensions'][0]['hierarchies'][0]['levels'][1]],
                                             'measures': [cube['measures'][0]],
@@ -64,6 +82,139 @@ class TestMondrianClient(unittest.TestCase):
             }
         )
 
+    def test_json_loads(self):
+        transport = Mock()
+        transport.get.return_value.content = self.cube_fixture.encode('utf-8')
+        loads = Mock(side_effect=json.loads)
+        c = MondrianClient(API_BASE, transport=transport, json_loads=loads).get_cube('foodmart')
+
+        assert c.name == 'exports'
+        loads.assert_called_once_with(self.cube_fixture.encode('utf-8'))
+
+    def test_custom_transport(self):
+        transport = Mock()
+        transport.get.return_value.content = self.cube_fixture.encode('utf-8')
+        c = MondrianClient(API_BASE, transport=transport).get_cube('foodmart')
+
+        assert c.name == 'exports'
+        transport.get.assert_called_with(urljoin(API_BASE, 'cubes/foodmart'), params=None)
+
+
+class TestSessionTransport(unittest.TestCase):
+    def test_session_per_thread(self):
+        import threading
+        transport = SessionTransport(pool_size=4, retries=2)
+        sessions = []
+        t = threading.Thread(target=lambda: sessions.append(transport.session))
+        t.start()
+        t.join()
+
+        assert transport.session is transport.session
+        assert sessions[0] is not transport.session
+        assert sessions[0].get_adapter(API_BASE) is transport.session.get_adapter(API_BASE)
+        assert transport.session.get_adapter(API_BASE).max_retries.total == 2
+
+    def test_accept_encoding(self):
+        transport = SessionTransport()
+        assert 'gzip' in transport.session.headers['Accept-Encoding']
+        transport = SessionTransport(accept_encoding='identity')
+        assert transport.session.headers['Accept-Encoding'] == 'identity'
+
+    @patch('requests.Session.get')
+    def test_timeout(self, MockGet):
+        transport = SessionTransport(timeout=5)
+        transport.get(API_BASE)
+        MockGet.assert_called_with(API_BASE, params=None, timeout=5)
+        transport.get(API_BASE, timeout=1)
+        MockGet.assert_called_with(API_BASE, params=None, timeout=1)
+
+    @patch('requests.Session.get')
+    def test_aggregation_timeout(self, MockGet):
+        with open(os.path.join(FIXTURES_DIR, 'aggregation_response.json'), 'rb') as f:
+            MockGet.return_value.content = f.read()
+        with open(os.path.join(FIXTURES_DIR, 'cube_export.json')) as f:
+            cube = Cube(*(itemgetter(*CUBE_ATTRS)(json.load(f)) + (MondrianClient(API_BASE),)))
+
+        cube.get_aggregation(drilldown=['Date.Year'], measures=['FOB US'])
+        assert MockGet.call_args[1]['timeout'] == DEFAULT_TIMEOUT
+        assert DEFAULT_TIMEOUT[1] is not None
+
+        cube.get_aggregation(drilldown=['Date.Year'], measures=['FOB US'], timeout=(10, None))
+        assert MockGet.call_args[1]['timeout'] == (10, None)
+
+
+class TestIdentifier(unittest.TestCase):
+    # https://github.com/olap4j/olap4j/blob/b8eccd85753ffddb66c9d8b7c2cd7de2bd510ce0/testsrc/org/olap4j/impl/Olap4jUtilTest.java#L358
+    CASES = [
+        ('[Date].[Year].[2010]',
+         [('Date', QUOTING.QUOTED), ('Year', QUOTING.QUOTED), ('2010', QUOTING.QUOTED)]),
+        ('[string].[with].[a [bracket]] in it]',
+         [('string', QUOTING.QUOTED), ('with', QUOTING.QUOTED), ('a [bracket] in it', QUOTING.QUOTED)]),
+        ('Time.1997.[Q3]',
+         [('Time', QUOTING.UNQUOTED), ('1997', QUOTING.UNQUOTED), ('Q3', QUOTING.QUOTED)]),
+        ('[Customers].[City].&[San Francisco]&CA&USA.&[cust1234]',
+         [('Customers', QUOTING.QUOTED), ('City', QUOTING.QUOTED),
+          ('&San Francisco&CA&USA', QUOTING.KEY), ('&cust1234', QUOTING.KEY)]),
+        ('[Date].Year',
+         [('Date', QUOTING.QUOTED), ('Year', QUOTING.UNQUOTED)]),
+        (' [Date] . Calendar Year ',
+         [('Date', QUOTING.QUOTED), ('Calendar Year', QUOTING.UNQUOTED)]),
+        ('', []),
+        ('[a]&[b]', [('a', QUOTING.QUOTED), ('&b', QUOTING.KEY)]),
+        ('a&b.c', [('a', QUOTING.UNQUOTED), ('&b', QUOTING.KEY), ('c', QUOTING.UNQUOTED)]),
+        ('[a]]]]b]', [('a]]b', QUOTING.QUOTED)]),
+        ('x[y]z.w', [('x[y]z', QUOTING.UNQUOTED), ('w', QUOTING.UNQUOTED)]),
+    ]
+
+    def test_parse(self):
+        for string, expected in self.CASES:
+            ident = Identifier.parse(string)
+            assert [(s.name, s.quoting) for s in ident.segments] == expected, string
+
+    def test_invalid(self):
+        for string in ['[Date', '.Date', '[Date].', '&&[Date]', '[Date].&&[2010]', '[Date]Year', 'a,b']:
+            self.assertRaises(ValueError, Identifier.parse, string)
+
+    def test_memoized(self):
+        ident = Identifier.parse('[Date].[Year]')
+
+        assert Identifier.parse('[Date].[Year]') is ident
+        assert str(ident) == 'Date.Year'
+        assert ident[1] == Segment('[Year]', QUOTING.QUOTED)
+        self.assertRaises(AttributeError, setattr, ident, 'foo', 1)
+        self.assertRaises(AttributeError, setattr, ident, '_segments', ())
+        self.assertRaises(AttributeError, setattr, ident[0], '_unquoted', 'Time')
+
+
+class TestCubeSchema(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join(FIXTURES_DIR, 'cube_export.json')) as f:
+            self.cube_response = json.load(f)
+        self.cube = Cube(*(itemgetter(*CUBE_ATTRS)(self.cube_response) + (None,)))
+
+    def test_dict_access(self):
+        raw_hs = self.cube_response['dimensions'][3]
+        hs = self.cube.dimensions_by_name['HS']
+
+        assert hs == raw_hs
+        assert hs['hierarchies'][0]['levels'][2]['full_name'] == '[HS].[HS2]'
+        assert dict(self.cube.measures_by_name['FOB US']) == self.cube_response['measures'][1]
+        assert self.cube.time_dimension['name'] == 'Date'
+        assert sorted(self.cube.std_dimensions) == ['Destination Country', 'Export Geography', 'HS']
+
+    def test_indexes(self):
+        level = self.cube.get_level('HS', 'HS4')
+
+        assert level.full_name == '[HS].[HS4]'
+        assert level.depth == 3
+        assert self.cube.dimensions_by_name['HS'].hierarchies[0].levels[3] is level
+        assert self.cube.get_level_by_full_name('[HS].[HS4]') is level
+        assert self.cube.dimensions_by_name is self.cube.dimensions_by_name
+        self.assertRaises(ValueError, self.cube.get_level, 'HS', 'HS8')
+        self.assertRaises(ValueError, self.cube.get_level_by_full_name, '[HS].[HS8]')
+        assert not hasattr(level, '__dict__')
+
+
 class TestAggregation(unittest.TestCase):
     def setUp(self):
         self.client = MondrianClient(API_BASE)
@@ -77,25 +228,1251 @@ class TestAggregation(unittest.TestCase):
             self.cube_response = json.load(f)
 
     def test_tidy_data(self):
-        agg = Aggregation(self.aggregation_fixture)
+        agg = Aggregation(self.aggregation_fixture, None, API_BASE)
+
+        assert len(agg.tidy['data']) == 19 * 8
+        assert agg.tidy['data'][0][0]['name'] == '1995'
+        assert agg.tidy['data'][0][1]['name'] == 'Africa'
+        assert agg.tidy['data'][1][1]['name'] == 'Antartica'
+        assert agg.tidy['data'][0][2] == self.aggregation_fixture['values'][0][0][0]
+
+    def test_measure_arrays(self):
+        agg = Aggregation(self.aggregation_fixture_with_parents, None, API_BASE)
+        arrays = agg.measure_arrays()
+
+        assert len(arrays) == 2
+        assert arrays[0].shape == (36, 97)
+        for row in agg.tidy['data']:
+            i = agg.axes[1]['members'].index(row[0])
+            j = agg.axes[2]['members'].index(row[1])
+            assert arrays[0][i, j] == row[2]
+            assert arrays[1][i, j] == row[3]
+
+
+    def test_to_coo(self):
+        agg = Aggregation(self.aggregation_fixture_with_parents, None, API_BASE)
+        members = [ax['members'] for ax in agg.axes[1:]]
 
-        # TODO: add assertions
-        print(len(agg.tidy['data']))
+        for how, keep in [('any', any), ('all', all)]:
+            codes, values = agg.to_coo(how)
+            rows = [r for r in agg.tidy['data'] if keep(v is not None for v in r[2:])]
 
+            assert len(codes) == 2 and len(values) == 2
+            assert len(codes[0]) == len(rows)
+            for i, row in enumerate(rows):
+                assert members[0][codes[0][i]] is row[0]
+                assert members[1][codes[1][i]] is row[1]
+                for v, tv in zip(values, row[2:]):
+                    assert v[i] == tv or (tv is None and pd.isnull(v[i]))
+
+        assert len(agg.to_coo('all')[0][0]) == 1339
 
     def test_pandas_with_parents(self):
         cube = Cube(*(itemgetter(*CUBE_ATTRS)(self.cube_response) + (self.client,)))
         agg = Aggregation(self.aggregation_fixture_with_parents,
                           cube,
+                          API_BASE,
                           {'nonempty': True,
                            'drilldown': [{u'caption': u'Year', u'name': u'Year', u'full_name': u'[Date].[Year]'}, {u'caption': u'HS0', u'name': u'HS0', u'full_name': u'[HS].[HS2]'}],
                            'cut': [{'full_name': u'[Export Geography].[Region Metropolitana Santiago]'}],
                            'parents': True,
                            'measures': [{u'caption': u'FOB US', u'name': u'FOB US', u'full_name': u'[Measures].[FOB US]', u'annotations': {}}, {u'caption': u'Geo Rank Across Time', u'name': u'Geo Rank Across Time', u'full_name': u'[Measures].[Geo Rank Across Time]', u'annotations': {}}]})
+        p = agg.to_pandas(filter_empty_measures=False)
+
+        assert list(p.index.names) == ['ID Year', 'Year', 'ID HS0', 'HS0', 'ID HS2', 'HS2']
+        assert list(p.columns) == ['FOB US', 'Geo Rank Across Time']
+        assert len(p) == len(agg.tidy['data'])
+
+        for (idx, values), row in zip(p.iterrows(), agg.tidy['data']):
+            year, hs = row[:2]
+            assert idx == (year['key'], year['caption'],
+                           hs['ancestors'][0]['key'], hs['ancestors'][0]['caption'],
+                           hs['key'], hs['caption'])
+            for v, tv in zip(values, row[2:]):
+                assert v == tv or (tv is None and pd.isnull(v))
+
+        assert len(agg.to_pandas()) == 1339
+
+    def test_pandas_is_lazy(self):
+        cube = Cube(*(itemgetter(*CUBE_ATTRS)(self.cube_response) + (self.client,)))
+        params = cube._aggregation_params(['Date.Year', 'HS.HS2'], [],
+                                          ['FOB US', 'Geo Rank Across Time'], {'parents': True})
+        agg = Aggregation(self.aggregation_fixture_with_parents, cube, API_BASE, params)
+        p = agg.to_pandas(filter_empty_measures=False)
+
+        # built without the rows of `tidy`, with an index level per member
+        assert agg._tidy is None
+        assert len(p) == 36 * 97
+        assert [len(l) for l in p.index.levels] == [36, 36, 22, 22, 97, 97]
+        assert len(agg.to_pandas()) == 1339
+        assert agg._tidy is None
+
+    def test_pandas_workers(self):
+        cube = Cube(*(itemgetter(*CUBE_ATTRS)(self.cube_response) + (self.client,)))
+        params = cube._aggregation_params(['Date.Year', 'HS.HS2'], [],
+                                          ['FOB US', 'Geo Rank Across Time'], {'parents': True})
+        agg = Aggregation(self.aggregation_fixture_with_parents, cube, API_BASE, params)
+
+        for filter_empty_measures in [True, False]:
+            pd.testing.assert_frame_equal(agg.to_pandas(filter_empty_measures, workers=3),
+                                          agg.to_pandas(filter_empty_measures))
+        codes, values = agg.to_coo(workers=2)
+        expected_codes, expected_values = agg.to_coo()
+        for a, b in zip(codes + values, expected_codes + expected_values):
+            assert a.dtype == b.dtype
+            assert pd.Series(a).equals(pd.Series(b))
+
+        assert typed_values(self.aggregation_fixture_with_parents, 2) is not None
+        # no forking with other threads running
+        done = threading.Event()
+        thread = threading.Thread(target=done.wait)
+        thread.start()
+        try:
+            assert typed_values(self.aggregation_fixture_with_parents, 2) is None
+        finally:
+            done.set()
+            thread.join()
+
+    def test_compact_pandas(self):
+        cube = Cube(*(itemgetter(*CUBE_ATTRS)(self.cube_response) + (self.client,)))
+        params = cube._aggregation_params(['Date.Year', 'HS.HS2'], [],
+                                          ['FOB US', 'Geo Rank Across Time'], {'parents': True})
+        agg = Aggregation(self.aggregation_fixture_with_parents, cube, API_BASE, params)
+        p = agg.to_pandas(filter_empty_measures=False)
+        c = agg.to_pandas(filter_empty_measures=False, compact=True)
+
+        assert all(str(t) == 'category' for t in c.index.to_frame().dtypes)
+        assert c.index.to_frame().astype(object).equals(p.index.to_frame().astype(object))
+        assert str(c['Geo Rank Across Time'].dtype) == 'int8'
+        assert str(c['FOB US'].dtype) == 'float64'
+        pd.testing.assert_frame_equal(c.reset_index(drop=True), p.reset_index(drop=True), check_dtype=False)
+
+        saved = p.reset_index().memory_usage(deep=True).sum() \
+            - c.reset_index().memory_usage(deep=True).sum()
+        assert c.attrs['memory_saved'] > 0
+        assert abs(c.attrs['memory_saved'] - saved) < 0.1 * saved
+
+    def test_pandas_with_properties(self):
+        agg = Aggregation({
+            'axes': [
+                {'members': [{'name': 'Exports'}]},
+                {'members': [{'key': 2000 + i, 'caption': str(2000 + i),
+                              'properties': {}} for i in range(3)]},
+                {'members': [{'key': 'c%d' % i, 'caption': 'C%d' % i,
+                              'properties': {'ISO': 'i%d' % i},
+                              'ancestors': [{'level_name': 'Continent',
+                                             'properties': {'Continent ES': 'es%d' % (i % 2)}}]}
+                             for i in range(4)]}
+            ],
+            'axis_dimensions': [
+                {'name': 'Measures', 'level': 'MeasuresLevel'},
+                {'name': 'Year', 'level': 'Year'},
+                {'name': 'Geo', 'level': 'Country'}
+            ],
+            'values': [[[i * 10 + j if (i + j) % 3 else None] for i in range(3)] for j in range(4)]
+        }, None, API_BASE, {
+            'parents': False,
+            'measures': [{'name': 'Exports', 'caption': 'Exports'}],
+            'properties': ['Geo.Country.ISO', 'Geo.Continent.Continent ES']
+        })
         p = agg.to_pandas()
 
-        #assert list(p.columns) == [u'Origin Country', u'Year', u'Exports']
-        #assert len(p) == len(agg.tidy['data'])
+        assert list(p.index.names) == ['ID Year', 'Year', 'ID Country', 'Country', 'ISO', 'Continent ES']
+        assert len(p) == 8
+        assert p.loc[(2001, '2001', 'c3', 'C3', 'i3', 'es1'), 'Exports'] == 13
+
+    def test_property_plan(self):
+        plan = PropertyPlan(['Geo.Country.ISO', 'Geo.Continent.Continent ES', 'Year.Year.Leap'],
+                            [{'name': 'Year', 'level': 'Year'},
+                             {'name': 'Geo', 'level': 'Country'}])
+        assert plan.sources == {'ISO': (1, None), 'Continent ES': (1, 'Continent'), 'Leap': (0, None)}
+
+        members = [
+            [{'properties': {'Leap': y % 4 == 0}} for y in (2000, 2001)],
+            [{'properties': {'ISO': 'cl'},
+              'ancestors': [{'level_name': 'Continent', 'properties': {'Continent ES': 'Sudamerica'}},
+                            {'level_name': 'World', 'properties': {}}]}]
+        ]
+        assert plan.columns(members) == [('ISO', 1, ['cl']),
+                                         ('Continent ES', 1, ['Sudamerica']),
+                                         ('Leap', 0, [True, False])]
+        assert PropertyPlan(['Product.HS2.Section'], [{'name': 'Geo', 'level': 'Country'}]) \
+            .columns(members) == [('Section', None, None)]
+
+
+class TestFlatAggregation(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join(FIXTURES_DIR, 'aggregation_reponse_with_ancestors.json')) as f:
+            data = json.load(f)
+        with open(os.path.join(FIXTURES_DIR, 'cube_export.json')) as f:
+            cube_fixture = json.load(f)
+        self.cube = Cube(*(itemgetter(*CUBE_ATTRS)(cube_fixture) + (MondrianClient(API_BASE),)))
+        params = self.cube._aggregation_params(['Date.Year', 'HS.HS2'], [],
+                                               ['FOB US', 'Geo Rank Across Time'],
+                                               {'parents': True})
+        self.expected = Aggregation(data, self.cube, API_BASE, params).to_pandas()
+
+        # the table mondrian-rest serves: measures are named by their names
+        table = Aggregation(data, self.cube, API_BASE, params) \
+            .to_pandas(filter_empty_measures=False).reset_index()
+        table = table.astype(object).where(table.notnull(), None)
+        self.bodies = {
+            'csv': table.to_csv(index=False).encode('utf-8'),
+            'jsonrecords': json.dumps({'data': table.to_dict('records')}).encode('utf-8')
+        }
+
+    @patch('mondrian_rest.client.MondrianClient._request')
+    def get_aggregation(self, format, mock_client_request):
+        mock_client_request.return_value.content = self.bodies[format]
+        agg = self.cube.get_aggregation(drilldown=['Date.Year', 'HS.HS2'],
+                                        measures=['FOB US', 'Geo Rank Across Time'],
+                                        parents=True, format=format)
+        assert mock_client_request.call_args[0][0] == API_BASE + '/cubes/exports/aggregate.' + format
+        return agg
+
+    def test_jsonrecords(self):
+        agg = self.get_aggregation('jsonrecords')
+        assert type(agg) == FlatAggregation
+        pd.testing.assert_frame_equal(agg.to_pandas(), self.expected)
+
+    def test_csv(self):
+        df = self.get_aggregation('csv').to_pandas()
+        expected = self.expected.copy()
+        expected.index = pd.MultiIndex.from_frame(expected.index.to_frame().astype(str))
+        pd.testing.assert_frame_equal(df, expected, check_dtype=False)
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, self.cube.get_aggregation,
+                          drilldown=['Date.Year'], measures=['FOB US'], format='xls')
+
+
+def chunked(s, size):
+    return [s[i:i + size] for i in range(0, len(s), size)]
+
+
+class TestStreamingAggregation(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join(FIXTURES_DIR, 'aggregation_reponse_with_ancestors.json'), 'rb') as f:
+            self.raw = f.read()
+        self.aggregation_fixture = json.loads(self.raw.decode('utf-8'))
+
+        with open(os.path.join(FIXTURES_DIR, 'cube_export.json')) as f:
+            self.cube = Cube(*(itemgetter(*CUBE_ATTRS)(json.load(f)) + (MondrianClient(API_BASE),)))
+
+        self.params = {
+            'parents': True,
+            'measures': [self.cube.measures_by_name['FOB US'],
+                         self.cube.measures_by_name['Geo Rank Across Time']]
+        }
+
+    def test_stream_cells(self):
+        agg = Aggregation(self.aggregation_fixture, self.cube, API_BASE, self.params)
+        for size in (7, 1000, len(self.raw)):
+            stream = AggregationStream(chunked(self.raw, size))
+            assert stream.data['axes'] == self.aggregation_fixture['axes']
+            assert sorted(stream.cells()) == sorted(agg.iter_cells())
+
+    def test_stream_empty(self):
+        stream = AggregationStream([b'{"axes": [{"members": []}, {"members": []}], "values": [], "x": 1}'])
+        assert list(stream.cells()) == []
+        assert stream.data['x'] == 1
+
+    def test_iter_pandas(self):
+        agg = Aggregation(self.aggregation_fixture, self.cube, API_BASE, self.params)
+        streamed = StreamingAggregation(AggregationStream(chunked(self.raw, 512)),
+                                        self.cube, API_BASE, self.params)
+        chunks = list(streamed.iter_pandas(500))
+
+        assert all(len(c) <= 500 for c in chunks)
+        pd.testing.assert_frame_equal(pd.concat(chunks).sort_index(),
+                                      agg.to_pandas().sort_index())
+        self.assertRaises(Exception, lambda: list(streamed.iter_cells()))
+
+    def test_stream_pandas_workers(self):
+        streamed = lambda: StreamingAggregation(AggregationStream(chunked(self.raw, 512)),
+                                                self.cube, API_BASE, self.params)
+        pd.testing.assert_frame_equal(streamed().to_pandas(workers=2), streamed().to_pandas())
+
+    @patch('mondrian_rest.client.MondrianClient._request')
+    def test_iter_aggregation(self, mock_client_request):
+        mock_client_request.return_value.iter_content.side_effect = \
+            lambda size: chunked(self.raw, size)
+
+        rows = list(self.cube.iter_aggregation(drilldown=['Date.Year', 'HS.HS2'],
+                                               measures=['FOB US', 'Geo Rank Across Time'],
+                                               parents=True))
+
+        assert mock_client_request.call_args[1] == {'stream': True}
+        assert len(rows) == 36 * 97
+        assert rows[0][0]['name'] == '1990'
+        assert rows[0][1]['name'] == 'Live animals'
+        assert rows[1][0]['name'] == '1991'
+        # exhausted: the response is released
+        mock_client_request.return_value.close.assert_called_once_with()
+
+    @patch('mondrian_rest.client.MondrianClient._request')
+    def test_iter_aggregation_error(self, mock_client_request):
+        mock_client_request.return_value.raise_for_status.side_effect = \
+            requests.HTTPError('500 Server Error')
+
+        self.assertRaises(requests.HTTPError, self.cube.iter_aggregation,
+                          drilldown=['Date.Year'], measures=['FOB US'])
+        mock_client_request.return_value.close.assert_called_once_with()
+        mock_client_request.return_value.iter_content.assert_not_called()
+
+    def test_close(self):
+        response = Mock()
+        with StreamingAggregation(AggregationStream(chunked(self.raw, 512)),
+                                  self.cube, API_BASE, self.params,
+                                  response=response) as streamed:
+            next(streamed.iter_rows())
+        response.close.assert_called_once_with()
+
+
+class FakeTransport(object):
+    """ Serves the aggregation fixture, whatever the query """
+    def __init__(self, body):
+        self.body = body
+        self.calls = []
+
+    def get(self, url, params=None, **kwargs):
+        self.calls.append((url, params))
+        r = Mock()
+        r.status_code = 200
+        r.url = url
+        r.content = self.body
+        return r
+
+
+class BlockingTransport(FakeTransport):
+    """ A `FakeTransport` whose responses wait for `release` """
+    def __init__(self, body):
+        super(BlockingTransport, self).__init__(body)
+        self.release = threading.Event()
+
+    def get(self, url, params=None, **kwargs):
+        self.release.wait(5)
+        r = super(BlockingTransport, self).get(url, params, **kwargs)
+        if params is not None and 'measures[]' in params:
+            # with the measures in the order asked for
+            data = reorder_measures(json.loads(self.body.decode('utf-8')), params['measures[]'])
+            r.content = json.dumps(data).encode('utf-8')
+        return r
+
+
+class SubsetTransport(BlockingTransport):
+    """ A `BlockingTransport` serving the measures asked for and, with
+        `nonempty`, only the members with a value for any of them """
+    def get(self, url, params=None, **kwargs):
+        r = super(SubsetTransport, self).get(url, params, **kwargs)
+        data = reorder_measures(json.loads(self.body.decode('utf-8')), params['measures[]'])
+        if params['nonempty'] == 'true':
+            full = lambda cell: any(v is not None for v in cell)
+            years = [i for i in range(len(data['axes'][1]['members']))
+                     if any(full(row[i]) for row in data['values'])]
+            hss = [j for j, row in enumerate(data['values']) if any(full(c) for c in row)]
+            axes = data['axes']
+            data = dict(data,
+                        axes=[axes[0],
+                              dict(axes[1], members=[axes[1]['members'][i] for i in years]),
+                              dict(axes[2], members=[axes[2]['members'][j] for j in hss])],
+                        values=[[data['values'][j][i] for i in years] for j in hss])
+        r.content = json.dumps(data).encode('utf-8')
+        return r
+
+
+class TestCoalescing(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join(FIXTURES_DIR, 'aggregation_reponse_with_ancestors.json'), 'rb') as f:
+            self.body = f.read()
+        with open(os.path.join(FIXTURES_DIR, 'cube_export.json')) as f:
+            self.cube_response = json.load(f)
+
+    def run_threads(self, client, fn, n=10):
+        results = [None] * n
+
+        def run(i):
+            try:
+                results[i] = fn(i)
+            except Exception as e:
+                results[i] = e
+
+        threads = [threading.Thread(target=run, args=(i, )) for i in range(n)]
+        for t in threads:
+            t.start()
+        time.sleep(0.2)
+        client.transport.release.set()
+        for t in threads:
+            t.join()
+        return results
+
+    def test_concurrent_aggregations(self):
+        client = MondrianClient(API_BASE, transport=BlockingTransport(self.body))
+        cube = Cube(*(itemgetter(*CUBE_ATTRS)(self.cube_response) + (client,)))
+        orders = [['FOB US', 'Geo Rank Across Time'], ['Geo Rank Across Time', 'FOB US']]
+
+        aggs = self.run_threads(client, lambda i: cube.get_aggregation(
+            drilldown=['Date.Year', 'HS.HS2'], measures=orders[i % 2], parents=True))
+
+        assert len(client.transport.calls) == 1
+        assert client.instrumentation.counters['coalesced'] == 9
+        for i, agg in enumerate(aggs):
+            assert [m['name'] for m in agg.measures] == orders[i % 2]
+        p0, p1 = aggs[0].to_pandas(), aggs[1].to_pandas()
+        pd.testing.assert_frame_equal(p0, p1[p0.columns])
+
+        # once done, queries go upstream again
+        cube.get_aggregation(drilldown=['Date.Year'], measures=['FOB US'])
+        assert len(client.transport.calls) == 2
+
+    def test_measure_union(self):
+        client = MondrianClient(API_BASE, transport=SubsetTransport(self.body),
+                                measure_window=0.05)
+        cube = Cube(*(itemgetter(*CUBE_ATTRS)(self.cube_response) + (client,)))
+        measures = [['FOB US'], ['Geo Rank Across Time', 'FOB US'], ['Geo Rank Across Time']]
+
+        aggs = self.run_threads(client, lambda i: cube.get_aggregation(
+            drilldown=['Date.Year', 'HS.HS2'], measures=measures[i], nonempty=True), n=3)
+
+        assert len(client.transport.calls) == 1
+        assert sorted(client.transport.calls[0][1]['measures[]']) == ['FOB US', 'Geo Rank Across Time']
+        assert client.instrumentation.counters['measure_unions'] == 2
+
+        # like separate fetches
+        alone = MondrianClient(API_BASE, transport=SubsetTransport(self.body))
+        alone.transport.release.set()
+        cube = Cube(*(itemgetter(*CUBE_ATTRS)(self.cube_response) + (alone,)))
+        for agg, ms in zip(aggs, measures):
+            expected = cube.get_aggregation(drilldown=['Date.Year', 'HS.HS2'],
+                                            measures=ms, nonempty=True)
+            assert agg.axes == expected.axes
+            assert agg.values == expected.values
+        assert len(aggs[0].axes[1]['members']) < len(aggs[1].axes[1]['members'])
+
+    def test_errors_are_shared(self):
+        client = MondrianClient(API_BASE, transport=BlockingTransport(b'not json'))
+        results = self.run_threads(client, lambda i: client.get_cube('exports'))
+
+        assert len(client.transport.calls) == 1
+        assert all(isinstance(r, ValueError) for r in results)
+
+    def test_disabled(self):
+        client = MondrianClient(API_BASE, transport=BlockingTransport(self.body),
+                                coalesce=False)
+        self.run_threads(client, lambda i: client.get_members('exports', 'Date', 'Year'), n=3)
+
+        assert len(client.transport.calls) == 3
+
+
+class SlowTransport(FakeTransport):
+    """ A `FakeTransport` taking `delay` seconds per request, which keeps
+        track of the most requests in flight at once """
+    def __init__(self, body, delay=0.05):
+        super(SlowTransport, self).__init__(body)
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.timeouts = []
+        self.lock = threading.Lock()
+
+    def get(self, url, params=None, **kwargs):
+        with self.lock:
+            self.timeouts.append(kwargs.get('timeout'))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self.lock:
+            self.in_flight -= 1
+            r = super(SlowTransport, self).get(url, params, **kwargs)
+        r.url = '%s?cut=%s' % (url, params['cut[]'][0])
+        return r
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join(FIXTURES_DIR, 'aggregation_reponse_with_ancestors.json'), 'rb') as f:
+            self.body = f.read()
+        with open(os.path.join(FIXTURES_DIR, 'cube_export.json')) as f:
+            self.cube_response = json.load(f)
+
+    def cube(self, transport):
+        client = MondrianClient(API_BASE, transport=transport)
+        return Cube(*(itemgetter(*CUBE_ATTRS)(self.cube_response) + (client,)))
+
+    def queries(self, n):
+        return [{'drilldown': ['Date.Year'], 'measures': ['FOB US'],
+                 'cut': ['[Date].[Year].&[%d]' % (1990 + i)]}
+                for i in range(n)]
+
+    def test_order_and_failures(self):
+        cube = self.cube(SlowTransport(self.body))
+        queries = self.queries(12)
+        queries[5]['measures'] = ['Not a measure']
+
+        results = cube.get_aggregations(queries, max_workers=4)
+
+        assert len(results) == 12
+        assert isinstance(results[5], KeyError)
+        for i, r in enumerate(results):
+            if i != 5:
+                assert type(r) == Aggregation
+                assert r.url.endswith('[Date].[Year].&[%d]' % (1990 + i))
+        assert cube.client.transport.max_in_flight == 4
+
+    def test_rate_limit_and_timeout(self):
+        cube = self.cube(SlowTransport(self.body, delay=0))
+        queries = self.queries(5)
+        queries[0]['timeout'] = 1
+
+        t0 = time.time()
+        cube.get_aggregations(queries, rate_limit=50, timeout=(10, 20))
+
+        # 5 queries, started at least 20ms apart
+        assert time.time() - t0 >= 0.08
+        assert sorted(cube.client.transport.timeouts, key=str) == [(10, 20)] * 4 + [1]
+
+
+class TestAggregationCache(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join(FIXTURES_DIR, 'aggregation_reponse_with_ancestors.json'), 'rb') as f:
+            self.body = f.read()
+        with open(os.path.join(FIXTURES_DIR, 'cube_export.json')) as f:
+            self.cube_fixture = json.load(f)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+
+    def client(self, cache):
+        transport = FakeTransport(self.body)
+        client = MondrianClient(API_BASE, transport=transport, cache=cache)
+        cube = Cube(*(itemgetter(*CUBE_ATTRS)(self.cube_fixture) + (client,)))
+        return transport, cube
+
+    def test_hit_with_reordered_params(self):
+        cache = AggregationCache()
+        transport, cube = self.client(cache)
+
+        a = cube.get_aggregation(drilldown=['Date.Year', 'HS.HS2'],
+                                 cut=['[Date].[2010]', '[HS].[01]'],
+                                 measures=['FOB US', 'Geo Rank Across Time'])
+        b = cube.get_aggregation(drilldown=['Date.Year', 'HS.HS2'],
+                                 cut=['[HS].[01]', '[Date].[2010]'],
+                                 measures=['Geo Rank Across Time', 'FOB US'])
+
+        assert len(transport.calls) == 1
+        assert cache.stats['hits'] == 1 and cache.stats['misses'] == 1
+        assert [m['name'] for m in b.measures] == ['Geo Rank Across Time', 'FOB US']
+        for ra, rb in zip(a.tidy['data'], b.tidy['data']):
+            assert ra[:2] == rb[:2] and ra[2:] == list(reversed(rb[2:]))
+
+        # drilldown order is significant
+        cube.get_aggregation(drilldown=['HS.HS2', 'Date.Year'], measures=['FOB US'])
+        assert len(transport.calls) == 2
+
+    def test_lru_and_ttl(self):
+        cache = AggregationCache(max_bytes=len(self.body) * DECODED_SIZE_FACTOR * 2, ttl=60)
+        for i in range(3):
+            cache.set('exports', 'k%d' % i, API_BASE, self.body, {})
+        assert cache.stats['evictions'] == 1
+        assert cache.stats['bytes'] == len(self.body) * DECODED_SIZE_FACTOR * 2
+        assert cache.get('exports', 'k0') is None
+        assert cache.get('exports', 'k1') is not None
+
+        cache.ttl = 0
+        time.sleep(0.01)
+        assert cache.get('exports', 'k2') is None
+        assert cache.stats['entries'] == 1
+
+    def test_disk_tier_and_invalidation(self):
+        transport, cube = self.client(AggregationCache(directory=self.directory))
+        cube.get_aggregation(drilldown=['Date.Year'], measures=['FOB US', 'Geo Rank Across Time'])
+
+        # a new cache (eg: after a restart) on the same directory
+        cache = AggregationCache(directory=self.directory)
+        transport, cube = self.client(cache)
+        agg = cube.get_aggregation(drilldown=['Date.Year'], measures=['FOB US', 'Geo Rank Across Time'])
+        assert len(transport.calls) == 0
+        assert cache.stats['disk_hits'] == 1
+        assert len(agg.tidy['data']) == 36 * 97
+
+        cache.invalidate('exports')
+        cube.get_aggregation(drilldown=['Date.Year'], measures=['FOB US', 'Geo Rank Across Time'])
+        assert len(transport.calls) == 1
+
+    def test_disk_hit_keeps_ttl(self):
+        AggregationCache(directory=self.directory).set('exports', 'k', API_BASE, self.body, {})
+        path = os.path.join(self.directory, 'exports', os.listdir(os.path.join(self.directory, 'exports'))[0])
+        stored_at = time.time() - 50
+        os.utime(path, (stored_at, stored_at))
+
+        # promoted to memory, it still expires `ttl` seconds after it was stored
+        cache = AggregationCache(directory=self.directory, ttl=60)
+        assert cache.get('exports', 'k') is not None
+        assert cache._entries['k'][1] == stored_at
+        cache.ttl = 40
+        assert cache.get('exports', 'k') is None
+
+
+class TestRollup(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join(FIXTURES_DIR, 'aggregation_reponse_with_ancestors.json')) as f:
+            data = json.load(f)
+        # Date.Year x HS.HS2 of FOB US alone
+        data['axes'][0]['members'] = data['axes'][0]['members'][:1]
+        data['values'] = [[cell[:1] for cell in row] for row in data['values']]
+        self.body = json.dumps(data).encode('utf-8')
+
+        with open(os.path.join(FIXTURES_DIR, 'cube_export.json')) as f:
+            cube_fixture = json.load(f)
+        measures = {m['name']: m for m in cube_fixture['measures']}
+        measures['FOB US']['aggregator'] = 'SUM'
+        measures['Q Traded']['aggregator'] = 'sum'
+        measures['Q Traded']['annotations'] = {'additive': 'false'}
+
+        self.transport = FakeTransport(self.body)
+        self.client = MondrianClient(API_BASE, transport=self.transport,
+                                     cache=AggregationCache())
+        self.cube = Cube(*(itemgetter(*CUBE_ATTRS)(cube_fixture) + (self.client,)))
+        self.cube_fixture = cube_fixture
+
+    def test_measure_rollup(self):
+        assert measure_rollup(self.cube.measures_by_name['FOB US']) is np.add
+        assert measure_rollup(self.cube.measures_by_name['Q Traded']) is None
+        assert measure_rollup(self.cube.measures_by_name['Geo Rank']) is None
+
+    def test_rollup(self):
+        fine = self.cube.get_aggregation(drilldown=['Date.Year', 'HS.HS2'],
+                                         measures=['FOB US'], parents=True)
+        coarse = self.cube.get_aggregation(drilldown=['Date.Year', 'HS.HS0'],
+                                           measures=['FOB US'], parents=True)
+        assert len(self.transport.calls) == 1
+        assert self.client.instrumentation.counters['rollups'] == 1
+        assert coarse.axis_dimensions[2]['level'] == 'HS0'
+        assert [m['depth'] for m in coarse.axes[2]['members'][0]['ancestors']] == [0]
+
+        expected = fine.to_pandas(filter_empty_measures=False) \
+            .groupby(level=['ID Year', 'ID HS0'], sort=False)['FOB US'].sum(min_count=1)
+        p = coarse.to_pandas(filter_empty_measures=False)
+        assert list(p.index.names) == ['ID Year', 'Year', 'ID HS0', 'HS0']
+        pd.testing.assert_series_equal(p['FOB US'].droplevel(['Year', 'HS0']), expected)
+
+        # without parents, the members of the coarser level have no ancestors
+        coarse = self.cube.get_aggregation(drilldown=['Date.Year', 'HS.HS0'],
+                                           measures=['FOB US'])
+        assert len(self.transport.calls) == 1
+        assert 'ancestors' not in coarse.axes[2]['members'][0]
+
+    def test_raw_params(self):
+        # levels and measures as the raw dicts of the schema
+        levels = {l['name']: l for d in self.cube_fixture['dimensions'] if d['name'] == 'HS'
+                  for l in d['hierarchies'][0]['levels']}
+        measures = {m['name']: m for m in self.cube_fixture['measures']}
+        year = self.cube_fixture['dimensions'][0]['hierarchies'][0]['levels'][1]
+
+        self.client.get_aggregation(self.cube, {'drilldown': [year, levels['HS2']],
+                                                'measures': [measures['FOB US']],
+                                                'parents': True})
+        coarse = self.client.get_aggregation(self.cube, {'drilldown': [year, levels['HS0']],
+                                                         'measures': [measures['FOB US']]})
+        assert len(self.transport.calls) == 1
+        assert self.client.instrumentation.counters['rollups'] == 1
+        assert coarse.axis_dimensions[2]['level'] == 'HS0'
+
+        self.client.get_aggregation(self.cube, {'drilldown': [year, levels['HS0']],
+                                                'measures': [measures['Q Traded']]})
+        assert len(self.transport.calls) == 2
+
+    def test_fallback(self):
+        self.cube.get_aggregation(drilldown=['Date.Year', 'HS.HS2'],
+                                  measures=['FOB US'], parents=True)
+
+        # not cached at a finer level
+        self.cube.get_aggregation(drilldown=['Date.Year', 'HS.HS4'], measures=['FOB US'])
+        assert len(self.transport.calls) == 2
+        # not additive
+        self.cube.get_aggregation(drilldown=['Date.Year', 'HS.HS0'], measures=['Q Traded'])
+        assert len(self.transport.calls) == 3
+        # disabled
+        self.client.rollup = False
+        self.cube.get_aggregation(drilldown=['Date.Year', 'HS.HS0'], measures=['FOB US'])
+        assert len(self.transport.calls) == 4
+        assert self.client.instrumentation.counters['rollups'] == 0
+
+
+@unittest.skipIf(pa is None, 'requires pyarrow')
+class TestArrow(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join(FIXTURES_DIR, 'aggregation_reponse_with_ancestors.json'), 'rb') as f:
+            self.body = f.read()
+        with open(os.path.join(FIXTURES_DIR, 'cube_export.json')) as f:
+            self.cube_fixture = json.load(f)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+
+    def cube(self, **kwargs):
+        transport = FakeTransport(self.body)
+        client = MondrianClient(API_BASE, transport=transport, **kwargs)
+        return transport, Cube(*(itemgetter(*CUBE_ATTRS)(self.cube_fixture) + (client,)))
+
+    def test_to_arrow(self):
+        _, cube = self.cube()
+        params = cube._aggregation_params(['Date.Year', 'HS.HS2'], [],
+                                          ['FOB US', 'Geo Rank Across Time'], {'parents': True})
+        agg = Aggregation(json.loads(self.body.decode('utf-8')), cube, API_BASE, params)
+        table = agg.to_arrow()
+        expected = agg.to_pandas().reset_index()
+
+        assert table.column_names == list(expected.columns)
+        assert pa.types.is_dictionary(table.schema.field('HS2').type)
+        pd.testing.assert_frame_equal(table.to_pandas().astype(object),
+                                      expected.astype(object))
+
+        path = os.path.join(self.directory, 'agg.parquet')
+        agg.to_parquet(path)
+        pd.testing.assert_frame_equal(pq.read_table(path).to_pandas().astype(object),
+                                      expected.astype(object))
+
+    def test_store(self):
+        transport, cube = self.cube(store=ResultStore(self.directory))
+        a = cube.get_arrow(drilldown=['Date.Year', 'HS.HS2'],
+                           measures=['FOB US', 'Geo Rank Across Time'])
+        b = cube.get_arrow(drilldown=['Date.Year', 'HS.HS2'],
+                           measures=['Geo Rank Across Time', 'FOB US'])
+        assert len(transport.calls) == 1
+        assert b.column_names[-2:] == ['Geo Rank Across Time', 'FOB US']
+        assert b.select(a.column_names).equals(a)
+
+        # a new client (eg: after a restart) maps the stored table back
+        transport, cube = self.cube(store=ResultStore(self.directory))
+        c = cube.get_arrow(drilldown=['Date.Year', 'HS.HS2'],
+                           measures=['FOB US', 'Geo Rank Across Time'])
+        assert len(transport.calls) == 0
+        assert c.equals(a)
+
+        cube.client.store.invalidate('exports')
+        cube.get_arrow(drilldown=['Date.Year', 'HS.HS2'],
+                       measures=['FOB US', 'Geo Rank Across Time'])
+        assert len(transport.calls) == 1
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join(FIXTURES_DIR, 'aggregation_reponse_with_ancestors.json'), 'rb') as f:
+            self.body = f.read()
+        with open(os.path.join(FIXTURES_DIR, 'cube_export.json')) as f:
+            self.cube_fixture = json.load(f)
+
+    def test_events_and_counters(self):
+        events = []
+        client = MondrianClient(API_BASE, transport=FakeTransport(self.body),
+                                cache=AggregationCache(),
+                                instrumentation=Instrumentation([events.append]))
+        cube = Cube(*(itemgetter(*CUBE_ATTRS)(self.cube_fixture) + (client,)))
+
+        for _ in range(2):
+            agg = cube.get_aggregation(drilldown=['Date.Year', 'HS.HS2'],
+                                       measures=['FOB US', 'Geo Rank Across Time'])
+        agg.to_pandas()
+        agg.tidy
+
+        assert [e.name for e in events] == ['request', 'decode', 'to_pandas', 'tidy']
+        assert events[0].attributes['bytes'] == len(self.body)
+        assert events[0].attributes['status'] == 200
+        assert events[3].attributes['rows'] == 36 * 97
+        assert all(e.duration >= 0 for e in events)
+
+        counters = client.instrumentation.counters
+        assert counters['requests'] == 1 and counters['bytes'] == len(self.body)
+        assert counters['cache_hits'] == 1 and counters['cache_misses'] == 1
+        histogram = client.instrumentation.histograms['request']
+        assert histogram.count == 1 and sum(histogram.counts) == 1
+        assert histogram.quantile(0.5) is not None
+
+    def test_hooks(self):
+        instrumentation = Instrumentation()
+        spans = []
+
+        class Span(object):
+            def __init__(self, name, start_time, attributes):
+                self.name, self.start_time, self.attributes = name, start_time, attributes
+
+            def end(self, end_time):
+                self.end_time = end_time
+                spans.append(self)
+
+        tracer = Mock()
+        tracer.start_span.side_effect = Span
+        instrumentation.subscribe(SpanHook(tracer))
+        instrumentation.subscribe(LoggingHook())
+        instrumentation.subscribe(Mock(side_effect=ValueError))  # ignored
+
+        with self.assertLogs('mondrian_rest.instrumentation', 'DEBUG') as logs:
+            with instrumentation.timed('request', url=API_BASE) as attributes:
+                attributes['bytes'] = 10
+        assert any('request' in l and 'bytes=10' in l for l in logs.output)
+
+        assert spans[0].name == 'mondrian_rest.request'
+        assert spans[0].attributes == {'url': API_BASE, 'bytes': 10}
+        assert spans[0].end_time >= spans[0].start_time
+
+        with self.assertRaises(KeyError):
+            with instrumentation.timed('request'):
+                raise KeyError
+        assert spans[1].attributes == {'error': 'KeyError'}
+        assert instrumentation.counters['errors'] == 1
+
+
+class SchemaTransport(object):
+    """ Serves a cube schema with an ETag, honoring If-None-Match """
+    def __init__(self, body, etag='"v1"'):
+        self.body = body
+        self.etag = etag
+        self.calls = []
+
+    def get(self, url, params=None, headers=None, **kwargs):
+        self.calls.append(headers)
+        r = Mock()
+        r.headers = {'ETag': self.etag}
+        if headers and headers.get('If-None-Match') == self.etag:
+            r.status_code = 304
+            r.content = b''
+        else:
+            r.status_code = 200
+            r.content = self.body
+        return r
+
+
+class TestSchemaCache(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join(FIXTURES_DIR, 'cube_export.json'), 'rb') as f:
+            self.body = f.read()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+
+    def test_ttl_and_revalidation(self):
+        transport = SchemaTransport(self.body)
+        cache = SchemaCache(ttl=60)
+        client = MondrianClient(API_BASE, transport=transport, schema_cache=cache)
+
+        c1 = client.get_cube('exports')
+        c2 = client.get_cube('exports')
+        assert c1 is c2
+        assert transport.calls == [None]
+
+        # stale: revalidated, unchanged
+        cache.ttl = 0
+        time.sleep(0.01)
+        assert client.get_cube('exports') is c1
+        assert transport.calls[-1] == {'If-None-Match': '"v1"'}
+
+        # stale: revalidated, changed
+        transport.etag = '"v2"'
+        time.sleep(0.01)
+        c3 = client.get_cube('exports')
+        assert c3 is not c1 and c3.name == 'exports'
+        assert len(transport.calls) == 3
+
+    def test_persisted(self):
+        transport = SchemaTransport(self.body)
+        MondrianClient(API_BASE, transport=transport,
+                       schema_cache=SchemaCache(ttl=0, directory=self.directory)).get_cube('exports')
+
+        # after a restart, the schema is revalidated instead of downloaded
+        client = MondrianClient(API_BASE, transport=transport,
+                                schema_cache=SchemaCache(ttl=0, directory=self.directory))
+        time.sleep(0.01)
+        c = client.get_cube('exports')
+        assert c.name == 'exports'
+        assert transport.calls == [None, {'If-None-Match': '"v1"'}]
+
+
+class MembersTransport(object):
+    """ Serves the members of any level: those of `Date.Year` in the
+        aggregation fixture, with the level's name in their captions """
+    def __init__(self, members):
+        self.members = members
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def get(self, url, params=None, **kwargs):
+        with self.lock:
+            self.calls.append(url)
+        level = url.rsplit('/', 2)[-2]
+        body = json.dumps({'members': [dict(m, caption='%s %s' % (level, m['caption']))
+                                       for m in self.members]}).encode('utf-8')
+        r = Mock()
+        r.status_code = 200
+        r.content = body
+        return r
+
+
+class TestMemberCatalog(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join(FIXTURES_DIR, 'aggregation_response.json')) as f:
+            self.members = json.load(f)['axes'][1]['members']
+        with open(os.path.join(FIXTURES_DIR, 'cube_export.json')) as f:
+            self.cube_response = json.load(f)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+
+    def cube(self, transport, catalog):
+        client = MondrianClient(API_BASE, transport=transport, member_catalog=catalog)
+        return Cube(*(itemgetter(*CUBE_ATTRS)(self.cube_response) + (client,)))
+
+    def test_lookups(self):
+        transport = MembersTransport(self.members)
+        cube = self.cube(transport, MemberCatalog())
+        years = cube.get_level_members('Date', 'Year')
+
+        assert cube.get_level_members('Date', 'Year') is years
+        assert cube.get_members('Date', 'Year') == years.members
+        assert len(transport.calls) == 1
+
+        assert years.get(1995) is years.get('1995') is years.members[0]
+        assert years.get('Year 1996', by='caption')['key'] == 1996
+        assert years.get('[Year].[1997]', by='full_name')['key'] == 1997
+        assert years.cut([1995]) == '[Year].[1995]'
+        assert years.cut(['1995', 1996]) == '{[Year].[1995],[Year].[1996]}'
+        self.assertRaises(KeyError, years.resolve, [1995, 1900])
+        self.assertRaises(ValueError, years.get, 1995, 'name')
+
+    def test_prefetch_and_persistence(self):
+        transport = MembersTransport(self.members)
+        cube = self.cube(transport, MemberCatalog(directory=self.directory))
+        levels = cube.prefetch_members(['Date', 'HS'])
+
+        assert sorted(levels) == [('Date', 'Day'), ('Date', 'Month'), ('Date', 'Year'),
+                                  ('HS', 'HS0'), ('HS', 'HS2'), ('HS', 'HS4'), ('HS', 'HS6')]
+        assert levels['HS', 'HS2'].get('HS2 1995', by='caption') is not None
+        assert len(transport.calls) == 7
+
+        # after a restart, members are read from disk
+        cube = self.cube(transport, MemberCatalog(directory=self.directory))
+        assert cube.get_level_members('HS', 'HS4').get('HS4 1995', by='caption') is not None
+        assert len(transport.calls) == 7
+
+        cube.client.member_catalog.invalidate('exports')
+        cube.get_level_members('HS', 'HS4')
+        assert len(transport.calls) == 8
+
+    def test_error_status(self):
+        transport = MembersTransport(self.members)
+        error = requests.Response()
+        error.status_code = 500
+        error._content = b'Internal Server Error'
+        transport.get = lambda url, params=None, **kwargs: error
+        cube = self.cube(transport, MemberCatalog())
+
+        self.assertRaises(requests.HTTPError, cube.get_level_members, 'Date', 'Year')
+        assert cube.client.member_catalog.get('exports', 'Date', 'Year') is None
+
+
+class ShardTransport(object):
+    """ Serves the members of the `Date.Year` level, and the aggregation
+        fixture cut to the years in the query (as with `nonempty`) """
+    def __init__(self, data):
+        self.data = data
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def get(self, url, params=None, **kwargs):
+        with self.lock:
+            self.calls.append((url, params))
+        r = Mock()
+        r.status_code = 200
+        r.url = url
+        if url.endswith('/members'):
+            r.content = json.dumps({'members': self.data['axes'][1]['members']}).encode('utf-8')
+            return r
+
+        years, hss = self.data['axes'][1]['members'], self.data['axes'][2]['members']
+        cut = [c for c in params.get('cut[]', []) if '[Date]' in c]
+        iy = [i for i, y in enumerate(years)
+              if not cut or y['full_name'] in cut[0].strip('{}').split(',')]
+        ih = [j for j, _ in enumerate(hss)
+              if any(self.data['values'][j][i][0] is not None for i in iy)]
+        r.content = json.dumps(dict(
+            self.data,
+            axes=[self.data['axes'][0],
+                  dict(self.data['axes'][1], members=[years[i] for i in iy]),
+                  dict(self.data['axes'][2], members=[hss[j] for j in ih])],
+            values=[[self.data['values'][j][i] for i in iy] for j in ih])).encode('utf-8')
+        return r
+
+
+class TestSharding(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join(FIXTURES_DIR, 'aggregation_reponse_with_ancestors.json')) as f:
+            self.data = json.load(f)
+        # empty cells are empty for every measure
+        for row in self.data['values']:
+            for cell in row:
+                if cell[0] is None:
+                    cell[1] = None
+        with open(os.path.join(FIXTURES_DIR, 'cube_export.json')) as f:
+            self.cube_fixture = json.load(f)
+        self.transport = ShardTransport(self.data)
+        client = MondrianClient(API_BASE, transport=self.transport)
+        self.cube = Cube(*(itemgetter(*CUBE_ATTRS)(self.cube_fixture) + (client,)))
+
+    def test_merge_members(self):
+        m = lambda names: [{'full_name': n} for n in names]
+        merged = merge_members([m('acd'), m('bcf'), m('def')])
+        assert [x['full_name'] for x in merged] == list('abcdef')
+        # inconsistent orders
+        merged = merge_members([m('ab'), m('ba')])
+        assert [x['full_name'] for x in merged] == list('ab')
+
+    def test_sharded_aggregation(self):
+        whole = Aggregation(self.data, self.cube, API_BASE,
+                            self.cube._aggregation_params(
+                                ['Date.Year', 'HS.HS2'], [], ['FOB US', 'Geo Rank Across Time'],
+                                {'parents': True}))
+        for shard_by, shard_size in [(True, 1), ('Date.Year', 5)]:
+            self.transport.calls = []
+            agg = self.cube.get_aggregation(drilldown=['Date.Year', 'HS.HS2'],
+                                            measures=['FOB US', 'Geo Rank Across Time'],
+                                            cut=['[HS].[01]'], parents=True,
+                                            shard_by=shard_by, shard_size=shard_size)
+            shards = [c for c in self.transport.calls if c[0].endswith('/aggregate')]
+            assert len(shards) == (36 + shard_size - 1) // shard_size
+            assert all('[HS].[01]' in p['cut[]'] for _, p in shards)
+            assert agg.url == self.cube.client.aggregation_url(self.cube, agg._agg_params)
+
+            pd.testing.assert_frame_equal(agg.to_pandas().sort_index(),
+                                          whole.to_pandas().sort_index())
+
+    def test_refresh_aggregation(self):
+        query = dict(drilldown=['Date.Year', 'HS.HS2'], measures=['FOB US', 'Geo Rank Across Time'],
+                     parents=True)
+        whole = self.cube.get_aggregation(**query).to_pandas()
+        years = self.data['axes'][1]['members']
+
+        # stored up to the 30th year, whose values have changed since
+        previous = whole[whole.index.get_level_values('ID Year') <= years[29]['key']].copy()
+        previous.loc[previous.index.get_level_values('ID Year') == years[29]['key'], 'FOB US'] = -1
+
+        self.transport.calls = []
+        refreshed = self.cube.refresh_aggregation(previous, **query)
+
+        # from the last stored period (with data) on
+        last = [y['key'] for y in years].index(previous.index.get_level_values('ID Year').max())
+        cut = self.transport.calls[-1][1]['cut[]'][0]
+        assert cut == '{%s}' % ','.join(y['full_name'] for y in years[last:])
+        pd.testing.assert_frame_equal(refreshed.sort_index(), whole.sort_index())
+
+        # with nothing stored, everything is queried
+        refreshed = self.cube.refresh_aggregation(whole.iloc[:0], **query)
+        assert 'cut[]' not in self.transport.calls[-1][1]
+        assert len(refreshed) == len(whole)
+
+    @unittest.skipIf(pa is None, 'requires pyarrow')
+    def test_refresh_stored_table(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        self.cube.client.store = ResultStore(directory)
+        query = dict(drilldown=['Date.Year', 'HS.HS2'], measures=['FOB US', 'Geo Rank Across Time'],
+                     cut=['[HS].[01]'])
+        whole = self.cube.get_arrow(**query)
+
+        # stored up to the 20th year
+        years = self.data['axes'][1]['members']
+        params = self.cube._aggregation_params(query['drilldown'], query['cut'], query['measures'], {})
+        key = canonical_key(urljoin(API_BASE, 'cubes/exports/aggregate'), aggregation_qs_params(params))
+        stored = whole.filter(pa.compute.less_equal(whole.column('ID Year').cast(pa.int64()),
+                                                    years[19]['key']))
+        self.cube.client.store.set('exports', key, stored)
+        assert self.cube.get_arrow(**query).num_rows == stored.num_rows < whole.num_rows
+
+        refreshed = self.cube.get_arrow(refresh=True, **query)
+        assert '[Date].[1990]' not in self.transport.calls[-1][1]['cut[]'][1]
+        assert refreshed.num_rows == whole.num_rows
+        assert self.cube.get_arrow(**query).num_rows == whole.num_rows
+        pd.testing.assert_frame_equal(
+            refreshed.to_pandas().astype(object).sort_values(['ID Year', 'ID HS2']).reset_index(drop=True),
+            whole.to_pandas().astype(object).sort_values(['ID Year', 'ID HS2']).reset_index(drop=True))
+
+    def test_invalid_shard_level(self):
+        self.assertRaises(ValueError, self.cube.get_aggregation,
+                          drilldown=['HS.HS2'], measures=['FOB US'], shard_by=True)
+        self.assertRaises(ValueError, self.cube.get_aggregation,
+                          drilldown=['Date.Year'], measures=['FOB US'],
+                          cut=['[Date].[2010]'], shard_by='Date.Year')
+
+
+@unittest.skipIf(httpx is None, 'httpx is not installed')
+class TestAsyncMondrianClient(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join(FIXTURES_DIR, 'cube_export.json')) as f:
+            self.cube_fixture = json.load(f)
+        with open(os.path.join(FIXTURES_DIR, 'aggregation_reponse_with_ancestors.json')) as f:
+            self.aggregation_fixture = json.load(f)
+        self.requests = []
+
+    def handler(self, request):
+        self.requests.append(request)
+        if request.url.path == '/cubes/exports':
+            return httpx.Response(200, json=self.cube_fixture)
+        if request.url.path.endswith('/levels/Missing/members'):
+            return httpx.Response(500, text='Internal Server Error')
+        if request.url.path.endswith('/members'):
+            return httpx.Response(200, json={'members': self.aggregation_fixture['axes'][1]['members']})
+        if request.url.path == '/cubes/exports/aggregate':
+            if len(self.requests) == 2:
+                return httpx.Response(503)
+            return httpx.Response(200, json=self.aggregation_fixture)
+        return httpx.Response(404)
+
+    def client(self):
+        return AsyncMondrianClient(
+            API_BASE, backoff_factor=0,
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(self.handler)))
+
+    def test_get_aggregation(self):
+        async def run():
+            async with self.client() as client:
+                cube = await client.get_cube('exports')
+                agg = await cube.get_aggregation(drilldown=['Date.Year', 'HS.HS2'],
+                                                 measures=['FOB US', 'Geo Rank Across Time'],
+                                                 parents=True)
+                return cube, agg
+
+        cube, agg = asyncio.run(run())
+
+        assert type(cube) == AsyncCube
+        assert type(agg) == Aggregation
+        assert len(agg.tidy['data']) == 36 * 97
+        # the 503 was retried
+        assert len(self.requests) == 3
+        assert self.requests[-1].url.params.get_list('drilldown[]') == ['[Date].[Year]', '[HS].[HS2]']
+
+    def test_get_aggregations(self):
+        queries = [{'cube': 'exports', 'drilldown': ['Date.Year'], 'measures': [m]}
+                   for m in ['FOB US', 'Not a measure', 'Geo Rank Across Time']]
+
+        async def run():
+            async with self.client() as client:
+                return await client.get_aggregations(queries, max_concurrency=2)
+
+        results = asyncio.run(run())
+
+        assert type(results[0]) == Aggregation and type(results[2]) == Aggregation
+        assert isinstance(results[1], KeyError)
+        assert [m['name'] for m in results[2]._agg_params['measures']] == ['Geo Rank Across Time']
+
+    def test_prefetch_members(self):
+        async def run():
+            client = self.client()
+            client.member_catalog = MemberCatalog()
+            async with client:
+                cube = await client.get_cube('exports')
+                levels = await cube.prefetch_members(['Date'])
+                return levels, await cube.get_members('Date', 'Year')
+
+        levels, years = asyncio.run(run())
+
+        assert sorted(levels) == [('Date', 'Day'), ('Date', 'Month'), ('Date', 'Year')]
+        assert years is levels['Date', 'Year'].members
+        assert levels['Date', 'Year'].get(1990)['name'] == '1990'
+        # the cube, and each level once
+        assert len(self.requests) == 4
+
+    def test_level_members_error(self):
+        async def run():
+            client = self.client()
+            client.member_catalog = MemberCatalog()
+            async with client:
+                cube = await client.get_cube('exports')
+                await cube.get_level_members('Date', 'Missing')
+
+        self.assertRaises(httpx.HTTPStatusError, asyncio.run, run())
+
+    def test_concurrent_aggregations(self):
+        async def run():
+            async with self.client() as client:
+                cube = await client.get_cube('exports')
+                return await asyncio.gather(*[
+                    cube.get_aggregation(drilldown=['Date.Year'], measures=['FOB US'])
+                    for _ in range(20)
+                ])
+
+        aggs = asyncio.run(run())
+        assert len(aggs) == 20
+        assert all(len(a.axes[1]['members']) == 36 for a in aggs)
+        # coalesced: the cube, the 503 and its retry
+        assert len(self.requests) == 3
+
+    def test_measure_union(self):
+        async def run():
+            async with AsyncMondrianClient(
+                    API_BASE, backoff_factor=0, measure_window=0.05,
+                    http_client=httpx.AsyncClient(transport=httpx.MockTransport(self.handler))) as client:
+                cube = await client.get_cube('exports')
+                return await asyncio.gather(*[
+                    cube.get_aggregation(drilldown=['Date.Year'], measures=[m])
+                    for m in ['FOB US', 'Geo Rank Across Time']
+                ])
+
+        aggs = asyncio.run(run())
+        assert [[m['name'] for m in a.measures] for a in aggs] == [['FOB US'], ['Geo Rank Across Time']]
+        # the cube, the 503 and its retry
+        assert len(self.requests) == 3
+        assert self.requests[-1].url.params.get_list('measures[]') == ['FOB US', 'Geo Rank Across Time']
+        assert aggs[0].url.endswith('measures%5B%5D=FOB+US&drilldown%5B%5D=%5BDate%5D.%5BYear%5D')
+
+    def test_iter_aggregation(self):
+        raw = json.dumps(self.aggregation_fixture).encode('utf-8')
+
+        async def body():
+            for chunk in chunked(raw, 512):
+                yield chunk
+
+        def handler(request):
+            self.requests.append(request)
+            if request.url.path == '/cubes/exports':
+                return httpx.Response(200, json=self.cube_fixture)
+            return httpx.Response(200, content=body())
+
+        async def run(**kwargs):
+            client = AsyncMondrianClient(
+                API_BASE, http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+            async with client:
+                cube = await client.get_cube('exports')
+                return [r async for r in cube.iter_aggregation(
+                    drilldown=['Date.Year', 'HS.HS2'],
+                    measures=['FOB US', 'Geo Rank Across Time'],
+                    **kwargs)]
+
+        rows = asyncio.run(run())
+        expected = Aggregation(self.aggregation_fixture, None, None).tidy['data']
+        assert sorted(map(str, rows)) == sorted(map(str, expected))
+
+        frames = asyncio.run(run(chunksize=1000))
+        assert len(frames) == 4
+        assert sum(len(df) for df in frames) == \
+            sum(1 for r in rows if None not in r[-2:])
+
+    def test_iter_aggregation_error(self):
+        async def run():
+            async with self.client() as client:
+                cube = await client.get_cube('exports')
+                cube.name = 'missing'
+                return [r async for r in cube.iter_aggregation(drilldown=['Date.Year'],
+                                                               measures=['FOB US'])]
+
+        with self.assertRaises(httpx.HTTPStatusError):
+            asyncio.run(run())
+
+    def test_aggregation_timeout(self):
+        async def run():
+            async with self.client() as client:
+                cube = await client.get_cube('exports')
+                await cube.get_aggregation(drilldown=['Date.Year'], measures=['FOB US'],
+                                           timeout=(10, None))
+
+        asyncio.run(run())
+        timeout = self.requests[-1].extensions['timeout']
+        assert timeout['connect'] == 10
+        assert timeout['read'] is None
 
 
 if __name__ == '__main__':
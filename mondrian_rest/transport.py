@@ -0,0 +1,74 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .decoding import ACCEPT_ENCODING
+
+# (connect, read) timeouts, in seconds. Slow aggregations can get a longer
+# (or no) read timeout per request, eg: `cube.get_aggregation(...,
+# timeout=(10, None))`.
+DEFAULT_TIMEOUT = (10, 300)
+RETRY_STATUSES = (500, 502, 503, 504)
+
+
+class Transport(object):
+    """ Performs the HTTP requests of a `MondrianClient`. Subclasses must
+        implement `get`, returning a `requests.Response`-like object, and be
+        safe to use from several threads at once. """
+
+    def get(self, url, params=None, **kwargs):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SessionTransport(Transport):
+    """
+    Transport backed by `requests`, keeping connections alive in a pool of
+    (at most) `pool_size` connections per host.
+
+    Requests time out after `timeout` (anything `requests` accepts, can be
+    overridden per request) and are retried up to `retries` times, with
+    exponential backoff, on connection errors and 5xx responses.
+
+    Responses are requested compressed with any of `accept_encoding` (by
+    default, every coding urllib3 can decode).
+
+    `requests.Session` is not thread safe, so every thread gets its own
+    session, all of them sharing the same connection pool.
+    """
+
+    def __init__(self, pool_size=10, timeout=DEFAULT_TIMEOUT, retries=3,
+                 backoff_factor=0.5, accept_encoding=ACCEPT_ENCODING):
+        self.timeout = timeout
+        self.accept_encoding = accept_encoding
+        self._adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=Retry(total=retries,
+                              backoff_factor=backoff_factor,
+                              status_forcelist=RETRY_STATUSES,
+                              raise_on_status=False))
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        """ The `requests.Session` of the current thread """
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.headers['Accept-Encoding'] = self.accept_encoding
+            session.mount('http://', self._adapter)
+            session.mount('https://', self._adapter)
+            self._local.session = session
+        return session
+
+    def get(self, url, params=None, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.get(url, params=params, **kwargs)
+
+    def close(self):
+        self._adapter.close()
@@ -0,0 +1,122 @@
+"""
+Fetching the union of measures: aggregations that differ only in their
+measures, requested at about the same time, are fetched with one request
+for all of their measures, and each caller gets its own measures out of
+the result (see `MondrianClient`, `measure_window`).
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+import pandas as pd
+
+from .aggregation import flat_values
+
+
+def select_measures(data, names, nonempty=False):
+    """
+    Aggregation `data` with only the measures in `names`, in that order.
+    With `nonempty`, the members of the non-measure axes left without a
+    value for any of those measures are dropped too, as the server would
+    have.
+    """
+    members = data['axes'][0]['members']
+    index = {m['name']: i for i, m in enumerate(members)}
+    perm = [index[n] for n in names]
+    if perm == list(range(len(members))):
+        return data
+
+    sizes = [len(ax['members']) for ax in data['axes'][1:]]
+    values = flat_values(data).reshape(
+        tuple(reversed(sizes)) + (len(members), ))[..., perm]
+
+    axes = [dict(data['axes'][0], members=[members[i] for i in perm])]
+    keep = [np.arange(size) for size in sizes]
+    if nonempty and values.size > 0:
+        notnull = pd.notnull(values).any(axis=-1)
+        ndim = len(sizes)
+        # the response nests the last axis outermost
+        keep = [
+            np.flatnonzero(notnull.any(
+                axis=tuple(d for d in range(ndim) if d != ndim - 1 - j)))
+            for j in range(ndim)
+        ]
+        values = values[np.ix_(*reversed(keep))] if ndim > 0 else values
+    for ax, kept in zip(data['axes'][1:], keep):
+        axes.append(dict(ax, members=[ax['members'][i] for i in kept]))
+
+    return dict(data, axes=axes, values=values.tolist())
+
+
+class MeasureBatcher(object):
+    """
+    Gathers the calls for a key made within `window` seconds of the first
+    one into a single call for the union of their measures. Safe to share
+    between threads.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self._batches = {}  # key -> (measures, Future)
+        self._lock = threading.Lock()
+
+    def do(self, key, measures, fetch):
+        """
+        Return `(fetch(union), union)`, where `union` holds `measures` and
+        those of the other calls for `key` gathered with this one (in the
+        order they were first asked for).
+        """
+        with self._lock:
+            batch = self._batches.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._batches[key] = (list(measures), Future())
+            else:
+                batch[0].extend(m for m in measures if m not in batch[0])
+        if not leader:
+            return batch[1].result()
+
+        time.sleep(self.window)
+        with self._lock:
+            del self._batches[key]
+
+        union, future = batch
+        try:
+            result = fetch(union), union
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        future.set_result(result)
+        return result
+
+
+class AsyncMeasureBatcher(object):
+    """ Like `MeasureBatcher`, for the coroutines of one event loop. The
+        call is shielded: cancelling one of its callers doesn't cancel it
+        for the others. """
+
+    def __init__(self, window):
+        self.window = window
+        self._batches = {}  # key -> (measures, Task)
+
+    async def do(self, key, measures, fetch):
+        """ Return `(await fetch(union), union)`, like
+            `MeasureBatcher.do` """
+        batch = self._batches.get(key)
+        if batch is not None:
+            batch[0].extend(m for m in measures if m not in batch[0])
+        else:
+            union = list(measures)
+            batch = self._batches[key] = (
+                union, asyncio.ensure_future(self._run(key, union, fetch)))
+        return await asyncio.shield(batch[1])
+
+    async def _run(self, key, union, fetch):
+        try:
+            await asyncio.sleep(self.window)
+        finally:
+            del self._batches[key]
+        return await fetch(union), union
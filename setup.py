@@ -9,5 +9,8 @@ setup(
     author_email='manuel@jazzido.com',
     license='MIT',
     packages=['mondrian_rest'],
+    python_requires='>=3.7',
     install_requires=['numpy', 'pandas', 'requests'],
+    extras_require={'async': ['httpx'], 'arrow': ['pyarrow'],
+                    'speedups': ['orjson', 'brotli', 'zstandard']},
     zip_safe=False)